@@ -29,6 +29,13 @@ _RESULT_INTERRUPT_STATUS = const(0x13)
 _RESULT_RANGE_STATUS = const(0x14)
 _OSC_CALIBRATE = const(0xf8)
 _MEASURE_PERIOD = const(0x04)
+_RESULT_RANGE_MM = const(0x1e)
+
+# Interrupt status through the range result, read in one burst by poll_range()
+_RESULT_BURST_LEN = const(_RESULT_RANGE_MM + 2 - _RESULT_INTERRUPT_STATUS)
+
+# Written to _INTERRUPT_CLEAR to acknowledge a measurement
+_CLEAR = b'\x01'
 
 SYSRANGE_START = 0x00
 
@@ -113,18 +120,35 @@ ALGO_PHASECAL_LIM = 0x30
 ALGO_PHASECAL_CONFIG_TIMEOUT = 0x30
 
 
+## Shortest timing budget the sensor supports, in us
+MIN_TIMING_BUDGET_US = 20000
+
+# Fixed per sequence step overheads used to work out the timing budget, in us
+_START_OVERHEAD = 1910
+_END_OVERHEAD = 960
+_MSRC_OVERHEAD = 660
+_TCC_OVERHEAD = 590
+_DSS_OVERHEAD = 690
+_PRE_RANGE_OVERHEAD = 660
+_FINAL_RANGE_OVERHEAD = 550
+
+
 class TimeoutError(RuntimeError):
     pass
 
 
 class VL53L0X:
-    def __init__(self, i2c, address=0x29):
+    def __init__(self, i2c, address=0x29, cal=None):
+        """ Initialize the sensor
+
+        @param i2c I2C bus the sensor is on
+        @param address I2C address of the sensor
+        @param cal calibration from a previous boot's cal attribute, which skips
+               reading the SPAD info and running the reference calibrations """
         self.i2c = i2c
         self.address = address
-        self.init()
         self._started = False
         self.measurement_timing_budget_us = 0
-        self.set_measurement_timing_budget(self.measurement_timing_budget_us)
         self.enables = {"tcc": 0,
                         "dss": 0,
                         "msrc": 0,
@@ -141,6 +165,18 @@ class VL53L0X:
                          }
         self.vcsel_period_type = ["VcselPeriodPreRange", "VcselPeriodFinalRange"]
 
+        # Preallocated buffers so polling and reading results don't allocate
+        self._status_buf = bytearray(1)
+        self._range_buf = bytearray(2)
+        self._burst_buf = bytearray(_RESULT_BURST_LEN)
+
+        ## (spad_count, is_aperture, vhv_settings, phase_cal) found while booting
+        self.cal = None
+        ## Time in ms spent in each stage of init(), as (stage, ms) pairs
+        self.boot_ms = ()
+
+        self.init(cal=cal)
+
     def _registers(self, register, values=None, struct='B'):
         if values is None:
             size = ustruct.calcsize(struct)
@@ -167,10 +203,49 @@ class VL53L0X:
         self._register(register, data)
 
     def _config(self, *config):
-        for register, value in config:
-            self._register(register, value)
+        # Runs of consecutive registers go out as a single auto-incrementing
+        # write rather than one transaction per register
+        i = 0
+        n = len(config)
+        while i < n:
+            start = config[i][0]
+            j = i + 1
+            while j < n and config[j][0] == start + j - i:
+                j += 1
+            if j - i == 1:
+                self._register(start, config[i][1])
+            else:
+                self.i2c.writeto_mem(self.address, start, bytes([value for _, value in config[i:j]]))
+            i = j
+
+    def _ref_calibration(self, vhv=None, phase=None):
+        """ Read the VHV and phase reference calibration results, or write
+        previously measured ones back when vhv and phase are given """
+        self._config(
+            (0xff, 0x01),
+            (0x00, 0x00),
+            (0xff, 0x00),
+        )
+        if vhv is None:
+            vhv = self._register(0xcb)
+            phase = self._register(0xee) & 0xef
+        else:
+            self._register(0xcb, vhv)
+            self._register(0xee, (self._register(0xee) & 0x80) | phase)
+        self._config(
+            (0xff, 0x01),
+            (0x00, 0x01),
+            (0xff, 0x00),
+        )
+        return vhv, phase
+
+    def init(self, power2v8=True, cal=None):
+        t_start = utime.ticks_ms()
+
+        # A stored calibration only applies to a VL53L0X
+        if cal is not None and self._register(IDENTIFICATION_MODEL_ID) != 0xee:
+            cal = None
 
-    def init(self, power2v8=True):
         self._flag(_EXTSUP_HV, 0, power2v8)
 
         # I2C standard mode
@@ -198,7 +273,13 @@ class VL53L0X:
 
         self._register(_SYSTEM_SEQUENCE, 0xff)
 
-        spad_count, is_aperture = self._spad_info()
+        t_spad = utime.ticks_ms()
+        if cal is None:
+            spad_count, is_aperture = self._spad_info()
+        else:
+            spad_count, is_aperture = cal[0], cal[1]
+        t_config = utime.ticks_ms()
+
         spad_map = bytearray(self._registers(_SPAD_ENABLES, struct='6B'))
 
         # set reference spads
@@ -319,17 +400,30 @@ class VL53L0X:
         self._flag(_GPIO_MUX_ACTIVE_HIGH, 4, False)
         self._register(_INTERRUPT_CLEAR, 0x01)
 
-        # XXX Need to implement this.
-        # budget = self._timing_budget()
-        # self._register(_SYSTEM_SEQUENCE, 0xe8)
-        # self._timing_budget(budget)
-
-        self._register(_SYSTEM_SEQUENCE, 0x01)
-        self._calibrate(0x40)
-        self._register(_SYSTEM_SEQUENCE, 0x02)
-        self._calibrate(0x00)
+        # Changing the enabled sequence steps changes the timing, so restore
+        # the default budget once the final sequence is set
+        budget = self.get_measurement_timing_budget()
+        self._register(_SYSTEM_SEQUENCE, 0xe8)
+        self.set_measurement_timing_budget(budget)
+
+        t_cal = utime.ticks_ms()
+        if cal is None:
+            self._register(_SYSTEM_SEQUENCE, 0x01)
+            self._calibrate(0x40)
+            self._register(_SYSTEM_SEQUENCE, 0x02)
+            self._calibrate(0x00)
+            vhv, phase = self._ref_calibration()
+        else:
+            vhv, phase = self._ref_calibration(cal[2], cal[3])
 
         self._register(_SYSTEM_SEQUENCE, 0xe8)
+        t_end = utime.ticks_ms()
+
+        self.cal = (spad_count, is_aperture, vhv, phase)
+        self.boot_ms = (('setup', utime.ticks_diff(t_spad, t_start)),
+                        ('spad', utime.ticks_diff(t_config, t_spad)),
+                        ('config', utime.ticks_diff(t_cal, t_config)),
+                        ('calibrate', utime.ticks_diff(t_end, t_cal)))
 
     def _spad_info(self):
         self._config(
@@ -397,10 +491,7 @@ class VL53L0X:
             (0x80, 0x00),
         )
         if period:
-            oscilator = self._register(_OSC_CALIBRATE, struct='>H')
-            if oscilator:
-                period *= oscilator
-            self._register(_MEASURE_PERIOD, period, struct='>H')
+            self.set_inter_measurement_period(period)
             self._register(_SYSRANGE_START, 0x04)
         else:
             self._register(_SYSRANGE_START, 0x02)
@@ -436,14 +527,57 @@ class VL53L0X:
             else:
                 raise TimeoutError()
         for timeout in range(_IO_TIMEOUT):
-            if self._register(_RESULT_INTERRUPT_STATUS) & 0x07:
+            if self.poll():
                 break
             utime.sleep_ms(1)
         else:
             raise TimeoutError()
-        value = self._register(_RESULT_RANGE_STATUS + 10, struct='>H')
-        self._register(_INTERRUPT_CLEAR, 0x01)
-        return value
+        return self.result()
+
+    def poll(self):
+        """ Check once whether a measurement is ready, without waiting.
+        Costs a single one byte register read and doesn't allocate. """
+        self.i2c.readfrom_mem_into(self.address, _RESULT_INTERRUPT_STATUS, self._status_buf)
+        return bool(self._status_buf[0] & 0x07)
+
+    def result(self):
+        """ Read the range in mm of a measurement poll() reported ready, and
+        clear the interrupt so the next measurement can be reported """
+        buf = self._range_buf
+        self.i2c.readfrom_mem_into(self.address, _RESULT_RANGE_MM, buf)
+        self.i2c.writeto_mem(self.address, _INTERRUPT_CLEAR, _CLEAR)
+        return (buf[0] << 8) | buf[1]
+
+    def poll_range(self):
+        """ Read the interrupt status and range result registers in a single
+        burst, clearing the interrupt if a measurement was ready. This takes one
+        transaction instead of two, but moves more bytes than poll(), so it pays
+        off when the caller expects a measurement to be ready, e.g. when polling
+        at about the sensor's own measurement rate.
+
+        @return range in mm, or -1 if no measurement was ready """
+        buf = self._burst_buf
+        self.i2c.readfrom_mem_into(self.address, _RESULT_INTERRUPT_STATUS, buf)
+        if not buf[0] & 0x07:
+            return -1
+        self.i2c.writeto_mem(self.address, _INTERRUPT_CLEAR, _CLEAR)
+        return (buf[_RESULT_BURST_LEN - 2] << 8) | buf[_RESULT_BURST_LEN - 1]
+
+    def ranging(self):
+        """ Generator for use with yield from inside a task. Yields None while
+        the measurement is pending and returns the range in mm once it's ready.
+        The sensor must already be running with start(). """
+        while not self.poll():
+            yield None
+        return self.result()
+
+    def set_inter_measurement_period(self, period_ms):
+        """ Set the time between the start of measurements in continuous timed
+        mode. Takes effect the next time ranging is started with start(period). """
+        oscilator = self._register(_OSC_CALIBRATE, struct='>H')
+        if oscilator:
+            period_ms *= oscilator
+        self._register(_MEASURE_PERIOD, period_ms, struct='>I')
 
     def set_signal_rate_limit(self, limit_Mcps):
         if limit_Mcps < 0 or limit_Mcps > 511.99:
@@ -480,7 +614,7 @@ class VL53L0X:
 
             new_pre_range_timeout_mclks = self.timeout_microseconds_to_Mclks(self.timeouts["pre_range_us"],
                                                                              period_pclks)
-            self._register(PRE_RANGE_CONFIG_TIMEOUT_MACROP_HI, self.encode_timeout(new_pre_range_timeout_mclks))
+            self._register(PRE_RANGE_CONFIG_TIMEOUT_MACROP_HI, self.encode_timeout(new_pre_range_timeout_mclks), struct='>H')
 
             new_msrc_timeout_mclks = self.timeout_microseconds_to_Mclks(self.timeouts["msrc_dss_tcc_us"],
                                                                         period_pclks)
@@ -527,7 +661,7 @@ class VL53L0X:
 
             if self.enables["pre_range"]:
                 new_final_range_timeout_mclks += 1
-            self._register(FINAL_RANGE_CONFIG_TIMEOUT_MACROP_HI, self.encode_timeout(new_final_range_timeout_mclks))
+            self._register(FINAL_RANGE_CONFIG_TIMEOUT_MACROP_HI, self.encode_timeout(new_final_range_timeout_mclks), struct='>H')
         else:
             return False
         self.set_measurement_timing_budget(self.measurement_timing_budget_us)
@@ -549,9 +683,9 @@ class VL53L0X:
 
     def get_vcsel_pulse_period(self, type):
         if type == self.vcsel_period_type[0]:
-            return self.decode_Vcsel_period(0x50)
+            return self.decode_Vcsel_period(self._register(PRE_RANGE_CONFIG_VCSEL_PERIOD))
         elif type == self.vcsel_period_type[1]:
-            return self.decode_Vcsel_period(0x70)
+            return self.decode_Vcsel_period(self._register(FINAL_RANGE_CONFIG_VCSEL_PERIOD))
         else:
             return 255
 
@@ -561,12 +695,12 @@ class VL53L0X:
         self.timeouts["msrc_dss_tcc_us"] = self.timeout_Mclks_to_microseconds(self.timeouts["msrc_dss_tcc_mclks"],
                                                                               self.timeouts[
                                                                                   "pre_range_vcsel_period_pclks"])
-        self.timeouts["pre_range_mclks"] = self.decode_timeout(PRE_RANGE_CONFIG_TIMEOUT_MACROP_HI)
+        self.timeouts["pre_range_mclks"] = self.decode_timeout(self._register(PRE_RANGE_CONFIG_TIMEOUT_MACROP_HI, struct='>H'))
         self.timeouts["pre_range_us"] = self.timeout_Mclks_to_microseconds(self.timeouts["pre_range_mclks"],
                                                                            self.timeouts[
                                                                                "pre_range_vcsel_period_pclks"])
         self.timeouts["final_range_vcsel_period_pclks"] = self.get_vcsel_pulse_period(self.vcsel_period_type[1])
-        self.timeouts["final_range_mclks"] = self.decode_timeout(self._register(FINAL_RANGE_CONFIG_TIMEOUT_MACROP_HI))
+        self.timeouts["final_range_mclks"] = self.decode_timeout(self._register(FINAL_RANGE_CONFIG_TIMEOUT_MACROP_HI, struct='>H'))
 
         if self.enables["pre_range"]:
             self.timeouts["final_range_mclks"] -= self.timeouts["pre_range_mclks"]
@@ -576,14 +710,14 @@ class VL53L0X:
 
     def timeout_Mclks_to_microseconds(self, timeout_period_mclks, vcsel_period_pclks):
         macro_period_ns = self.calc_macro_period(vcsel_period_pclks)
-        return ((timeout_period_mclks * macro_period_ns) + (macro_period_ns / 2)) / 1000
+        return ((timeout_period_mclks * macro_period_ns) + 500) // 1000
 
     def timeout_microseconds_to_Mclks(self, timeout_period_us, vcsel_period_pclks):
         macro_period_ns = self.calc_macro_period(vcsel_period_pclks)
-        return (((timeout_period_us * 1000) + (macro_period_ns / 2)) / macro_period_ns)
+        return (((timeout_period_us * 1000) + (macro_period_ns // 2)) // macro_period_ns)
 
     def calc_macro_period(self, vcsel_period_pclks):
-        return (((2304 * (vcsel_period_pclks) * 1655) + 500) / 1000)
+        return (((2304 * (vcsel_period_pclks) * 1655) + 500) // 1000)
 
     def decode_timeout(self, reg_val):
         return ((reg_val & 0x00FF) << ((reg_val & 0xFF00) >> 8)) + 1
@@ -599,38 +733,48 @@ class VL53L0X:
             while (ls_byte & 0xFFFFFF00) > 0:
                 ls_byte >>= 1
                 ms_byte += 1
-            return (ms_byte << 8) or (ls_byte & 0xFF)
+            return (ms_byte << 8) | (ls_byte & 0xFF)
         else:
             return 0
 
-    def set_measurement_timing_budget(self, budget_us):
-        start_overhead = 1320
-        end_overhead = 960
-        msrc_overhead = 660
-        tcc_overhead = 590
-        dss_overhead = 690
-        pre_range_overhead = 660
-        final_range_overhead = 550
-
-        min_timing_budget = 20000
-
-        if budget_us < min_timing_budget:
-            return False
-        used_budget_us = start_overhead + end_overhead
-
+    def _used_budget_us(self):
+        """ Time in us taken by every enabled sequence step except the final range """
         self.get_sequence_step_enables()
         self.get_sequence_step_timeouts()
 
+        used_budget_us = _START_OVERHEAD + _END_OVERHEAD
         if self.enables["tcc"]:
-            used_budget_us += self.timeouts["msrc_dss_tcc_us"] + tcc_overhead
+            used_budget_us += self.timeouts["msrc_dss_tcc_us"] + _TCC_OVERHEAD
         if self.enables["dss"]:
-            used_budget_us += 2* self.timeouts["msrc_dss_tcc_us"] + dss_overhead
-        if self.enables["msrc"]:
-            used_budget_us += self.timeouts["msrc_dss_tcc_us"] + msrc_overhead
+            used_budget_us += 2*(self.timeouts["msrc_dss_tcc_us"] + _DSS_OVERHEAD)
+        elif self.enables["msrc"]:
+            used_budget_us += self.timeouts["msrc_dss_tcc_us"] + _MSRC_OVERHEAD
         if self.enables["pre_range"]:
-            used_budget_us += self.timeouts["pre_range_us"] + pre_range_overhead
+            used_budget_us += self.timeouts["pre_range_us"] + _PRE_RANGE_OVERHEAD
+        return used_budget_us
+
+    def get_measurement_timing_budget(self):
+        """ Time in us the sensor is currently configured to take per measurement """
+        budget_us = self._used_budget_us()
+        if self.enables["final_range"]:
+            budget_us += self.timeouts["final_range_us"] + _FINAL_RANGE_OVERHEAD
+        self.measurement_timing_budget_us = budget_us
+        return budget_us
+
+    def set_measurement_timing_budget(self, budget_us):
+        """ Set the time allowed for a measurement. Longer budgets give more
+        accurate readings, shorter ones a faster update rate. The sensor should
+        be stopped while the budget is changed.
+
+        @param budget_us timing budget in us, from MIN_TIMING_BUDGET_US (20 ms,
+               fast mode) up to around 200 ms for high accuracy
+        @return True if the budget was applied """
+        if budget_us < MIN_TIMING_BUDGET_US:
+            return False
+
+        used_budget_us = self._used_budget_us()
         if self.enables["final_range"]:
-            used_budget_us += final_range_overhead
+            used_budget_us += _FINAL_RANGE_OVERHEAD
 
             if used_budget_us > budget_us:
                 return False
@@ -639,7 +783,7 @@ class VL53L0X:
 
             if self.enables["pre_range"]:
                 final_range_timeout_mclks += self.timeouts["pre_range_mclks"]
-            self._register(FINAL_RANGE_CONFIG_TIMEOUT_MACROP_HI, self.encode_timeout(final_range_timeout_mclks))
+            self._register(FINAL_RANGE_CONFIG_TIMEOUT_MACROP_HI, self.encode_timeout(final_range_timeout_mclks), struct='>H')
             self.measurement_timing_budget_us = budget_us
         return True
 
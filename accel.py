@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file accel.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Driver for the MMA8451Q accelerometer on I2C Bus 1, used to tell when the
+# SUMO bot has been hit, is being pushed, or is being tipped over.
+#
+# The accelerometer buffers samples in its internal FIFO. Once per task run
+# the FIFO is drained with one burst read into a preallocated buffer, instead
+# of a transaction per sample, and each sample is checked with integer math
+# only. Events found since the last run are published to AccelFlags.
+
+import task_share
+import i2c
+
+## Default I2C address, with the SA0 pin pulled high
+ADDRESS = 0x1d
+
+_F_STATUS = 0x00
+_OUT_X_MSB = 0x01
+_F_SETUP = 0x09
+_WHO_AM_I = 0x0d
+_XYZ_DATA_CFG = 0x0e
+_CTRL_REG1 = 0x2a
+_CTRL_REG2 = 0x2b
+
+_WHO_AM_I_MMA8451 = 0x1a
+_FIFO_SIZE = 32
+
+## Counts per g in the +/-4 g range we run in
+COUNTS_PER_G = 2048
+
+## Change in horizontal acceleration between samples which counts as a hit, in counts
+IMPACT_THRESH = COUNTS_PER_G // 2
+
+## Horizontal acceleration which counts as being pushed, in counts
+PUSH_THRESH = COUNTS_PER_G // 4
+
+## Consecutive samples above PUSH_THRESH before we're considered pushed
+PUSH_SAMPLES = 10
+
+## Vertical acceleration below which the bot is tilted, in counts (about 35 degrees)
+TILT_THRESH = COUNTS_PER_G*4 // 5
+
+## Bits in AccelFlags
+IMPACT = 0x01
+PUSH = 0x02
+TILT = 0x04
+
+class MMA8451:
+    """ MMA8451Q accelerometer running from its FIFO """
+
+    def __init__(self, bus, address=ADDRESS):
+        """ Configure the accelerometer for +/-4 g at 200 Hz with the FIFO in
+        circular mode and start it sampling
+
+        @param bus i2c_bus.Bus the accelerometer is on
+        @param address I2C address of the accelerometer """
+        self.bus = bus
+        self.address = address
+
+        # Room for a full FIFO, and views sized for every possible sample count
+        # so draining the FIFO reads exactly what's there without allocating
+        self._buf = bytearray(6*_FIFO_SIZE)
+        mv = memoryview(self._buf)
+        self._views = [mv[:6*n] for n in range(_FIFO_SIZE + 1)]
+        self._status = bytearray(1)
+
+        self.flags = 0
+        self._last_x = 0
+        self._last_y = 0
+        self._push_count = 0
+
+        ## Total samples read from the FIFO
+        self.samples = 0
+        ## Number of times the FIFO overflowed before it was drained
+        self.overflows = 0
+
+        if bus.readfrom_mem(address, _WHO_AM_I, 1)[0] != _WHO_AM_I_MMA8451:
+            raise OSError('MMA8451 not found')
+
+        # Registers can only be changed in standby
+        bus.writeto_mem(address, _CTRL_REG1, b'\x00')
+        bus.writeto_mem(address, _XYZ_DATA_CFG, b'\x01')
+        bus.writeto_mem(address, _CTRL_REG2, b'\x02')
+        bus.writeto_mem(address, _F_SETUP, b'\x40')
+        # 200 Hz data rate, active
+        bus.writeto_mem(address, _CTRL_REG1, b'\x11')
+
+    def drain(self):
+        """ Read every sample waiting in the FIFO and check it for events
+
+        @return bitmask of IMPACT, PUSH and TILT events seen in the samples """
+        self.bus.readfrom_mem_into(self.address, _F_STATUS, self._status)
+        status = self._status[0]
+        count = status & 0x3f
+        if status & 0x80:
+            self.overflows += 1
+        if count == 0:
+            return 0
+        self.bus.readfrom_mem_into(self.address, _OUT_X_MSB, self._views[count])
+        self.samples += count
+
+        buf = self._buf
+        flags = 0
+        last_x = self._last_x
+        last_y = self._last_y
+        for i in range(0, 6*count, 6):
+            x = ((buf[i] << 8) | buf[i + 1]) >> 2
+            y = ((buf[i + 2] << 8) | buf[i + 3]) >> 2
+            z = ((buf[i + 4] << 8) | buf[i + 5]) >> 2
+            if x & 0x2000:
+                x -= 0x4000
+            if y & 0x2000:
+                y -= 0x4000
+            if z & 0x2000:
+                z -= 0x4000
+
+            if abs(x - last_x) + abs(y - last_y) > IMPACT_THRESH:
+                flags |= IMPACT
+            if abs(x) + abs(y) > PUSH_THRESH:
+                self._push_count += 1
+                if self._push_count >= PUSH_SAMPLES:
+                    flags |= PUSH
+            else:
+                self._push_count = 0
+            if z < TILT_THRESH:
+                flags |= TILT
+            last_x = x
+            last_y = y
+
+        self._last_x = last_x
+        self._last_y = last_y
+        return flags
+
+def handler():
+    """ Task which drains the accelerometer FIFO and publishes events. Does
+    nothing if the accelerometer wasn't found. """
+    while True:
+        yield(0)
+        if Accel is None:
+            continue
+        yield from i2c.Bus1.acquire(Accel)
+        try:
+            AccelFlags.put(Accel.drain())
+        finally:
+            i2c.Bus1.release(Accel)
+
+## SUMO Bot accelerometer, or None if it didn't answer
+try:
+    Accel = MMA8451(i2c.Bus1)
+except OSError:
+    Accel = None
+    print('[ACCEL] MMA8451 not found, running without hit detection')
+
+## Accelerometer events seen in the last task run, a bitmask of IMPACT, PUSH and TILT
+AccelFlags = task_share.Share('B', thread_protect = False, name = 'Accel Flags')
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file bearing_lut.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Calibrated opponent bearing and range lookup table for the three TOF sensors.
+#
+# Each (left, center, right) distance is quantized to one of LEVELS levels, and
+# the three levels index a table of the bearing and range measured when the
+# opponent was placed at known positions around the bot. At runtime a lookup is
+# three shifts and a table read instead of the weighted bearing formula, and
+# it accounts for how the sensors are actually mounted.
+#
+# To calibrate, create a Calibrator, put the opponent at known positions and add
+# the TOF readings for each with add() (tof.calibrate_point() does this on the
+# robot), then build() the table and save() it to flash. Readings taken with no
+# opponent in front of the bot, only walls or people past the ring, are added
+# with a bearing of None, and the table reports no opponent for them and for
+# every combination of readings closer to them than to any opponent position.
+#
+# Bearings in the table are true degrees. tof converts them to the weighted
+# formula's scale with DEG_PER_UNIT. The formula itself, dists_to_ang(), lives
+# here too rather than in tof, which sets up the sensors when it is imported,
+# so that the host simulator and replayer compute bearings the same way.
+
+import array
+
+## Quantization levels per sensor, level 0 meaning nothing was detected
+LEVELS = 8
+
+## Bits per sensor in a table index
+_BITS = 3
+
+## Distances are quantized in steps of 2^SHIFT mm
+SHIFT = 7
+
+## Readings beyond this many mm count as nothing detected, the same range limit
+# tof.TOF applies to its dist
+MAX_RANGE = 1000
+
+## True degrees per unit of the weighted bearing formula's -20 to 20 scale, fit
+# to the sensors' 20 degree spacing and 25 degree fields of view
+DEG_PER_UNIT = 1.5
+
+## Bearing entry meaning there is no opponent for this combination of readings
+NONE = -128
+
+## File the table is stored in on the board's flash
+LUT_FILE = 'bearing_lut.bin'
+
+_SIZE = 1 << (3*_BITS)
+
+def quantize(dist):
+    """ Quantize a raw distance in mm to a level from 0 to LEVELS - 1 """
+    if dist == 0 or dist > MAX_RANGE:
+        return 0
+    q = (dist >> SHIFT) + 1
+    return q if q < LEVELS else LEVELS - 1
+
+def index(l, c, r):
+    """ Table index for raw (left, center, right) distances in mm """
+    return (quantize(l) << (2*_BITS)) | (quantize(c) << _BITS) | quantize(r)
+
+def dists_to_ang(l, c, r):
+    """ Bearing to the opponent from raw (left, center, right) distances in mm
+    by the weighted formula, -20 to 20 positive to the right, or None if
+    nothing is in range. Used when there is no calibrated table. """
+    l = 0 if l > MAX_RANGE else l
+    c = 0 if c > MAX_RANGE else c
+    r = 0 if r > MAX_RANGE else r
+    sum = l + c + r
+
+    if sum == 0:
+        return None
+
+    return -20*(l/sum) + 20*(r/sum)
+
+def dists_to_range(l, c, r):
+    """ Distance in mm to the closest thing in range from raw (left, center,
+    right) distances in mm, or 0 if nothing is in range """
+    closest = 0
+    for d in (l, c, r):
+        if d and d <= MAX_RANGE and (closest == 0 or d < closest):
+            closest = d
+    return closest
+
+def ang_to_vec(ang):
+    """ Opponent bearing from dists_to_ang() as the -1 to 1 direction strategy
+    steers by, or None """
+    if ang is None:
+        return None
+    return ang/20.0
+
+def measure(lut, l, c, r):
+    """ Opponent (bearing, range in mm) from raw (left, center, right)
+    distances in mm, from a table if there is one and the weighted formula if
+    not. The bearing is on the formula's scale either way, or None if there is
+    no opponent. """
+    if lut is not None:
+        deg = lut.lookup(l, c, r)
+        return None if deg is None else deg/DEG_PER_UNIT, lut.range_mm(l, c, r)
+    return dists_to_ang(l, c, r), dists_to_range(l, c, r)
+
+class BearingLut:
+    """ Lookup table from quantized TOF readings to opponent bearing and range """
+
+    def __init__(self, bearings=None, ranges=None):
+        """ @param bearings array('b') of bearings in degrees, NONE for no opponent
+            @param ranges bytearray of ranges in cm """
+        self.bearings = bearings if bearings is not None else array.array('b', [NONE]*_SIZE)
+        self.ranges = ranges if ranges is not None else bytearray(_SIZE)
+
+    def lookup(self, l, c, r):
+        """ Bearing in true degrees for raw (left, center, right) distances in
+        mm, positive to the right, or None if there is no opponent """
+        b = self.bearings[index(l, c, r)]
+        return None if b == NONE else b
+
+    def range_mm(self, l, c, r):
+        """ Range in mm for raw (left, center, right) distances, 0 if no opponent """
+        i = index(l, c, r)
+        return 0 if self.bearings[i] == NONE else self.ranges[i]*10
+
+    def save(self, path=LUT_FILE):
+        with open(path, 'wb') as f:
+            f.write(self.bearings)
+            f.write(self.ranges)
+
+def load(path=LUT_FILE):
+    """ Load a table written by BearingLut.save()
+
+    @return BearingLut, or None if no valid table is stored """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) != 2*_SIZE:
+        return None
+    return BearingLut(array.array('b', data[:_SIZE]), bytearray(data[_SIZE:]))
+
+class Calibrator:
+    """ Collects TOF readings at known opponent positions and builds a BearingLut """
+
+    def __init__(self):
+        # Sums of [bearing, range, count, empty count] for each table index seen
+        self._cells = {}
+
+    def add(self, l, c, r, bearing, range_mm=0):
+        """ Record one reading
+
+        @param l, c, r raw distances from the left, center and right sensors in mm
+        @param bearing true bearing of the opponent in degrees, positive to the
+               right, or None if no opponent was in front of the sensors
+        @param range_mm true distance to the opponent in mm """
+        i = index(l, c, r)
+        if i == 0:
+            return
+        cell = self._cells.get(i)
+        if cell is None:
+            cell = self._cells[i] = [0.0, 0.0, 0, 0]
+        if bearing is None:
+            cell[3] += 1
+            return
+        cell[0] += bearing
+        cell[1] += range_mm
+        cell[2] += 1
+
+    def build(self):
+        """ Average the readings for each index and fill indices which were never
+        seen from the nearest one that was, by distance between quantized levels.
+        Indices whose readings were mostly taken with no opponent, or whose
+        nearest seen index was, are left as NONE.
+
+        @return BearingLut """
+        lut = BearingLut()
+        if not self._cells:
+            return lut
+        mask = LEVELS - 1
+        seen = [(i >> (2*_BITS), (i >> _BITS) & mask, i & mask, cell)
+                for i, cell in self._cells.items()]
+
+        for i in range(1, _SIZE):
+            ql = i >> (2*_BITS)
+            qc = (i >> _BITS) & mask
+            qr = i & mask
+            best = None
+            best_d = None
+            for sl, sc, sr, cell in seen:
+                d = abs(sl - ql) + abs(sc - qc) + abs(sr - qr)
+                if best_d is None or d < best_d:
+                    best = cell
+                    best_d = d
+            if best[3] >= best[2]:
+                continue
+            bearing = int(round(best[0]/best[2]))
+            lut.bearings[i] = max(-127, min(127, bearing))
+            lut.ranges[i] = min(255, int(best[1]/best[2]/10))
+        return lut
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file dashboard.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Live terminal dashboard for the robot's telemetry stream (see telemetry.py).
+#
+# Shows each task's run time and lateness averaged over the last WINDOW task
+# frames, both wheels' velocity against their setpoints, and the strategy's
+# state and recent transitions. The stream is decoded as fast as it arrives and
+# the screen is only redrawn at the refresh rate, so a slow terminal never
+# holds up decoding. A capture saved with telemetry_host.py --raw can be played
+# back in real time, faster, or all at once.
+#
+# The task counters from the robot are totals since boot, so the dashboard
+# works from the difference between consecutive task frames. The window counts
+# frames rather than time, so it behaves the same live and when a capture is
+# played back at any speed. It also notes the robot's time whenever a task's
+# slowest run or latest start grows, which is when it overran. --report writes a
+# per-task latency report as CSV, and with --no-display nothing is drawn and
+# captures are read as fast as possible, for scripting.
+#
+# Run with:
+#   python dashboard.py /dev/ttyACM0 --report latency.csv
+#   python dashboard.py run.bin --speed 2                   (a saved capture)
+#   python dashboard.py run.bin --no-display --report latency.csv
+
+import host_shims
+host_shims.install()
+
+import argparse
+import collections
+import sys
+import time
+
+import telemetry
+import telemetry_host
+
+## Task frames in the rolling window for task statistics, about 2 s at the
+# robot's telemetry rate
+WINDOW = 50
+
+## Wheel velocity samples kept for the sparklines
+HISTORY = 60
+
+## Transitions shown for the strategy
+TRANSITIONS = 6
+
+## Report columns, one row per task
+REPORT_COLUMNS = ('task', 'runs', 'mean_run_us', 'max_run_us', 'mean_late_us', 'max_late_us',
+                  'worst_window_late_us', 'worst_window_ms', 'overruns', 'last_overrun_ms')
+
+_SPARKS = ' ▁▂▃▄▅▆▇█'
+
+class TaskStats:
+    """ Rolling and whole session statistics for one task """
+
+    def __init__(self, name):
+        self.name = name
+        # Counters from the previous task frame
+        self._prev = None
+        # (runs, run_us, late_us) since the previous task frame, for the last WINDOW frames
+        self._window = collections.deque()
+        self._win_runs = 0
+        self._win_run_us = 0
+        self._win_late_us = 0
+
+        ## Totals since the first task frame
+        self.runs = 0
+        self.run_us = 0
+        self.late_us = 0
+        ## Slowest run and latest start since boot, in us
+        self.slowest_us = 0
+        self.latest_us = 0
+        ## Robot times in ms when the slowest run or latest start grew
+        self.overruns = []
+        ## Highest rolling average lateness in us and the robot time it was seen at
+        self.worst_late_us = 0
+        self.worst_ms = None
+
+    def update(self, time_ms, counts):
+        """ Add a task frame's counters
+
+        @param counts (runs, run_sum_us, late_sum_us, slowest_us, latest_us) """
+        runs, run_sum, late_sum, slowest, latest = counts
+        prev = self._prev
+        self._prev = counts
+        if prev is None:
+            self.slowest_us = slowest
+            self.latest_us = latest
+            return
+        if runs < prev[0]:
+            # The robot restarted and the counters went back to zero
+            self._window.clear()
+            self._win_runs = self._win_run_us = self._win_late_us = 0
+            self.slowest_us = slowest
+            self.latest_us = latest
+            return
+
+        d = (runs - prev[0], run_sum - prev[1], late_sum - prev[2])
+        self._window.append(d)
+        self._win_runs += d[0]
+        self._win_run_us += d[1]
+        self._win_late_us += d[2]
+        if len(self._window) > WINDOW:
+            old = self._window.popleft()
+            self._win_runs -= old[0]
+            self._win_run_us -= old[1]
+            self._win_late_us -= old[2]
+
+        self.runs += d[0]
+        self.run_us += d[1]
+        self.late_us += d[2]
+        if slowest > self.slowest_us or latest > self.latest_us:
+            self.overruns.append(time_ms)
+        self.slowest_us = slowest
+        self.latest_us = latest
+
+        late = self.window_late_us()
+        if late > self.worst_late_us:
+            self.worst_late_us = late
+            self.worst_ms = time_ms
+
+    def window_run_us(self):
+        return self._win_run_us/self._win_runs if self._win_runs else 0.0
+
+    def window_late_us(self):
+        return self._win_late_us/self._win_runs if self._win_runs else 0.0
+
+    def report_row(self):
+        return (self.name, self.runs, self.run_us/self.runs if self.runs else 0.0, self.slowest_us,
+                self.late_us/self.runs if self.runs else 0.0, self.latest_us, self.worst_late_us,
+                self.worst_ms, len(self.overruns), self.overruns[-1] if self.overruns else None)
+
+class Dashboard:
+    """ Keeps the state shown on the dashboard up to date from decoded frames """
+
+    def __init__(self):
+        self.dec = telemetry_host.Decoder()
+        ## TaskStats by task number in the task frames
+        self.tasks = []
+        self.control = None
+        self.vel_l = collections.deque(maxlen=HISTORY)
+        self.vel_r = collections.deque(maxlen=HISTORY)
+        ## (time_ms, state name) for recent strategy state changes
+        self.transitions = collections.deque(maxlen=TRANSITIONS)
+        self._state = None
+        self._state_ms = 0
+        self._last_frame = None
+
+    def feed(self, kind, seq, frame):
+        """ Update from one frame returned by telemetry_host.Decoder.feed() """
+        self._last_frame = time.monotonic()
+        if kind == telemetry.FRAME_CONTROL:
+            self.control = frame
+            self.vel_l.append(frame.vel_l)
+            self.vel_r.append(frame.vel_r)
+            if frame.state != self._state:
+                self._state = frame.state
+                self._state_ms = frame.time_ms
+                self.transitions.append((frame.time_ms, self.dec.state_name(frame.state) or '-'))
+        elif kind == telemetry.FRAME_TASKS:
+            time_ms = self.control.time_ms if self.control is not None else 0
+            for i, counts in enumerate(frame):
+                if i == len(self.tasks):
+                    self.tasks.append(TaskStats(str(i)))
+                stats = self.tasks[i]
+                if i < len(self.dec.task_names):
+                    stats.name = self.dec.task_names[i]
+                stats.update(time_ms, counts)
+
+    def render(self):
+        """ The dashboard as a block of text """
+        dec = self.dec
+        c = self.control
+        lines = []
+        stale = '' if self._last_frame is None else \
+            '   last frame {:.1f} s ago'.format(time.monotonic() - self._last_frame)
+        lines.append('time {:8.2f} s   frames {:d}   lost {:d}   console bytes {:d}{:s}'.format(
+            c.time_ms/1000 if c is not None else 0.0, dec.frames, dec.lost, dec.skipped, stale))
+        lines.append('')
+
+        lines.append('{:<18s}{:>8s}{:>10s}{:>10s}{:>10s}{:>10s}{:>9s}'.format('TASK', 'RUNS',
+            'RUN MS', 'MAX MS', 'LATE MS', 'MAX MS', 'OVERRUN'))
+        for t in self.tasks:
+            lines.append('{:<18s}{: 8d}{: 10.3f}{: 10.3f}{: 10.3f}{: 10.3f}{:>9s}'.format(t.name[:17],
+                t.runs, t.window_run_us()/1000, t.slowest_us/1000, t.window_late_us()/1000,
+                t.latest_us/1000, '{:.2f}'.format(t.overruns[-1]/1000) if t.overruns else '-'))
+        lines.append('')
+
+        if c is not None:
+            lines.append('{:<6s}{:>9s}{:>9s}{:>9s}{:>7s}'.format('WHEEL', 'VEL', 'SET', 'ERR', 'DUTY'))
+            for name, vel, sp, duty, hist in (('left', c.vel_l, c.set_l, c.duty_l, self.vel_l),
+                                              ('right', c.vel_r, c.set_r, c.duty_r, self.vel_r)):
+                err = '' if sp is None else '{: 9.3f}'.format(sp - vel)
+                sp = '-' if sp is None else '{:.3f}'.format(sp)
+                lines.append('{:<6s}{: 9.3f}{:>9s}{:>9s}{: 7d}  {:s}'.format(name, vel, sp, err, duty,
+                                                                            _sparkline(hist)))
+            lines.append('')
+
+            bearing = '-' if c.bearing is None else '{:.1f} deg'.format(c.bearing)
+            state = dec.state_name(c.state) or '-'
+            lines.append('strategy {:s}   state {:s} for {:.2f} s   bearing {:s}'.format(
+                dec.strategy or '-', state, (c.time_ms - self._state_ms)/1000, bearing))
+            for time_ms, name in self.transitions:
+                lines.append('  {: 9.2f}  {:s}'.format(time_ms/1000, name))
+        return '\n'.join(lines)
+
+    def write_report(self, path):
+        """ Write the per-task latency report as CSV """
+        with open(path, 'w') as f:
+            f.write(','.join(REPORT_COLUMNS) + '\n')
+            for t in self.tasks:
+                f.write(','.join(_fmt(v) for v in t.report_row()) + '\n')
+
+def _fmt(val):
+    if val is None:
+        return ''
+    if isinstance(val, float):
+        return '{:.1f}'.format(val)
+    return str(val)
+
+def _sparkline(vals):
+    """ One character per value, scaled between the smallest and largest """
+    if not vals:
+        return ''
+    lo = min(vals)
+    hi = max(vals)
+    span = hi - lo
+    if span == 0:
+        return _SPARKS[4]*len(vals)
+    return ''.join(_SPARKS[1 + int((v - lo)/span*(len(_SPARKS) - 2))] for v in vals)
+
+def run(dash, frames, rate=20.0, speed=None, display=True):
+    """ Feed frames to the dashboard, redrawing it at up to rate per second
+
+    @param frames iterator of (kind, seq, frame), e.g. telemetry_host.read_frames(),
+           which may also give None while it waits on a live stream so the
+           dashboard keeps redrawing when nothing arrives
+    @param speed play a capture back at this multiple of real time using the
+           frames' robot times, or None to feed frames as fast as they come
+    @param display draw the dashboard on the terminal """
+    period = 1.0/rate
+    next_draw = 0.0
+    start = None
+
+    def draw():
+        sys.stdout.write('\x1b[H' + dash.render().replace('\n', '\x1b[K\n') + '\x1b[K\x1b[J')
+        sys.stdout.flush()
+
+    if display:
+        sys.stdout.write('\x1b[2J')
+    for item in frames:
+        if item is None:
+            kind = None
+        else:
+            kind, seq, frame = item
+            dash.feed(kind, seq, frame)
+        if speed is not None and kind == telemetry.FRAME_CONTROL:
+            if start is None:
+                start = (time.monotonic(), frame.time_ms)
+            due = start[0] + (frame.time_ms - start[1])/1000.0/speed
+            while True:
+                now = time.monotonic()
+                if now >= due:
+                    break
+                if display and now >= next_draw:
+                    draw()
+                    next_draw = now + period
+                time.sleep(min(due - now, period))
+        if display:
+            now = time.monotonic()
+            if now >= next_draw:
+                draw()
+                next_draw = now + period
+    if display:
+        draw()
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Live dashboard for the robot\'s telemetry stream')
+    parser.add_argument('source', help='serial port, e.g. /dev/ttyACM0 or COM3, or a saved capture')
+    parser.add_argument('--rate', type=float, default=20.0, help='screen updates per second (default 20)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='playback speed for a capture, 0 for as fast as possible (default 1)')
+    parser.add_argument('--seconds', type=float, help='stop reading a serial port after this long')
+    parser.add_argument('--raw', help='also save the raw stream here')
+    parser.add_argument('--report', help='write a per-task latency report CSV here at the end')
+    parser.add_argument('--no-display', action='store_true', help='don\'t draw anything, e.g. for scripts')
+    args = parser.parse_args()
+
+    stream, live = telemetry_host.open_stream(args.source)
+    raw = open(args.raw, 'wb') if args.raw else None
+    dash = Dashboard()
+    # Without a display there's nothing to watch, so captures are read straight through
+    speed = None if live or args.no_display or args.speed <= 0 else args.speed
+    try:
+        run(dash, telemetry_host.read_frames(stream, live, dash.dec, raw, args.seconds, idle=True),
+            args.rate, speed, not args.no_display)
+    except KeyboardInterrupt:
+        pass
+    if raw is not None:
+        raw.close()
+    if args.report:
+        dash.write_report(args.report)
+        print('latency report written to ' + args.report)
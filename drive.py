@@ -6,49 +6,129 @@
 # @author Ethan Czuppa
 #
 # This file contains high level driving control functionality for the SUMO Bot.
+#
+# Drive commands are measured relative to the encoder position they were
+# started at, so the drive task can hand off from one command to the next
+# without stopping the motors or resetting the encoders. Strategy can either
+# replace the active command with change_command() or line up a sequence of
+# movements with queue_command(), which the drive task advances through on its own.
 
 import controller
 import encoder
+import motor_cal
 import motor_driver
 
+## Zero the motors for one drive period and start the new command from rest
+HANDOFF_STOP = 0
+
+## Start the new command straight from the previous one, carrying over
+# controller state where the two commands are compatible
+HANDOFF_CARRY = 1
+
+## Currently executing drive command
 DriveCommand = None
 
+## Commands waiting to run after the current one completes, as (cmd, handoff) pairs
+CommandQueue = []
+
+# Command handed over by change_command(), started on the next drive task run
+_Pending = None
+
+## Number of times the drive task has run, so the match recorder can tell
+# which of its records the drive task ran between
+Runs = 0
+
 class StraightDistance:
+    ## Commands without their own feedforward get deadband compensation from the drive task
+    feedforward = False
+
+    ## Proportional gain in duty cycle percent per encoder tick of error
+    KP = 0.1
+
     def __init__(self, dist_inches, fix_overshoot=False):
         self._dist_ticks = encoder.in_to_ticks(dist_inches)
         self._fix_overshoot = fix_overshoot
         self._distance_remaining_ticks = self._dist_ticks
-        self._cntrl = controller.PControl(0.1, self._dist_ticks)
+        self._cntrl = controller.PControl(self.KP, self._dist_ticks)
+        self._l0 = self._r0 = 0
+
+    def start(self, left_enc, right_enc, prev):
+        """ Record the encoder positions the movement is measured from
+
+        @param left_enc left encoder state when the command starts
+        @param right_enc right encoder state when the command starts
+        @param prev previous drive command, or None if starting from rest """
+        self._l0 = left_enc.ticks
+        self._r0 = right_enc.ticks
 
     def step(self, left_enc, right_enc):
         """ Calculate motor speeds to execute movement """
         left_speed = right_speed = 0
+        left_ticks = left_enc.ticks - self._l0
+        right_ticks = right_enc.ticks - self._r0
 
-        if self._fix_overshoot == True or left_enc.ticks < self._dist_ticks:
-            left_speed = self._cntrl.ploop(left_enc.ticks)
+        if self._fix_overshoot == True or left_ticks < self._dist_ticks:
+            left_speed = self._cntrl.ploop(left_ticks)
 
-        if self._fix_overshoot == True or right_enc.ticks < self._dist_ticks:
-            right_speed = self._cntrl.ploop(right_enc.ticks)
+        if self._fix_overshoot == True or right_ticks < self._dist_ticks:
+            right_speed = self._cntrl.ploop(right_ticks)
 
         return left_speed, right_speed
 
     def dist_remaining_in(self, left_enc, right_enc):
         """ Get distance remaining of movement in inches """
-        left_dist = encoder.ticks_to_in(self._dist_ticks - left_enc.ticks)
-        right_dist = encoder.ticks_to_in(self._dist_ticks - right_enc.ticks)
+        left_dist = encoder.ticks_to_in(self._dist_ticks - (left_enc.ticks - self._l0))
+        right_dist = encoder.ticks_to_in(self._dist_ticks - (right_enc.ticks - self._r0))
         return left_dist, right_dist
 
-    def complete(self):
+    def complete(self, left_enc, right_enc):
         """ Checks if movement is complete """
-        return encoder.LeftVal >= self._dist_ticks and encoder.RightVal >= self._dist_ticks
+        return left_enc.ticks - self._l0 >= self._dist_ticks and \
+            right_enc.ticks - self._r0 >= self._dist_ticks
 
 class StraightVelocity:
-    def __init__(self, vel_in_ms):
+    ## Proportional gain in duty cycle percent per tick/ms of velocity error
+    KP = 12.0
+    ## Integral gain
+    KI = 0.05
+
+    def __init__(self, vel_in_ms, dist_inches=None):
+        """ Drive straight at a constant velocity
+
+        @param vel_in_ms velocity in inches per millisecond
+        @param dist_inches optional distance after which the command reports complete.
+               Without it the command runs until it is replaced. """
         self._vel_ticks_ms = encoder.in_to_ticks(vel_in_ms)
-        self._cntrl_left = controller.PIcontrol(12.0, 0.05, self._vel_ticks_ms)
-        self._cntrl_right = controller.PIcontrol(12.0, 0.05, self._vel_ticks_ms)
+        self._cntrl_left = controller.PIcontrol(self.KP, self.KI, self._vel_ticks_ms)
+        self._cntrl_right = controller.PIcontrol(self.KP, self.KI, self._vel_ticks_ms)
+        self._dist_ticks = None if dist_inches is None else abs(encoder.in_to_ticks(dist_inches))
+        self._l0 = self._r0 = 0
         self.seek_amnt = 0
 
+        ## Velocity setpoints in ticks/ms of each wheel from the most recent step
+        self.left_vel = self.right_vel = self._vel_ticks_ms
+
+        # With calibrated motors the lookup table supplies the steady state duty
+        # cycle, so the integrators only need to trim out the remaining error
+        self.feedforward = motor_cal.Left is not None and motor_cal.Right is not None
+        if self.feedforward:
+            self._cntrl_left.i_err = 0
+            self._cntrl_right.i_err = 0
+
+    def start(self, left_enc, right_enc, prev):
+        """ Record the starting encoder positions. If the previous command was
+        also driving straight in the same direction, its integrator state is carried
+        over so the wheels keep their current speed instead of reaccelerating.
+
+        @param left_enc left encoder state when the command starts
+        @param right_enc right encoder state when the command starts
+        @param prev previous drive command, or None if starting from rest """
+        self._l0 = left_enc.ticks
+        self._r0 = right_enc.ticks
+        if isinstance(prev, StraightVelocity) and (prev._vel_ticks_ms >= 0) == (self._vel_ticks_ms >= 0):
+            self._cntrl_left.i_err = prev._cntrl_left.i_err
+            self._cntrl_right.i_err = prev._cntrl_right.i_err
+
     def seek(self, amount):
         if amount is None:
             self.seek_amnt = 0
@@ -58,38 +138,69 @@ class StraightVelocity:
     def step(self, left_enc, right_enc):
         """ Calculate motor speeds to execute movement """
 
+        left_vel = right_vel = self._vel_ticks_ms
         if self.seek_amnt < 0:
-            self._cntrl_left.set_vel(self._vel_ticks_ms - abs(self.seek_amnt))
-            self._cntrl_right.set_vel(self._vel_ticks_ms)
+            left_vel -= abs(self.seek_amnt)
         else:
-            self._cntrl_left.set_vel(self._vel_ticks_ms)
-            self._cntrl_right.set_vel(self._vel_ticks_ms - abs(self.seek_amnt))
+            right_vel -= abs(self.seek_amnt)
+        self._cntrl_left.set_vel(left_vel)
+        self._cntrl_right.set_vel(right_vel)
+        self.left_vel = left_vel
+        self.right_vel = right_vel
 
         left_speed = self._cntrl_left.piloop(left_enc.vel_ticks_ms, left_enc.dt)
         right_speed = self._cntrl_right.piloop(right_enc.vel_ticks_ms, right_enc.dt)
 
+        if self.feedforward:
+            left_speed += motor_cal.Left.duty_for(left_vel)
+            right_speed += motor_cal.Right.duty_for(right_vel)
+
         # print("[DRIVE]", left_speed, "l", right_speed, "r", left_enc.vel_ticks_ms, "lv", right_enc.vel_ticks_ms, "rv", self._vel_ticks_ms)
         return left_speed, right_speed
 
+    def dist_travelled_in(self, left_enc, right_enc):
+        """ Get the distance driven since the command started in inches """
+        return encoder.ticks_to_in((left_enc.ticks - self._l0 + right_enc.ticks - self._r0)/2)
+
+    def complete(self, left_enc, right_enc):
+        """ Checks if the optional distance has been covered """
+        if self._dist_ticks is None:
+            return False
+        return abs(left_enc.ticks - self._l0 + right_enc.ticks - self._r0)/2 >= self._dist_ticks
+
 class TurnAngle:
     """ Turn the SUMO bot a given angle clockwise.
 
     To spin in place, we run a p-controller on one wheel and mirror the speed on the other wheel """
 
+    feedforward = False
+
+    ## Proportional gain in duty cycle percent per encoder tick of error
+    KP = 0.25
+
     def __init__(self, degrees, max_rate=None, fix_overshoot=False):
         self._dist_ticks = encoder.deg_to_ticks(degrees)
         self._fix_overshoot = fix_overshoot
         self._distance_remaining_ticks = self._dist_ticks
-        self._cntrl = controller.PControl(0.25, self._dist_ticks)
+        self._cntrl = controller.PControl(self.KP, self._dist_ticks)
         self._cw = degrees >= 0
         self._max_rate = max_rate
+        self._l0 = 0
+
+    def start(self, left_enc, right_enc, prev):
+        """ Record the encoder position the turn is measured from
+
+        @param left_enc left encoder state when the command starts
+        @param right_enc right encoder state when the command starts
+        @param prev previous drive command, or None if starting from rest """
+        self._l0 = left_enc.ticks
 
     def step(self, left_enc, right_enc):
         """ Calculate motor speeds to execute movement """
         speed = 0
 
-        if self._fix_overshoot == True or not self.complete(left_enc):
-            speed = self._cntrl.ploop(left_enc.ticks)
+        if self._fix_overshoot == True or not self.complete(left_enc, right_enc):
+            speed = self._cntrl.ploop(left_enc.ticks - self._l0)
 
         if speed == 0:
             return speed, -speed
@@ -102,39 +213,80 @@ class TurnAngle:
 
     def dist_remaining_deg(self, left_enc, right_enc):
         """ Get distance remaining of movement in inches """
-        return encoder.ticks_to_deg(self._dist_ticks - left_enc.ticks)
+        return encoder.ticks_to_deg(self._dist_ticks - (left_enc.ticks - self._l0))
 
-    def complete(self, enc):
+    def complete(self, left_enc, right_enc):
         """ Checks if movement is complete """
         if self._cw:
-            return enc.ticks >= self._dist_ticks
+            return left_enc.ticks - self._l0 >= self._dist_ticks
         else:
-            return enc.ticks <= self._dist_ticks
+            return left_enc.ticks - self._l0 <= self._dist_ticks
+
+def change_command(cmd, handoff=HANDOFF_CARRY):
+    """ Replace the active drive command and drop any queued commands.
+    The new command is started by the drive task on its next run.
 
-def change_command(cmd):
+    @param cmd new drive command, or None to stop the motors
+    @param handoff HANDOFF_CARRY to blend straight into the new command,
+           HANDOFF_STOP to bring the motors to zero first """
+    global _Pending
+
+    del CommandQueue[:]
+    _Pending = (cmd, handoff)
+
+def queue_command(cmd, handoff=HANDOFF_CARRY):
+    """ Add a command to run once the current command (and any commands queued
+    before this one) report complete. If nothing is running it starts right away.
+
+    @param cmd drive command to queue
+    @param handoff handoff rule used when this command takes over """
+    CommandQueue.append((cmd, handoff))
+
+def idle():
+    """ Checks if there is no active, pending or queued drive command """
+    return DriveCommand is None and _Pending is None and not CommandQueue
+
+def _start(cmd, handoff, left_enc, right_enc):
+    """ Make cmd the active drive command, applying the handoff rule """
     global DriveCommand
 
-    motor_driver.Left.set_duty_cycle(0)
-    motor_driver.Right.set_duty_cycle(0)
+    if cmd is not None:
+        cmd.start(left_enc, right_enc, DriveCommand if handoff == HANDOFF_CARRY else None)
     DriveCommand = cmd
 
 def handler():
     global DriveCommand
+    global _Pending
+    global Runs
 
     last_l_enc, last_r_enc = encoder.read()
     while True:
         yield(0)
+        Runs += 1
         left_enc, right_enc = encoder.read(last_l_state=last_l_enc, last_r_state=last_r_enc)
         last_l_enc = left_enc
         last_r_enc = right_enc
 
-        # Stop the motors if there is no currently active command
-        if DriveCommand is None:
+        handoff = HANDOFF_CARRY
+        if _Pending is not None:
+            cmd, handoff = _Pending
+            _Pending = None
+            _start(cmd, handoff, left_enc, right_enc)
+
+        # Advance through the queue once the running command is done
+        while CommandQueue and (DriveCommand is None or DriveCommand.complete(left_enc, right_enc)):
+            cmd, handoff = CommandQueue.pop(0)
+            _start(cmd, handoff, left_enc, right_enc)
+
+        # Stop the motors if there is no currently active command, or for
+        # one period when the command asked to start from rest
+        if DriveCommand is None or handoff == HANDOFF_STOP:
             # print("[DRIVE] No command, stopping motors")
-            motor_driver.Left.set_duty_cycle(0)
-            motor_driver.Right.set_duty_cycle(0)
+            motor_driver.set_duty_cycles(0, 0)
             continue
 
         left_speed, right_speed = DriveCommand.step(left_enc, right_enc)
-        motor_driver.Left.set_duty_cycle(left_speed)
-        motor_driver.Right.set_duty_cycle(right_speed)
+        if not DriveCommand.feedforward and motor_cal.Left is not None and motor_cal.Right is not None:
+            left_speed = motor_cal.Left.compensate(left_speed)
+            right_speed = motor_cal.Right.compensate(right_speed)
+        motor_driver.set_duty_cycles(left_speed, right_speed)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file fsm.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Table driven state machine engine for strategies.
+#
+# A strategy subclasses StateMachine and describes itself in STATES, one row per
+# state number: the state's name, the method run when it is entered, the method
+# run on every step while in it, and its transitions as (guard, next state)
+# pairs. Guards are methods taking the sensor snapshot and returning True to
+# take the transition, checked in order. The table is resolved to bound methods
+# once, so a step only indexes the current state's row and runs its guards.
+#
+# Every machine keeps the time spent in and number of entries to each state, a
+# count of each transition, and a short ring buffer trace of recent transitions.
+
+import array
+
+## Number of transitions kept in a machine's trace
+TRACE_LEN = 32
+
+class StateMachine:
+    """ Runs a table of states against sensor snapshots """
+
+    ## Name printed in diagnostics
+    NAME = 'FSM'
+
+    ## State table, indexed by state number. Each row is
+    # (name, entry method, step method, ((guard method, next state), ...)),
+    # with None for a missing entry or step method.
+    STATES = ()
+
+    ## State the machine starts in and returns to on reset()
+    INITIAL = 0
+
+    def __init__(self):
+        n = len(self.STATES)
+        self._names = [row[0] for row in self.STATES]
+        self._entry = [self._method(row[1]) for row in self.STATES]
+        self._step = [self._method(row[2]) for row in self.STATES]
+        self._trans = [tuple((self._method(guard), nxt) for guard, nxt in row[3])
+                       for row in self.STATES]
+
+        ## Total time in ms spent in each state
+        self.time_in_state = array.array('I', [0]*n)
+        ## Number of times each state has been entered
+        self.entries = array.array('I', [0]*n)
+        ## Number of times each transition fired, indexed by from*len(STATES) + to
+        self.transitions = array.array('H', [0]*(n*n))
+
+        self._trace_ms = array.array('I', [0]*TRACE_LEN)
+        self._trace_state = bytearray(TRACE_LEN)
+        self._trace_idx = 0
+        self._trace_count = 0
+
+        ## Current state number
+        self.state = self.INITIAL
+        # True until the initial state's entry method has run
+        self._pending = True
+
+    def _method(self, name):
+        return None if name is None else getattr(self, name)
+
+    def reset(self):
+        """ Return to the initial state. Its entry method runs on the next step. """
+        self.state = self.INITIAL
+        self._pending = True
+
+    def reset_counters(self):
+        """ Clear the time-in-state, entry and transition counts and the trace """
+        for counts in (self.time_in_state, self.entries, self.transitions):
+            for i in range(len(counts)):
+                counts[i] = 0
+        self._trace_idx = 0
+        self._trace_count = 0
+
+    def state_name(self):
+        return self._names[self.state]
+
+    def _enter(self, state, sens_state):
+        if not self._pending:
+            self.transitions[self.state*len(self._names) + state] += 1
+        self._pending = False
+        self.state = state
+        self.entries[state] += 1
+
+        i = self._trace_idx
+        self._trace_ms[i] = sens_state.time_ms
+        self._trace_state[i] = state
+        self._trace_idx = (i + 1) % TRACE_LEN
+        if self._trace_count < TRACE_LEN:
+            self._trace_count += 1
+
+        entry = self._entry[state]
+        if entry is not None:
+            entry(sens_state)
+
+    def step(self, sens_state):
+        """ Run one step of the current state
+
+        @param sens_state sensor snapshot for this step
+        @return True if the machine changed state """
+        if self._pending:
+            self._enter(self.INITIAL, sens_state)
+            return True
+
+        state = self.state
+        self.time_in_state[state] += sens_state.dt_ms
+
+        step = self._step[state]
+        if step is not None:
+            step(sens_state)
+
+        for guard, nxt in self._trans[state]:
+            if guard(sens_state):
+                self._enter(nxt, sens_state)
+                return True
+        return False
+
+    def get_trace(self):
+        """ String of the most recent transitions, oldest first, as the time in
+        ms each state was entered """
+        tr_str = self.NAME + ':\n'
+        start = (self._trace_idx - self._trace_count) % TRACE_LEN
+        for k in range(self._trace_count):
+            i = (start + k) % TRACE_LEN
+            tr_str += '{: 10d}: {:s}\n'.format(self._trace_ms[i], self._names[self._trace_state[i]])
+        return tr_str
+
+    def __repr__(self):
+        n = len(self._names)
+        rst = '{:<16s}{:>8s}{:>10s}\n'.format(self.NAME, 'ENTRIES', 'TIME MS')
+        for s in range(n):
+            rst += '{:<16s}{: 8d}{: 10d}'.format(self._names[s], self.entries[s], self.time_in_state[s])
+            for t in range(n):
+                count = self.transitions[s*n + t]
+                if count:
+                    rst += '  ->{:s} {:d}'.format(self._names[t], count)
+            rst += '\n'
+        return rst
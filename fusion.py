@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file fusion.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Sensor acquisition task.
+#
+# Owns the encoders, the opponent tracker and the line sensor flags, and every
+# run publishes everything strategy needs in the strategy.Snapshot sensor
+# snapshot through a snapshot.Publisher. The snapshot is allocated once and
+# updated in place; its version number goes up each time it changes, so
+# strategy only has to compare versions to know it has a new snapshot and never
+# touches a sensor itself.
+#
+# While the opponent is being tracked the TOF sensors are asked to range in
+# their fast mode, and in their default mode otherwise.
+#
+# Everything published during a match is also logged to recorder.Match, and the
+# log is written to flash once the match is over.
+
+import utime
+import drive
+import encoder
+import ir
+import line_sensor
+import motor_driver
+import recorder
+import snapshot
+import strategy
+import tof
+import tracker
+
+def handler():
+    """ Task which reads the sensors and publishes strategy.Snapshot """
+    pub = snapshot.Publisher(strategy.Snapshot, tracker.Opponent, tof.Lut)
+    last_time = utime.ticks_ms()
+    tof_seq = tof.Sensors.frame.seq
+    drive_runs = drive.Runs
+    rec = recorder.Match
+    recording = False
+
+    last_l_enc, last_r_enc = encoder.read()
+
+    while True:
+        yield(0)
+
+        now = utime.ticks_ms()
+        dt = utime.ticks_diff(now, last_time)
+        last_time = now
+
+        l_enc, r_enc = encoder.read(last_l_state=last_l_enc, last_r_state=last_r_enc)
+
+        if not ir.IR_STARTED:
+            pub.reset()
+            last_l_enc = l_enc
+            last_r_enc = r_enc
+            tof.request_mode(tof.MODE_DEFAULT)
+            if recording:
+                recording = False
+                # Writing flash holds up every task for a while, so stop the
+                # motors first rather than leave them at their last duty cycle
+                drive.change_command(None)
+                motor_driver.set_duty_cycles(0, 0)
+                rec.save()
+            continue
+
+        if not recording:
+            recording = True
+            rec.clear()
+
+        flags = 0
+        frame = tof.Sensors.frame
+        new_frame = None
+        if frame.seq != tof_seq:
+            tof_seq = frame.seq
+            flags |= recorder.FLAG_TOF
+            new_frame = frame.raw
+
+        line_flags = line_sensor.LineFlags.get()
+        pub.publish(now, dt, l_enc, r_enc, last_l_enc, last_r_enc, new_frame, line_flags)
+        last_l_enc = l_enc
+        last_r_enc = r_enc
+
+        # Range faster while there is an opponent to follow. The TOF task only
+        # restarts the sensors when the mode actually changes.
+        tof.request_mode(tof.MODE_FAST if tracker.Opponent.valid else tof.MODE_DEFAULT)
+
+        if drive.Runs != drive_runs:
+            drive_runs = drive.Runs
+            flags |= recorder.FLAG_DRIVE
+        strat = strategy.Strategy
+        rec.record(now, l_enc.ticks, r_enc.ticks, frame.raw, line_flags, ir.Decoder.cmd, flags,
+                   int(motor_driver.Left.duty), int(motor_driver.Right.duty),
+                   recorder.NO_STATE if strat is None else strat.state)
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file gain_tune.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Host tool which tunes the drive command controller gains against a model
+# of our motors.
+#
+# First a plant.MotorPlant model (gain, time constant and deadband) is fit to
+# a log of duty cycle steps recorded on the robot with motor_cal.run_steps().
+# Then, for each drive command, a grid of gains is run through the real drive
+# task against that model, spread over a multiprocessing pool, and every set of
+# gains is scored on settling time and overshoot. The best gains per command are
+# printed next to the current ones, ready to copy into the drive command's KP/KI
+# class attributes.
+#
+# Run with:
+#   python gain_tune.py motor_steps.txt        (log copied off the robot)
+#   python gain_tune.py --synth                (log made from the default plant)
+
+import host_shims
+host_shims.install()
+
+import argparse
+import math
+import multiprocessing
+import random
+
+import utime
+import drive
+import encoder
+import motor_cal
+import motor_driver
+import plant
+import strategy
+
+## Velocity samples are taken over this many ms of the log
+VEL_WINDOW_MS = 10
+
+## Fraction of a step, at its end, averaged for the steady state velocity
+STEADY_FRAC = 0.3
+
+## Time constants in ms tried when fitting the model
+TAU_CANDIDATES = [5*1.03**i for i in range(150)]
+
+## Drive task period in ms, as in main.py
+DRIVE_PERIOD_MS = 20
+
+## Milliseconds of settling time one percent of overshoot is worth
+OVERSHOOT_MS = 20
+
+## Test movement for each drive command class name: (setpoint, run time in ms,
+# settling tolerance as a fraction of the setpoint)
+TESTS = {
+    'StraightVelocity': (0.014, 1500, 0.05),
+    'StraightDistance': (6, 2000, 0.02),
+    'TurnAngle': (strategy.BasicStrategy.TURN_DEG, 2000, 0.02),
+}
+
+## Other arguments each drive command is built with, matching how strategy.py
+# runs it, so the gains are tuned for the controller the robot actually uses
+ARGS = {
+    'TurnAngle': {'max_rate': strategy.BasicStrategy.TURN_RATE},
+}
+
+## Gains tried for each command, as a list of values for each class attribute
+GRIDS = {
+    'StraightVelocity': {'KP': [2.0*1.3**i for i in range(14)], 'KI': [0.005*1.6**i for i in range(11)]},
+    'StraightDistance': {'KP': [0.02*1.25**i for i in range(20)]},
+    'TurnAngle': {'KP': [0.05*1.25**i for i in range(20)]},
+}
+
+def load_log(path):
+    """ Read a step log written by motor_cal.save_steps()
+
+    @return list of (time_ms, duty, ticks) """
+    log = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            t, d, ticks = line.split(',')
+            log.append((int(t), int(d), int(ticks)))
+    return log
+
+def synth_log(model, duties=motor_cal.STEP_DUTIES, hold_ms=600, noise=0.05, seed=0):
+    """ Step log of a simulated motor, for checking identify() """
+    flat = []
+    rng = random.Random(seed)
+    sim = plant.MotorPlant(model.gain, model.tau_ms, model.deadband, noise, rng)
+    for _ in motor_cal.record_steps(flat, sim, sim, sim.ticks_ms, duties, hold_ms):
+        sim.advance(1)
+    return [tuple(flat[i:i + 3]) for i in range(0, len(flat), 3)]
+
+def _segments(log):
+    """ Split a log into runs of constant duty cycle as (duty, [(time, vel)]) """
+    segments = []
+    start = 0
+    for i in range(1, len(log) + 1):
+        if i == len(log) or log[i][1] != log[start][1]:
+            vels = []
+            j = start
+            for k in range(start + 1, i):
+                if log[k][0] - log[j][0] >= VEL_WINDOW_MS:
+                    vels.append((log[k][0] - log[start][0],
+                                 (log[k][2] - log[j][2])/(log[k][0] - log[j][0])))
+                    j = k
+            segments.append((log[start][1], vels))
+            start = i
+    return segments
+
+def _step_error(steps, tau):
+    """ Squared error between logged steps and first order responses with time constant tau """
+    err = 0.0
+    for v0, v_ss, vels in steps:
+        for t, v in vels:
+            # Velocities are averaged over the window before each sample
+            t -= VEL_WINDOW_MS/2
+            err += (v - (v_ss + (v0 - v_ss)*math.exp(-t/tau)))**2
+    return err
+
+def identify(log):
+    """ Fit a first order model with a deadband to a step log
+
+    @return plant.MotorPlant with the identified gain, time constant and deadband """
+    steady = []
+    steps = []
+    prev_vel = 0.0
+    for duty, vels in _segments(log):
+        if len(vels) < 4:
+            continue
+        tail = vels[int(len(vels)*(1 - STEADY_FRAC)):]
+        v_ss = sum(v for _, v in tail)/len(tail)
+        steady.append((abs(duty), abs(v_ss)))
+
+        change = v_ss - prev_vel
+        if abs(change) > 0.5:
+            steps.append((prev_vel, v_ss, vels))
+        prev_vel = v_ss
+
+    # Least squares line through the steps which moved the motor
+    moving = [(d, v) for d, v in steady if d and v > 0.1]
+    n = len(moving)
+    mean_d = sum(d for d, _ in moving)/n
+    mean_v = sum(v for _, v in moving)/n
+    gain = sum((d - mean_d)*(v - mean_v) for d, v in moving)/sum((d - mean_d)**2 for d, _ in moving)
+    deadband = mean_d - mean_v/gain
+
+    # Time constant whose first order response best fits every step at once
+    tau = min(TAU_CANDIDATES, key=lambda tau: _step_error(steps, tau))
+    return plant.MotorPlant(gain, tau, deadband)
+
+def run_command(model, cmd_name, gains, cal):
+    """ Run a drive command through the drive task against two copies of the model
+
+    @param model plant.MotorPlant whose parameters are used for both wheels
+    @param cmd_name drive command class name
+    @param gains dictionary of class attribute values to run the command with
+    @param cal motor_cal.DutyTable of the model, or None to run uncalibrated
+    @return list of (time_ms, value) where value is the wheel velocity in
+            ticks/ms for StraightVelocity and the left wheel's position in
+            ticks otherwise, and the setpoint in the same units """
+    cls = getattr(drive, cmd_name)
+    for key, val in gains.items():
+        setattr(cls, key, val)
+    setpoint, run_ms, _ = TESTS[cmd_name]
+
+    left = plant.MotorPlant(model.gain, model.tau_ms, model.deadband)
+    right = plant.MotorPlant(model.gain, model.tau_ms, model.deadband)
+    encoder.Left = motor_driver.Left = left
+    encoder.Right = motor_driver.Right = right
+    motor_cal.Left = motor_cal.Right = cal
+    drive.DriveCommand = None
+    drive.CommandQueue = []
+    drive._Pending = None
+
+    clock = [1000]
+    utime.ticks_ms = lambda: clock[0]
+    task = drive.handler()
+    next(task)
+    drive.change_command(cls(setpoint, **ARGS.get(cmd_name, {})))
+
+    if cmd_name == 'StraightVelocity':
+        target = encoder.in_to_ticks(setpoint)
+    elif cmd_name == 'StraightDistance':
+        target = encoder.in_to_ticks(setpoint)
+    else:
+        target = encoder.deg_to_ticks(setpoint)
+
+    trace = []
+    for t in range(run_ms):
+        left.advance(1)
+        right.advance(1)
+        clock[0] += 1
+        if (t + 1) % DRIVE_PERIOD_MS == 0:
+            next(task)
+        if cmd_name == 'StraightVelocity':
+            trace.append((t, (left.vel + right.vel)/2))
+        else:
+            trace.append((t, left.pos))
+    return trace, target
+
+def score(trace, target, tol):
+    """ Settling time and overshoot of a response
+
+    @param tol settling band as a fraction of the setpoint
+    @return (settling time in ms, overshoot in percent, score) """
+    band = abs(target)*tol
+    settle = 0
+    for t, val in trace:
+        if abs(val - target) > band:
+            settle = t + 1
+    if target > 0:
+        peak = max(val for _, val in trace)
+    else:
+        peak = min(val for _, val in trace)
+    overshoot = max(0.0, 100*(peak - target)/target)
+    return settle, overshoot, settle + OVERSHOOT_MS*overshoot
+
+def evaluate(job):
+    """ Pool worker: run and score one command with one set of gains """
+    model_params, cmd_name, gains, calibrated = job
+    model = plant.MotorPlant(*model_params)
+    cal = _calibrate(model) if calibrated else None
+    trace, target = run_command(model, cmd_name, gains, cal)
+    return (cmd_name, gains) + score(trace, target, TESTS[cmd_name][2])
+
+_cal_cache = {}
+
+def _calibrate(model):
+    """ motor_cal table for the model, as motor_cal.run() would store on the robot """
+    key = (model.gain, model.tau_ms, model.deadband)
+    if key not in _cal_cache:
+        table = motor_cal.DutyTable()
+        sim = plant.MotorPlant(model.gain, model.tau_ms, model.deadband)
+        for _ in motor_cal.calibrate(table, sim, sim, sim.ticks_ms):
+            sim.advance(5)
+        _cal_cache[key] = table
+    return _cal_cache[key]
+
+def _grid(axes):
+    combos = [{}]
+    for key, vals in axes.items():
+        combos = [dict(c, **{key: v}) for c in combos for v in vals]
+    return combos
+
+def tune(model, calibrated=True, jobs=None):
+    """ Search each command's gain grid
+
+    @return dictionary of command name to (current result, best result), each
+            result being (name, gains, settle ms, overshoot %, score) """
+    params = (model.gain, model.tau_ms, model.deadband)
+    current = {}
+    jobs_list = []
+    for cmd_name, axes in GRIDS.items():
+        cls = getattr(drive, cmd_name)
+        current[cmd_name] = {key: getattr(cls, key) for key in axes}
+        jobs_list.append((params, cmd_name, current[cmd_name], calibrated))
+        jobs_list += [(params, cmd_name, gains, calibrated) for gains in _grid(axes)]
+
+    best = {}
+    baseline = {}
+    with multiprocessing.Pool(jobs) as pool:
+        for result in pool.imap(evaluate, jobs_list, chunksize=4):
+            cmd_name, gains = result[0], result[1]
+            if gains == current[cmd_name] and cmd_name not in baseline:
+                baseline[cmd_name] = result
+            elif cmd_name not in best or result[4] < best[cmd_name][4]:
+                best[cmd_name] = result
+    return {cmd_name: (baseline[cmd_name], best[cmd_name]) for cmd_name in GRIDS}
+
+def _gains_str(gains):
+    return ' '.join('{:s}={:.4g}'.format(k, v) for k, v in sorted(gains.items()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune drive command gains against an identified motor model')
+    parser.add_argument('log', nargs='?', help='step log from motor_cal.run_steps()')
+    parser.add_argument('--synth', action='store_true', help='use a log made from the default plant model')
+    parser.add_argument('--uncalibrated', action='store_true',
+                        help='tune as if no motor_cal table is stored on the robot')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default one per core)')
+    args = parser.parse_args()
+
+    if args.log:
+        log = load_log(args.log)
+    elif args.synth:
+        log = synth_log(plant.MotorPlant())
+    else:
+        parser.error('give a step log or --synth')
+
+    model = identify(log)
+    print('model: gain {:.4f} ticks/ms per %, tau {:.1f} ms, deadband {:.1f} %'.format(
+        model.gain, model.tau_ms, model.deadband))
+
+    print('{:<18s}{:<28s}{:>10s}{:>12s}'.format('COMMAND', 'GAINS', 'SETTLE MS', 'OVERSHOOT %'))
+    for cmd_name, (cur, best) in tune(model, not args.uncalibrated, args.jobs).items():
+        for label, result in (('current', cur), ('best', best)):
+            print('{:<18s}{:<28s}{: 10d}{: 12.1f}  {:s}'.format(cmd_name, _gains_str(result[1]),
+                result[2], result[3], label))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file host_shims.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Stand-ins for the MicroPython only modules our code imports, so the pure
+# logic in the robot code can be benchmarked and simulated with CPython on a
+# laptop. Call install() before importing any robot modules. Modules which
+# already exist, e.g. when running under MicroPython itself, are left alone.
+
+import struct
+import sys
+import time
+import types
+
+def _micropython():
+    mod = types.ModuleType('micropython')
+    mod.const = lambda x: x
+    mod.native = lambda f: f
+    mod.viper = lambda f: f
+    mod.alloc_emergency_exception_buf = lambda size: None
+    mod.schedule = lambda fun, arg: fun(arg)
+    return mod
+
+def _utime():
+    mod = types.ModuleType('utime')
+    mod.ticks_ms = lambda: int(time.monotonic()*1000)
+    mod.ticks_us = lambda: int(time.monotonic()*1000000)
+    mod.ticks_diff = lambda a, b: a - b
+    mod.ticks_add = lambda a, b: a + b
+    mod.sleep_ms = lambda ms: time.sleep(ms/1000)
+    mod.sleep_us = lambda us: time.sleep(us/1000000)
+    mod.sleep = time.sleep
+    return mod
+
+class _PinNames:
+    """ pyb.Pin.board and pyb.Pin.cpu, where any pin name resolves to a pin """
+
+    def __init__(self, pin_cls):
+        self._pin_cls = pin_cls
+
+    def __getattr__(self, name):
+        return self._pin_cls(name)
+
+def _pyb():
+    mod = types.ModuleType('pyb')
+
+    class Pin:
+        IN = 0
+        OUT_PP = 1
+        AF_PP = 2
+        PULL_NONE = 0
+        PULL_UP = 1
+        AF1_TIM2 = 1
+        AF2_TIM4 = 2
+        AF3_TIM8 = 3
+
+        def __init__(self, name=None, *args, **kwargs):
+            self.name = name
+            self._value = 0
+
+        def init(self, *args, **kwargs):
+            pass
+
+        def value(self, val=None):
+            if val is None:
+                return self._value
+            self._value = val
+
+        def high(self):
+            self._value = 1
+
+        def low(self):
+            self._value = 0
+
+    class TimerChannel:
+        def __init__(self):
+            self._capture = 0
+            self._callback = None
+
+        def capture(self):
+            return self._capture
+
+        def callback(self, fun):
+            self._callback = fun
+
+        def pulse_width(self, counts=None):
+            return 0
+
+    class Timer:
+        IC = 0
+        PWM = 1
+        RISING = 0
+        FALLING = 1
+        BOTH = 2
+        ENC_AB = 3
+
+        def __init__(self, num, prescaler=0, period=0xffff, freq=None):
+            self._period = period
+
+        def period(self):
+            return self._period
+
+        def counter(self):
+            return 0
+
+        def channel(self, num, mode=None, pin=None, **kwargs):
+            return TimerChannel()
+
+    class USB_VCP:
+        """ Serial port to nowhere: reads nothing and takes every write """
+
+        def __init__(self, id=0):
+            pass
+
+        def any(self):
+            return False
+
+        def read(self, nbytes=None):
+            return None
+
+        def write(self, buf):
+            return len(buf)
+
+        def isconnected(self):
+            return True
+
+        def setinterrupt(self, chr):
+            pass
+
+    Pin.board = _PinNames(Pin)
+    Pin.cpu = _PinNames(Pin)
+    mod.Pin = Pin
+    mod.Timer = Timer
+    mod.USB_VCP = USB_VCP
+    mod.disable_irq = lambda: True
+    mod.enable_irq = lambda state=True: None
+    mod.millis = lambda: int(time.monotonic()*1000)
+    mod.micros = lambda: int(time.monotonic()*1000000)
+    mod.delay = lambda ms: time.sleep(ms/1000)
+    mod.udelay = lambda us: time.sleep(us/1000000)
+    return mod
+
+def install():
+    """ Register the host stand-ins in sys.modules """
+    if 'micropython' not in sys.modules:
+        try:
+            import micropython
+        except ImportError:
+            sys.modules['micropython'] = _micropython()
+    if 'ustruct' not in sys.modules:
+        sys.modules['ustruct'] = struct
+    if 'utime' not in sys.modules:
+        try:
+            import utime
+        except ImportError:
+            sys.modules['utime'] = _utime()
+    if 'pyb' not in sys.modules:
+        try:
+            import pyb
+        except ImportError:
+            sys.modules['pyb'] = _pyb()
@@ -9,12 +9,25 @@
 
 from machine import I2C
 import pyb
+import i2c_bus
 
 ## I2C Bus 1. Contains left time of flight sensor and accelerometer.
-Bus1 = I2C(1)
+Bus1 = i2c_bus.Bus(I2C(1), 'Bus1')
 
 ## I2C Bus 2. Contains center time of flight sensor.
-Bus2 = I2C(-1, pyb.Pin.board.PC3, pyb.Pin.board.PC2)
+Bus2 = i2c_bus.Bus(I2C(-1, pyb.Pin.board.PC3, pyb.Pin.board.PC2), 'Bus2')
 
 ## I2C Bus 3. Contains center time of flight sensor.
-Bus3 = I2C(-1, pyb.Pin.board.PC0, pyb.Pin.board.PB0)
+Bus3 = i2c_bus.Bus(I2C(-1, pyb.Pin.board.PC0, pyb.Pin.board.PB0), 'Bus3')
+
+def show_all():
+    """ Create a string with the transaction profile of every bus """
+    return i2c_bus.show_all()
+
+def handler():
+    """ Task which carries out transactions queued on the buses """
+    while True:
+        yield(0)
+        Bus1.service()
+        Bus2.service()
+        Bus3.service()
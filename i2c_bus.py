@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file i2c_bus.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Thin I2C bus layer used by the sensor drivers. A Bus wraps anything with the
+# machine.I2C memory access methods and profiles the transactions which go
+# through it, counting transactions, bytes and time spent per device address.
+#
+# Buses shared between tasks are arbitrated cooperatively. A task takes the bus
+# with lock(), or with "yield from bus.acquire(owner)" which yields back to the
+# scheduler until the bus is free, and gives it back with release(). Tasks can
+# also submit() Transaction objects, which the I2C task carries out in order
+# whenever the bus isn't locked, and check their done flag on a later run.
+
+import utime
+
+## List of all buses, used to create diagnostic printouts
+bus_list = []
+
+def show_all():
+    """ Create a string holding the transaction profile of every bus
+    @return A string containing information about each bus """
+    return '\n'.join(str(bus) for bus in bus_list)
+
+class Transaction:
+    """ A register read or write queued on a bus with Bus.submit(). Allocate
+    these once and resubmit them, so queuing a transaction doesn't allocate. """
+
+    def __init__(self, addr, reg, buf, write=False):
+        """ @param addr I2C address of the device
+            @param reg register to start reading or writing at
+            @param buf bytearray to read into, or data to write
+            @param write True to write buf to the device, False to read into it """
+        self.addr = addr
+        self.reg = reg
+        self.buf = buf
+        self.write = write
+        ## Set once the transaction has been carried out
+        self.done = True
+        ## OSError raised by the transaction, or None if it succeeded
+        self.error = None
+
+class Bus:
+    """ Profiling wrapper around an I2C bus """
+
+    def __init__(self, dev, name, profile=True):
+        """ @param dev machine.I2C bus, or anything with the same methods,
+                   such as the recording and replaying devices in i2c_mock.py
+            @param name short name for diagnostic printouts
+            @param profile set to False to pass transactions straight through """
+        self.dev = dev
+        self.name = name
+        self.profile = profile
+
+        ## Transaction profile by device address, as [transactions, bytes, us] lists
+        self.stats = {}
+
+        ## Object currently holding the bus lock, or None if the bus is free
+        self.owner = None
+        ## Number of times a task found the bus locked by someone else
+        self.contention = 0
+        ## Transactions waiting for the I2C task to carry them out
+        self.queue = []
+
+        bus_list.append(self)
+
+    def _record(self, addr, nbytes, start):
+        """ Add a transaction which started at start us to the profile """
+        us = utime.ticks_diff(utime.ticks_us(), start)
+        stat = self.stats.get(addr)
+        if stat is None:
+            stat = self.stats[addr] = [0, 0, 0]
+        stat[0] += 1
+        stat[1] += nbytes
+        stat[2] += us
+
+    def lock(self, owner):
+        """ Try to take the bus without waiting
+
+        @param owner object identifying the task taking the bus
+        @return True if owner now holds the bus """
+        if self.owner is None or self.owner is owner:
+            self.owner = owner
+            return True
+        self.contention += 1
+        return False
+
+    def acquire(self, owner):
+        """ Generator for use with yield from inside a task, which yields to the
+        scheduler until owner holds the bus """
+        while not self.lock(owner):
+            yield None
+
+    def release(self, owner):
+        """ Give the bus back if owner holds it """
+        if self.owner is owner:
+            self.owner = None
+
+    def submit(self, txn):
+        """ Queue a transaction for the I2C task to carry out
+
+        @param txn Transaction to queue. Its done flag is cleared until it runs. """
+        txn.done = False
+        txn.error = None
+        self.queue.append(txn)
+
+    def service(self, max_txns=4):
+        """ Carry out queued transactions, unless a task holds the bus lock
+
+        @param max_txns most transactions to carry out in one call, to keep
+               the time spent bounded
+        @return number of transactions carried out """
+        if self.owner is not None:
+            if self.queue:
+                self.contention += 1
+            return 0
+        count = 0
+        while self.queue and count < max_txns:
+            txn = self.queue.pop(0)
+            try:
+                if txn.write:
+                    self.writeto_mem(txn.addr, txn.reg, txn.buf)
+                else:
+                    self.readfrom_mem_into(txn.addr, txn.reg, txn.buf)
+            except OSError as err:
+                txn.error = err
+            txn.done = True
+            count += 1
+        return count
+
+    def readfrom_mem(self, addr, reg, n):
+        if not self.profile:
+            return self.dev.readfrom_mem(addr, reg, n)
+        start = utime.ticks_us()
+        data = self.dev.readfrom_mem(addr, reg, n)
+        self._record(addr, n, start)
+        return data
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        if not self.profile:
+            return self.dev.readfrom_mem_into(addr, reg, buf)
+        start = utime.ticks_us()
+        self.dev.readfrom_mem_into(addr, reg, buf)
+        self._record(addr, len(buf), start)
+
+    def writeto_mem(self, addr, reg, data):
+        if not self.profile:
+            return self.dev.writeto_mem(addr, reg, data)
+        start = utime.ticks_us()
+        self.dev.writeto_mem(addr, reg, data)
+        self._record(addr, len(data), start)
+
+    def readfrom_into(self, addr, buf):
+        if not self.profile:
+            return self.dev.readfrom_into(addr, buf)
+        start = utime.ticks_us()
+        self.dev.readfrom_into(addr, buf)
+        self._record(addr, len(buf), start)
+
+    def writeto(self, addr, data):
+        if not self.profile:
+            return self.dev.writeto(addr, data)
+        start = utime.ticks_us()
+        ack = self.dev.writeto(addr, data)
+        self._record(addr, len(data), start)
+        return ack
+
+    def scan(self):
+        return self.dev.scan()
+
+    def reset_profile(self):
+        """ Clear the transaction profile """
+        self.stats.clear()
+        self.contention = 0
+
+    def busy_us(self):
+        """ Total time in us spent in transactions on this bus """
+        return sum(stat[2] for stat in self.stats.values())
+
+    def __repr__(self):
+        """ Diagnostic text with the transaction profile for each device """
+        ret = '{:<8s}  ADDR     TXNS     BYTES        US   CONTENTION {:d}'.format(self.name, self.contention)
+        for addr in sorted(self.stats):
+            stat = self.stats[addr]
+            ret += '\n          0x{:02x}{: 9d}{: 10d}{: 10d}'.format(addr, stat[0], stat[1], stat[2])
+        return ret
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file i2c_mock.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Recording and replaying I2C devices.
+#
+# A Recorder sits between a Bus and the real bus and logs every transaction.
+# The log can be saved to a file and later fed to a Replayer, which stands in
+# for the bus on a laptop: reads return the recorded data and writes are
+# checked against what the driver wrote when the log was made. Wrap either of
+# them in an i2c_bus.Bus to get the usual transaction profile.
+#
+# Run this file on a laptop to record a VL53L0X boot against the fake sensor
+# in vl53l0x_bench.py and replay it.
+
+## Transaction types in a log
+READ_MEM = 'r'
+WRITE_MEM = 'w'
+READ = 'R'
+WRITE = 'W'
+
+class Recorder:
+    """ Logs every transaction made through an I2C bus """
+
+    def __init__(self, dev):
+        """ @param dev machine.I2C bus or other device to pass transactions on to """
+        self.dev = dev
+        ## Transactions as (type, address, register, data) tuples. register is None
+        # for transactions which don't address a register.
+        self.log = []
+
+    def readfrom_mem(self, addr, reg, n):
+        data = self.dev.readfrom_mem(addr, reg, n)
+        self.log.append((READ_MEM, addr, reg, bytes(data)))
+        return data
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        self.dev.readfrom_mem_into(addr, reg, buf)
+        self.log.append((READ_MEM, addr, reg, bytes(buf)))
+
+    def writeto_mem(self, addr, reg, data):
+        self.dev.writeto_mem(addr, reg, data)
+        self.log.append((WRITE_MEM, addr, reg, bytes(data)))
+
+    def readfrom_into(self, addr, buf):
+        self.dev.readfrom_into(addr, buf)
+        self.log.append((READ, addr, None, bytes(buf)))
+
+    def writeto(self, addr, data):
+        ack = self.dev.writeto(addr, data)
+        self.log.append((WRITE, addr, None, bytes(data)))
+        return ack
+
+    def scan(self):
+        return self.dev.scan()
+
+    def save(self, path):
+        """ Write the log to a text file, one transaction per line """
+        with open(path, 'w') as f:
+            for kind, addr, reg, data in self.log:
+                f.write('{:s} {:02x} {:s} {:s}\n'.format(kind, addr,
+                    '--' if reg is None else '{:02x}'.format(reg),
+                    ''.join('{:02x}'.format(b) for b in data)))
+
+def load(path):
+    """ Read a log written by Recorder.save()
+    @return list of (type, address, register, data) tuples """
+    log = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3:
+                fields.append('')
+            kind, addr, reg, data = fields
+            log.append((kind, int(addr, 16), None if reg == '--' else int(reg, 16),
+                        bytes([int(data[i:i + 2], 16) for i in range(0, len(data), 2)])))
+    return log
+
+class ReplayError(Exception):
+    """ Raised when a driver's transactions stop matching the recording """
+    pass
+
+class Replayer:
+    """ Stands in for an I2C bus by playing back a recorded log """
+
+    def __init__(self, log, check_writes=True):
+        """ @param log list of transactions from Recorder.log or load()
+            @param check_writes raise ReplayError if written data differs from the recording """
+        self.log = log
+        self.check_writes = check_writes
+        ## Index of the next transaction in the log
+        self.pos = 0
+
+    def _next(self, kind, addr, reg, n=None):
+        if self.pos >= len(self.log):
+            raise ReplayError('transaction {:d}: past the end of the recording'.format(self.pos))
+        rec = self.log[self.pos]
+        if rec[0] != kind or rec[1] != addr or rec[2] != reg or (n is not None and len(rec[3]) != n):
+            raise ReplayError('transaction {:d}: expected {}, got {}'.format(self.pos, rec[:3] + (len(rec[3]),),
+                (kind, addr, reg, n)))
+        self.pos += 1
+        return rec[3]
+
+    def _check(self, kind, addr, reg, data):
+        expected = self._next(kind, addr, reg, len(data))
+        if self.check_writes and bytes(data) != expected:
+            raise ReplayError('transaction {:d}: wrote {}, recorded {}'.format(self.pos - 1, bytes(data), expected))
+
+    def readfrom_mem(self, addr, reg, n):
+        return self._next(READ_MEM, addr, reg, n)
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        buf[:] = self._next(READ_MEM, addr, reg, len(buf))
+
+    def writeto_mem(self, addr, reg, data):
+        self._check(WRITE_MEM, addr, reg, data)
+
+    def readfrom_into(self, addr, buf):
+        buf[:] = self._next(READ, addr, None, len(buf))
+
+    def writeto(self, addr, data):
+        self._check(WRITE, addr, None, data)
+        return 1
+
+    def done(self):
+        """ Checks if every recorded transaction has been replayed """
+        return self.pos == len(self.log)
+
+if __name__ == '__main__':
+    import host_shims
+    host_shims.install()
+
+    import i2c_bus
+    import VL53L0X
+    import vl53l0x_bench
+
+    rec = Recorder(vl53l0x_bench.FakeVL53L0X())
+    bus = i2c_bus.Bus(rec, 'Record')
+    sensor = VL53L0X.VL53L0X(bus)
+    sensor.start()
+    for _ in range(10):
+        sensor.read()
+    rec.save('vl53l0x_boot.log')
+
+    replay = Replayer(load('vl53l0x_boot.log'))
+    bus = i2c_bus.Bus(replay, 'Replay')
+    sensor = VL53L0X.VL53L0X(bus)
+    sensor.start()
+    for _ in range(10):
+        sensor.read()
+    print('replayed {:d} of {:d} transactions'.format(replay.pos, len(replay.log)))
+    print(i2c_bus.show_all())
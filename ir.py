@@ -9,15 +9,187 @@ This file contains the logic for handling the interrupts created by an IR remote
 
 import pyb
 import utime
-import task_share
 
 IR_TMR_CH = None
 IR_TMR_FREQ = 1000000
-IR_QUEUE = task_share.Queue('I', 68, overwrite = False)
-IR_QUEUE_EMPTY_TIME = 0
 IR_START_CMD = 48
+## Commands which start a match. Any other command stops it.
+IR_START_CMDS = (IR_START_CMD,)
 IR_STARTED = False
 
+# NEC pulse lengths in microseconds
+NEC_LEAD_MARK_US = 9000
+NEC_LEAD_SPACE_US = 4500
+NEC_REPEAT_SPACE_US = 2250
+NEC_BIT_MARK_US = 562
+NEC_ZERO_SPACE_US = 562
+NEC_ONE_SPACE_US = 1687
+
+## Accepted error in a pulse length, as a fraction (1/2^NEC_TOL_SHIFT) of the pulse
+NEC_TOL_SHIFT = 2
+
+# Decoder states, named for the pulse the next edge ends
+_IDLE = 0
+_LEAD_MARK = 1
+_LEAD_SPACE = 2
+_BIT_MARK = 3
+_BIT_SPACE = 4
+_REPEAT_MARK = 5
+
+class NecDecoder:
+    """ Decodes NEC frames one edge at a time as the timer captures them.
+
+    The work per edge is a subtraction, a few compares and a shift, so it can
+    be fed straight from the capture interrupt and the command is ready the
+    moment the last edge of the frame lands. Nothing is allocated per edge:
+    the 32 frame bits are shifted into two 16-bit halves so neither leaves the
+    small int range, which would need the heap.
+
+    A leader mark resynchronizes the decoder wherever it is in a frame, and
+    the repeat codes a held button sends repeat the last command. """
+
+    def __init__(self, tick_freq=IR_TMR_FREQ, tmr_bits=16):
+        """ @param tick_freq frequency in Hz the capture timer counts at
+            @param tmr_bits width of the capture timer in bits """
+        self._mask = (1 << tmr_bits) - 1
+
+        # (min, max) pulse lengths in ticks
+        self._lead_mark = self._window(NEC_LEAD_MARK_US, tick_freq)
+        self._lead_space = self._window(NEC_LEAD_SPACE_US, tick_freq)
+        self._repeat_space = self._window(NEC_REPEAT_SPACE_US, tick_freq)
+        self._bit_mark = self._window(NEC_BIT_MARK_US, tick_freq)
+        self._zero = self._window(NEC_ZERO_SPACE_US, tick_freq)
+        self._one = self._window(NEC_ONE_SPACE_US, tick_freq)
+
+        self._state = _IDLE
+        self._last = 0
+        self._bits = 0
+        self._hi = 0
+        self._lo = 0
+        # True while repeat codes continue the last good frame
+        self._held = False
+
+        ## Address of the newest good frame
+        self.addr = 0
+        ## Command of the newest good frame
+        self.cmd = 0
+        ## Incremented every time a good frame is decoded
+        self.seq = 0
+        ## Repeat codes received for the last good frame
+        self.repeats = 0
+        ## Frames dropped because the address or command failed its check
+        self.bad_checksum = 0
+        ## Partial frames abandoned because a new leader started
+        self.resyncs = 0
+
+    @staticmethod
+    def _window(us, tick_freq):
+        ticks = us*tick_freq//1000000
+        tol = ticks >> NEC_TOL_SHIFT
+        return (ticks - tol, ticks + tol)
+
+    def reset(self):
+        """ Forget any partly received frame """
+        self._state = _IDLE
+        self._held = False
+
+    def feed(self, capture):
+        """ Process one edge. Safe to call from an interrupt.
+
+        @param capture timer count when the edge happened
+        @return True if the edge completed a good frame or a repeat code """
+        pulse = (capture - self._last) & self._mask
+        self._last = capture
+        state = self._state
+
+        if state >= _LEAD_SPACE and self._lead_mark[0] <= pulse <= self._lead_mark[1]:
+            # A new frame started before this one finished
+            self.resyncs += 1
+            self._held = False
+            self._state = _LEAD_SPACE
+            return False
+
+        if state == _BIT_SPACE:
+            if self._zero[0] <= pulse <= self._zero[1]:
+                bit = 0
+            elif self._one[0] <= pulse <= self._one[1]:
+                bit = 1
+            else:
+                self._held = False
+                self._state = _LEAD_MARK
+                return False
+            if self._bits < 16:
+                self._hi = (self._hi << 1) | bit
+            else:
+                self._lo = (self._lo << 1) | bit
+            self._bits += 1
+            self._state = _BIT_MARK
+            return False
+
+        if state == _BIT_MARK:
+            if not self._bit_mark[0] <= pulse <= self._bit_mark[1]:
+                self._held = False
+                self._state = _LEAD_MARK
+                return False
+            if self._bits < 32:
+                self._state = _BIT_SPACE
+                return False
+            # Stop bit, the frame is complete
+            self._state = _IDLE
+            return self._finish()
+
+        if state == _LEAD_SPACE:
+            if self._lead_space[0] <= pulse <= self._lead_space[1]:
+                self._bits = 0
+                self._hi = 0
+                self._lo = 0
+                self._state = _BIT_MARK
+            elif self._repeat_space[0] <= pulse <= self._repeat_space[1]:
+                self._state = _REPEAT_MARK
+            else:
+                self._held = False
+                self._state = _LEAD_MARK
+            return False
+
+        if state == _REPEAT_MARK:
+            if self._held and self._bit_mark[0] <= pulse <= self._bit_mark[1]:
+                self.repeats += 1
+                self._state = _IDLE
+                return True
+            self._held = False
+            self._state = _LEAD_MARK
+            return False
+
+        if state == _LEAD_MARK and self._lead_mark[0] <= pulse <= self._lead_mark[1]:
+            self._state = _LEAD_SPACE
+            return False
+
+        # Idle, or a pulse that can't be a leader: this edge may start one
+        self._state = _LEAD_MARK
+        return False
+
+    def _finish(self):
+        hi = self._hi
+        lo = self._lo
+        if (hi >> 8) ^ (hi & 0xff) != 0xff or (lo >> 8) ^ (lo & 0xff) != 0xff:
+            self.bad_checksum += 1
+            self._held = False
+            return False
+        self.addr = hi >> 8
+        self.cmd = lo >> 8
+        self.seq += 1
+        self.repeats = 0
+        self._held = True
+        return True
+
+    def __repr__(self):
+        return '[IR] addr {:d} cmd {:d}: {:d} frames, {:d} repeats, {:d} bad checksums, ' \
+            '{:d} resyncs'.format(self.addr, self.cmd, self.seq, self.repeats,
+            self.bad_checksum, self.resyncs)
+
+## Decoder fed by the capture interrupt
+Decoder = NecDecoder()
+
 def init():
     global IR_TMR_CH
 
@@ -26,48 +198,28 @@ def init():
     IR_TMR_CH.callback(irq)
 
 def irq(a):
-    """Takes data from IR reciever and puts in queue"""
-    IR_QUEUE.put(IR_TMR_CH.capture(), in_ISR = True)
+    """Decodes each edge from the IR reciever as it arrives, and starts or
+    stops the match as soon as a frame is complete"""
+    global IR_STARTED
+    if Decoder.feed(IR_TMR_CH.capture()):
+        IR_STARTED = Decoder.cmd in IR_START_CMDS
 
 def handler():
     """
-    Decodes the data stored in queue from IR transmitter and prints out the data
-    from the recieved the packet. The address, address complement, command, and
-    command complement are all displayed along with the decimal representation of
-    the command and address.
+    Reports commands decoded from the IR transmitter. The decoding itself
+    happens in the capture interrupt, so this only prints.
     """
-    global IR_STARTED
+    seq = Decoder.seq
 
     while True:
         yield(0)
-        cur_time = utime.ticks_ms()
-        if IR_QUEUE.empty():
-            IR_QUEUE_EMPTY_TIME = cur_time
-        elif IR_QUEUE.full():
-            ir_evt_list = []
-            while not IR_QUEUE.empty():
-                ir_evt_list.append(IR_QUEUE.get())
-
-            pulses = evt_time_to_pulse_len(ir_evt_list)
-            pulses_ms = ticks_to_ms(pulses, IR_TMR_FREQ)
-            packet = psls_to_logic_in_dct(pulses_ms)
-
-            if packet is None:
-                continue
-            elif packet['cmd'] == IR_START_CMD:
-                IR_STARTED = True
+        if Decoder.seq != seq:
+            seq = Decoder.seq
+            if IR_STARTED:
                 print("[IR] Match Started")
             else:
-                IR_STARTED = False
                 print("[IR] Match Stopped")
 
-        elif not IR_QUEUE.empty() and utime.ticks_diff(cur_time, IR_QUEUE_EMPTY_TIME) > 200:
-            # if the queue has items but not a full ir message
-            # assume we recived an incomplete message and drop the queue
-            print("Incomplete message recieved, dropping ir packet")
-            while not IR_QUEUE.empty():
-                IR_QUEUE.get()
-
 def evt_time_to_pulse_len(ir_evt_times):
     """Convert a list of absolute ir transition times to a list alternating between
     pulse time high and pulse time low. The first element will always a high pulse.
@@ -79,13 +231,13 @@ def evt_time_to_pulse_len(ir_evt_times):
     @param ir_evt_times list of ir irq evnts in 16-bit ticks
     @return list of pulse sizes in ticks, alternating between high and low. First pulse is always high.
     """
-    tmr_max = 65535
+    tmr_wrap = 65536
     delta_ticks = []
     for i in range(1, len(ir_evt_times)):
         # Check if timer wrapped between ticks
         delta = ir_evt_times[i] - ir_evt_times[i-1]
         if(ir_evt_times[i] < ir_evt_times[i-1]):
-            delta = tmr_max - ir_evt_times[i-1]
+            delta = tmr_wrap - ir_evt_times[i-1]
             delta += ir_evt_times[i]
         delta_ticks.append(delta)
     return delta_ticks
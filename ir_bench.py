@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file ir_bench.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Host benchmark and fuzzer for the IR start signal decoders.
+#
+# NEC edge captures are synthesized the way the 16-bit capture timer records
+# them, with timing jitter and wrap-around at 2^16, then run through the
+# original list based decode (evt_time_to_pulse_len, ticks_to_ms and
+# psls_to_logic_in_dct) and the streaming NecDecoder. For each path the decode
+# rate, the frames decoded correctly and the peak heap bytes allocated per frame
+# are reported. The fuzzer then feeds both paths truncated, noisy and random
+# edge streams and counts crashes and wrong commands.
+#
+# Run with: python ir_bench.py
+
+import host_shims
+host_shims.install()
+
+import contextlib
+import io
+import random
+import time
+import tracemalloc
+import ir
+
+## Edges in a full NEC frame: leader mark and space, 32 bits and the stop bit
+FRAME_EDGES = 68
+
+def nec_pulses(addr, cmd):
+    """ Pulse lengths in us of an NEC frame, starting with the leader mark """
+    pulses = [ir.NEC_LEAD_MARK_US, ir.NEC_LEAD_SPACE_US]
+    for byte in (addr, addr ^ 0xff, cmd, cmd ^ 0xff):
+        for i in range(8):
+            pulses.append(ir.NEC_BIT_MARK_US)
+            if (byte >> (7 - i)) & 1:
+                pulses.append(ir.NEC_ONE_SPACE_US)
+            else:
+                pulses.append(ir.NEC_ZERO_SPACE_US)
+    pulses.append(ir.NEC_BIT_MARK_US)
+    return pulses
+
+def repeat_pulses():
+    """ Pulse lengths in us of an NEC repeat code """
+    return [ir.NEC_LEAD_MARK_US, ir.NEC_REPEAT_SPACE_US, ir.NEC_BIT_MARK_US]
+
+def captures(pulses, t0, rng=None, jitter_us=0):
+    """ Timer captures of the edges around a list of pulses
+
+    @param pulses pulse lengths in us
+    @param t0 capture of the first edge
+    @param rng random.Random used for jitter
+    @param jitter_us largest error added to each pulse
+    @return list of 16-bit captures, one more than there are pulses """
+    t = t0 & 0xffff
+    evts = [t]
+    for pulse in pulses:
+        if jitter_us:
+            pulse += rng.randint(-jitter_us, jitter_us)
+        t = (t + pulse) & 0xffff
+        evts.append(t)
+    return evts
+
+def baseline_decode(evts):
+    """ Original decode of a full frame of captures
+
+    @return command, or None """
+    pulses = ir.evt_time_to_pulse_len(evts)
+    pulses_ms = ir.ticks_to_ms(pulses, ir.IR_TMR_FREQ)
+    packet = ir.psls_to_logic_in_dct(pulses_ms)
+    return None if packet is None else packet['cmd']
+
+def stream_decode(evts, decoder):
+    """ Streaming decode of captures, one edge at a time
+
+    @return command of the last frame completed, or None """
+    cmd = None
+    for evt in evts:
+        if decoder.feed(evt):
+            cmd = decoder.cmd
+    return cmd
+
+def make_frames(n, rng, jitter_us):
+    """ n frames with random commands, each starting at a random capture so
+    plenty of them wrap the timer """
+    frames = []
+    for _ in range(n):
+        cmd = rng.randrange(256)
+        frames.append((cmd, captures(nec_pulses(0x00, cmd), rng.randrange(65536), rng, jitter_us)))
+    return frames
+
+def heap_per_frame(fun, evts):
+    """ Peak heap bytes CPython allocates decoding one frame """
+    fun(evts)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    fun(evts)
+    alloc = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return alloc
+
+def measure(name, fun, frames):
+    """ Decode every frame through fun and report rate, accuracy and allocation """
+    ok = 0
+    start = time.perf_counter()
+    for cmd, evts in frames:
+        if fun(evts) == cmd:
+            ok += 1
+    us = (time.perf_counter() - start)*1e6/len(frames)
+    alloc = heap_per_frame(fun, frames[0][1])
+    print('{:<10s}{: 10.1f}{: 10.1f}{: 8d}/{:<8d}{: 8d}'.format(name, us, 1e6/us, ok,
+        len(frames), alloc))
+
+def corrupt(evts, rng):
+    """ Damage a capture list the ways a real receiver does: truncation,
+    spurious edges, dropped edges or plain noise """
+    kind = rng.randrange(4)
+    if kind == 0:
+        return evts[:rng.randrange(len(evts))]
+    evts = list(evts)
+    if kind == 1:
+        for _ in range(rng.randint(1, 4)):
+            i = rng.randrange(1, len(evts))
+            evts.insert(i, (evts[i - 1] + rng.randint(1, 400)) & 0xffff)
+    elif kind == 2:
+        for _ in range(rng.randint(1, 4)):
+            del evts[rng.randrange(len(evts))]
+    else:
+        evts = [rng.randrange(65536) for _ in range(rng.randint(0, 2*FRAME_EDGES))]
+    return evts
+
+def fuzz(n, rng):
+    """ Feed corrupted and random streams to both decoders. The baseline is
+    only ever handed full 68 edge lists, as the queue gave it. A wrong command
+    is a decode of something other than the frame the stream was made from. """
+    print('FUZZ      STREAMS   CRASHES     WRONG')
+    crashes = [0, 0]
+    wrong = [0, 0]
+    decoder = ir.NecDecoder()
+    quiet = io.StringIO()
+    for _ in range(n):
+        cmd = rng.randrange(256)
+        evts = corrupt(captures(nec_pulses(0x00, cmd), rng.randrange(65536), rng, 50), rng)
+
+        batch = evts[:FRAME_EDGES]
+        batch += [rng.randrange(65536) for _ in range(FRAME_EDGES - len(batch))]
+        try:
+            with contextlib.redirect_stdout(quiet):
+                got = baseline_decode(batch)
+            if got is not None and got != cmd:
+                wrong[0] += 1
+        except Exception:
+            crashes[0] += 1
+
+        decoder.reset()
+        try:
+            got = stream_decode(evts, decoder)
+            if got is not None and got != cmd:
+                wrong[1] += 1
+        except Exception:
+            crashes[1] += 1
+
+    for name, i in (('baseline', 0), ('stream', 1)):
+        print('{:<10s}{: 8d}{: 10d}{: 10d}'.format(name, n, crashes[i], wrong[i]))
+
+def check_repeats(rng):
+    """ A frame followed by held button repeat codes and a resync mid-frame """
+    decoder = ir.NecDecoder()
+    evts = captures(nec_pulses(0x00, ir.IR_START_CMD), 60000, rng, 50)
+    assert stream_decode(evts, decoder) == ir.IR_START_CMD
+    assert decoder.seq == 1 and decoder.repeats == 0
+
+    # Each repeat code completes on its last edge and repeats the command
+    for n in range(1, 4):
+        repeat = captures(repeat_pulses(), evts[-1] + 40000, rng, 50)
+        done = [decoder.feed(evt) for evt in repeat]
+        assert done == [False]*(len(repeat) - 1) + [True], done
+        assert decoder.repeats == n and decoder.cmd == ir.IR_START_CMD and decoder.seq == 1
+        evts = repeat
+
+    # A new frame's leader starts on the last edge of a partial one
+    partial = captures(nec_pulses(0x00, 7), evts[-1] + 40000, rng, 50)[:30]
+    evts = partial + captures(nec_pulses(0x00, 9), partial[-1], rng, 50)[1:]
+    stream_decode(evts, decoder)
+    print(decoder)
+    assert decoder.seq == 2 and decoder.cmd == 9 and decoder.resyncs == 1 and decoder.repeats == 0
+
+if __name__ == '__main__':
+    rng = random.Random(405)
+    print('PATH       US/FRAME  FRAMES/S   DECODED OK    HEAP B')
+    frames = make_frames(5000, rng, 0)
+    measure('baseline', baseline_decode, frames)
+    decoder = ir.NecDecoder()
+    measure('stream', lambda evts: stream_decode(evts, decoder), frames)
+
+    print('with 100 us of jitter')
+    frames = make_frames(5000, rng, 100)
+    measure('baseline', baseline_decode, frames)
+    measure('stream', lambda evts: stream_decode(evts, decoder), frames)
+
+    check_repeats(rng)
+    fuzz(20000, rng)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file line_bench.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Host checks for the line sensors' analog mode.
+#
+# The sensor pins are replaced by capacitors which read high until their decay
+# time has passed since release(), against a clock which steps a few us every
+# time it is read. LineArray.measure() is run with one sensor over the white
+# line and one over the black ring, which is still charged at the end of the
+# window, and the flags, grades and running calibration are checked.
+#
+# Run with: python line_bench.py
+
+import host_shims
+host_shims.install()
+
+import utime
+import line_sensor
+
+## Clock step in us each time the fake clock is read
+STEP_US = 3
+
+class FakeDecay:
+    """ Line sensor pin which stays high for decay_us after it is released """
+
+    def __init__(self, clock, decay_us):
+        self.clock = clock
+        self.decay_us = decay_us
+
+    def init(self, mode):
+        pass
+
+    def high(self):
+        pass
+
+    def value(self):
+        return 1 if self.clock.now - self.clock.released < self.decay_us else 0
+
+class FakeClock:
+    """ utime.ticks_us() which moves STEP_US forward each time it is read """
+
+    def __init__(self):
+        self.now = 0
+        self.released = 0
+
+    def ticks_us(self):
+        self.now += STEP_US
+        return self.now
+
+class _Sensor:
+    def __init__(self, pin):
+        self.pin_sig = pin
+
+def make_array(decays):
+    """ LineArray of fake sensors with the given decay times in us """
+    clock = FakeClock()
+    utime.ticks_us = clock.ticks_us
+    pins = [FakeDecay(clock, t) for t in decays]
+    sensors = line_sensor.LineArray([_Sensor(pin) for pin in pins])
+    return sensors, clock, pins
+
+def run(sensors, clock, n=1):
+    """ Charge, release and measure the sensors n times """
+    flags = 0
+    for _ in range(n):
+        sensors.release()
+        clock.released = sensors.release_us
+        flags = sensors.measure()
+    return flags
+
+def check_saturated():
+    """ A sensor still charged at the end of the window is on the ring and
+    leaves the calibration alone, even though the window is shorter than the
+    midpoint between the starting white and black estimates """
+    sensors, clock, pins = make_array((150, line_sensor.SLP_T*4))
+    window = sensors.window_us()
+    assert window < (line_sensor.WHITE_T + line_sensor.SLP_T) >> 1, window
+    flags = run(sensors, clock, 50)
+    print('saturated: window {:d} us flags {:#x} grades {} white {} black {}'.format(window, flags,
+        list(sensors.grades), list(sensors.white_us), list(sensors.black_us)))
+    assert sensors.decay_us[1] >= sensors.window_us()
+    assert flags == 0x01, flags
+    assert sensors.grades[1] == 255
+    assert sensors.white_us[1] == line_sensor.WHITE_T
+    assert sensors.black_us[1] == line_sensor.SLP_T
+    assert abs(sensors.white_us[0] - 150) < 1 << line_sensor.CAL_SHIFT, sensors.white_us[0]
+
+if __name__ == '__main__':
+    check_saturated()
+    print('ok')
@@ -4,11 +4,30 @@
 @author: Ethan Czuppa
 """
 
+import array
 import pyb
 import utime
+import task_share
 
 RS_T = 10    # rise time to let pulse rise after being driven high in microseconds
 SLP_T = 1000   # sleep time waiting for pulse to decay in microseconds
+WHITE_T = 200   # initial guess at decay time over the white line in microseconds
+CAL_SHIFT = 3   # running calibration moves 1/2^CAL_SHIFT of the way to each new reading
+ANALOG_PERIOD_MS = 10   # time between analog measurements, the fusion task's period
+
+## Sample once at the end of a fixed decay window
+MODE_DIGITAL = 0
+## Time each sensor's decay and grade it against a running calibration
+MODE_ANALOG = 1
+
+## Acquisition mode used by the line sensor task
+Mode = MODE_DIGITAL
+
+## Bits in LineFlags for each of the line sensors
+FRONT_LEFT = 0x01
+FRONT_RIGHT = 0x02
+BACK_LEFT = 0x04
+BACK_RIGHT = 0x08
 
 class LineSense:
     """
@@ -40,8 +59,169 @@ class LineSense:
             return True
         return False
 
+class LineArray:
+    """
+    Reads a group of line sensors at once. All of the sensors are charged
+    together and then share a single decay window, which is split across
+    scheduler runs so the CPU is free while the sensors decay.
+    """
+    def __init__(self, sensors):
+        """
+        @param sensors LineSense objects, in the order of their bits in the result
+        """
+        self._pins = tuple(sens.pin_sig for sens in sensors)
+        self.release_us = 0
+
+        n = len(self._pins)
+        ## Decay time of each sensor from the last measure(), in microseconds
+        self.decay_us = array.array('H', [SLP_T]*n)
+        ## Grade of each sensor from the last measure(), 0 on the line to 255 on the ring
+        self.grades = bytearray(n)
+        ## Running estimate of each sensor's decay time over the white line
+        self.white_us = array.array('H', [WHITE_T]*n)
+        ## Running estimate of each sensor's decay time over the black ring
+        self.black_us = array.array('H', [SLP_T]*n)
+
+    def charge(self):
+        """ Drive all sensor pins high to charge the sensors """
+        for pin in self._pins:
+            pin.init(pyb.Pin.OUT_PP)
+            pin.high()
+
+    def release(self):
+        """ Switch all sensor pins to inputs and start the decay window """
+        for pin in self._pins:
+            pin.init(pyb.Pin.IN)
+        self.release_us = utime.ticks_us()
+
+    def decayed(self):
+        """ Checks if the decay window since release() has passed """
+        return utime.ticks_diff(utime.ticks_us(), self.release_us) >= SLP_T
+
+    def sample(self):
+        """
+        Read all sensors at the end of the decay window
+        @return bitmask with a bit set for each sensor which sees the line
+        """
+        flags = 0
+        bit = 1
+        for pin in self._pins:
+            if not pin.value():
+                flags |= bit
+            bit <<= 1
+        return flags
+
+    def window_us(self):
+        """
+        Length of the decay window needed in analog mode. The line decays fastest,
+        so once every sensor has had twice its white decay time, anything still
+        charged is on the ring and there is no need to wait the full SLP_T.
+        """
+        longest = 0
+        for t in self.white_us:
+            if t > longest:
+                longest = t
+        longest *= 2
+        return longest if longest < SLP_T else SLP_T
+
+    def measure(self):
+        """
+        Time each sensor's decay after release() by polling the pins, then
+        grade the readings and update the running white/black calibration.
+        Polls for at most window_us().
+        @return bitmask with a bit set for each sensor which sees the line
+        """
+        window = self.window_us()
+        decay = self.decay_us
+        n = len(self._pins)
+        for i in range(n):
+            decay[i] = window
+
+        pending = (1 << n) - 1
+        while pending:
+            dt = utime.ticks_diff(utime.ticks_us(), self.release_us)
+            if dt >= window:
+                break
+            for i in range(n):
+                bit = 1 << i
+                if pending & bit and not self._pins[i].value():
+                    decay[i] = dt
+                    pending &= ~bit
+
+        flags = 0
+        for i in range(n):
+            t = decay[i]
+            white = self.white_us[i]
+            black = self.black_us[i]
+            thresh = (white + black) >> 1
+            if thresh >= window:
+                thresh = window - 1
+
+            if t >= window:
+                # Still charged at the end of the window, so on the ring, but
+                # saturated readings say nothing about how dark the ring is
+                self.grades[i] = 255
+                continue
+            if t < thresh:
+                flags |= 1 << i
+                self.white_us[i] = white + ((t - white) >> CAL_SHIFT)
+            else:
+                self.black_us[i] = black + ((t - black) >> CAL_SHIFT)
+
+            if t <= white:
+                self.grades[i] = 0
+            elif t >= black or black <= white:
+                self.grades[i] = 255
+            else:
+                self.grades[i] = (t - white)*255//(black - white)
+        return flags
+
+def handler():
+    """
+    Task which keeps LineFlags up to date. In digital mode each run either
+    returns right away because the sensors are still decaying, or samples them,
+    publishes the result and charges them again for the next window. In analog
+    mode the decay has to be timed to the microsecond, so the task polls the
+    sensors for up to the whole calibrated window. That only happens once every
+    ANALOG_PERIOD_MS, as often as the fusion task reads the result, and every
+    other run returns right away, so at the task's 1 ms period it takes 4 to 10%
+    of the CPU instead of 40 to 100%.
+    """
+    Sensors.charge()
+    utime.sleep_us(RS_T)
+    Sensors.release()
+    next_analog = utime.ticks_ms()
+
+    while True:
+        yield(0)
+        if Mode == MODE_ANALOG:
+            now = utime.ticks_ms()
+            if utime.ticks_diff(now, next_analog) < 0:
+                continue
+            next_analog = utime.ticks_add(now, ANALOG_PERIOD_MS)
+            Sensors.charge()
+            utime.sleep_us(RS_T)
+            Sensors.release()
+            LineFlags.put(Sensors.measure())
+            continue
+
+        if not Sensors.decayed():
+            continue
+
+        LineFlags.put(Sensors.sample())
+
+        Sensors.charge()
+        utime.sleep_us(RS_T)
+        Sensors.release()
+
 ## Sumo Bot Line Sensors
 FrontRight = LineSense(pyb.Pin.board.PA4, pyb.Pin.OUT_PP)
 FrontLeft = LineSense(pyb.Pin.board.PC4, pyb.Pin.OUT_PP)
 BackRight = LineSense(pyb.Pin.board.PA3, pyb.Pin.OUT_PP)
 BackLeft = LineSense(pyb.Pin.board.PA5, pyb.Pin.OUT_PP)
+
+## All four line sensors, in FRONT_LEFT, FRONT_RIGHT, BACK_LEFT, BACK_RIGHT bit order
+Sensors = LineArray((FrontLeft, FrontRight, BackLeft, BackRight))
+
+## Latest line sensor snapshot, a bitmask of the sensors which see the line
+LineFlags = task_share.Share('B', thread_protect = False, name = 'Line Flags')
@@ -14,6 +14,13 @@ import ir
 import drive
 import motor_driver
 import strategy
+import fusion
+import line_sensor
+import tof
+import i2c
+import accel
+import recorder
+import telemetry
 
 from micropython import alloc_emergency_exception_buf
 alloc_emergency_exception_buf (100)
@@ -21,18 +28,44 @@ alloc_emergency_exception_buf (100)
 if __name__ == '__main__':
     ir.init()
 
-    strategy.Strategy = strategy.BasicStrategy()
+    # Every strategy can be started from its own button on the remote
+    ir.IR_START_CMDS = tuple(strategy.Strategies)
 
     drive_task = cotask.Task(drive.handler, name = 'Drive Task', priority = 1, period = 20,
                         profile = True, trace = False)
+    fusion_task = cotask.Task(fusion.handler, name = 'Fusion Task', priority = 2, period = 10,
+                        profile = True, trace = False)
     strategy_task = cotask.Task(strategy.handler, name = 'Strategy Task', priority = 1, period = 10,
                         profile = True, trace = False)
+    line_task = cotask.Task(line_sensor.handler, name = 'Line Task', priority = 2, period = 1,
+                        profile = True, trace = False)
+    tof_task = cotask.Task(tof.handler, name = 'TOF Task', priority = 1, period = 5,
+                        profile = True, trace = False)
+    i2c_task = cotask.Task(i2c.handler, name = 'I2C Task', priority = 1, period = 5,
+                        profile = True, trace = False)
+    # The accelerometer is optional, so there's no task for it if it's missing
+    accel_task = None
+    if accel.Accel is not None:
+        accel_task = cotask.Task(accel.handler, name = 'Accel Task', priority = 1, period = 20,
+                            profile = True, trace = False)
     ir_task = cotask.Task(ir.handler, name = 'IR Task', priority = 2, period = 50,
                         profile = True, trace = False)
+    telemetry_task = cotask.Task(telemetry.handler, name = 'Telemetry Task', priority = 0, period = 20,
+                        profile = True, trace = False)
 
     cotask.task_list.append(drive_task)
+    cotask.task_list.append(fusion_task)
     cotask.task_list.append(strategy_task)
+    cotask.task_list.append(line_task)
+    cotask.task_list.append(tof_task)
+    cotask.task_list.append(i2c_task)
+    if accel_task is not None:
+        cotask.task_list.append(accel_task)
     cotask.task_list.append(ir_task)
+    cotask.task_list.append(telemetry_task)
+
+    telemetry.Tasks = tuple(task for task in (drive_task, fusion_task, strategy_task, line_task,
+                            tof_task, i2c_task, accel_task, ir_task, telemetry_task) if task is not None)
 
     # Python's memory management for unused variables
     gc.collect()
@@ -46,11 +79,23 @@ if __name__ == '__main__':
     vcp.read ()
 
     # Stop motors on program exit
-    motor_driver.Left.set_duty_cycle(0)
-    motor_driver.Right.set_duty_cycle(0)
+    motor_driver.set_duty_cycles(0, 0)
+
+    # Keep the log of a match which was stopped from the console
+    if not recorder.Match.saved:
+        recorder.Match.save()
 
     # Print a table of task data and a table of shared information data
     print ('\n' + str (cotask.task_list) + '\n')
     print (task_share.show_all())
+    print (i2c.show_all())
+    print ('Left  ' + str (motor_driver.Left))
+    print ('Right ' + str (motor_driver.Right))
+    print (ir.Decoder)
+    print ('TOF mode {:d} us, {:d} sensors refused a mode'.format (tof.Mode, tof.Sensors.mode_errors))
+    print ('Telemetry {:d} frames, {:d} dropped'.format (telemetry.Frames, telemetry.Dropped))
+    for strat in strategy.Strategies.values():
+        print (strat)
+        print (strat.get_trace())
     print (ir_task.get_trace())
     print ('\r\n')
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file match_replay.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Host replayer for match logs written by recorder.py.
+#
+# Each record is turned back into the snapshot the fusion task published from
+# it, and stepped through a strategy with the drive task run on the same
+# records it ran between on the robot, against stand-in encoders and motors
+# which report the recorded ticks. Nothing in a replay depends on the laptop's
+# clock, so the same log and strategy always make the same decisions. The
+# replayed strategy states and duty cycles are checked against the ones
+# recorded, so a replay of unchanged code should agree with the robot; a
+# strategy that has been changed since shows where it would have decided
+# differently.
+#
+# The drive task reads the encoders at its own times, which aren't in the log,
+# so it is run on the readings of the record before the one it was logged
+# against. On the robot that is up to one fusion period early and duty cycles
+# may be off by a little; logs from match_sim.py replay exactly.
+#
+# Run with:
+#   python match_replay.py match.bin                       (log copied off the robot)
+#   python match_replay.py match.bin --strategy SearchStrategy --csv replay.csv
+
+import host_shims
+host_shims.install()
+
+import argparse
+import array
+import struct
+
+import utime
+import bearing_lut
+import drive
+import encoder
+import ir
+import motor_cal
+import motor_driver
+import recorder
+import snapshot
+import strategy
+import tracker
+
+class Log:
+    """ Columns of a match log, oldest record first """
+
+    def __init__(self, columns, count):
+        ## Dictionary of column name to array, as named in recorder.COLUMNS
+        self.columns = columns
+        ## Records taken during the match, more than len(self) if the ring wrapped
+        self.count = count
+
+    def __len__(self):
+        return len(self.columns['time_ms'])
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['columns'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+def load(path):
+    """ Read a log written by recorder.Recorder.save()
+
+    @return Log """
+    with open(path, 'rb') as f:
+        data = f.read()
+    size = struct.calcsize(recorder.HEADER)
+    magic, version, ncols, n, count = struct.unpack(recorder.HEADER, data[:size])
+    if magic != recorder.MAGIC or version != recorder.VERSION:
+        raise ValueError('{:s} is not a version {:d} match log'.format(path, recorder.VERSION))
+    codes = data[size:size + ncols].decode()
+    pos = size + ncols
+
+    columns = {}
+    for (name, _), code in zip(recorder.COLUMNS, codes):
+        col = array.array(code)
+        nbytes = n*col.itemsize
+        col.frombytes(data[pos:pos + nbytes])
+        pos += nbytes
+        columns[name] = col
+    return Log(columns, count)
+
+class _Wheel:
+    """ Stands in for an encoder and motor driver, reporting recorded ticks
+    and keeping the duty cycle the drive task sets """
+
+    def __init__(self):
+        self.ticks = 0
+        self.duty = 0
+
+    def read(self):
+        return self.ticks
+
+    def zero(self):
+        self.ticks = 0
+
+    def set_duty_cycle(self, level):
+        if level > 100:
+            level = 100
+        elif level < -100:
+            level = -100
+        self.duty = level
+
+class Replay:
+    """ Result of replaying a log through a strategy """
+
+    def __init__(self):
+        ## Replayed (state, left duty, right duty) for each record, as the
+        # recorder would have logged them
+        self.rows = []
+        ## Records where the replayed strategy state differs from the recorded one
+        self.state_diffs = []
+        ## Largest difference between replayed and recorded duty cycles in percent
+        self.max_duty_diff = 0
+        ## (time_ms, state name, drive command class name) for each state change
+        self.transitions = []
+
+def replay(log, strat, lut=None):
+    """ Feed a log through a strategy and the drive task
+
+    @param log Log to replay
+    @param strat strategy instance, e.g. strategy.BasicStrategy()
+    @param lut bearing_lut.BearingLut the robot was running with, or None if it
+           used the weighted bearing formula
+    @return Replay """
+    result = Replay()
+    if not len(log):
+        return result
+
+    clock = [log.time_ms[0]]
+    utime.ticks_ms = lambda: clock[0]
+    left = _Wheel()
+    right = _Wheel()
+    encoder.Left = motor_driver.Left = left
+    encoder.Right = motor_driver.Right = right
+    drive.DriveCommand = None
+    drive.CommandQueue = []
+    drive._Pending = None
+
+    def at(i):
+        clock[0] = log.time_ms[i]
+        left.ticks = log.l_ticks[i]
+        right.ticks = log.r_ticks[i]
+
+    # The drive task has been running since boot; start it one period before
+    # the log as if the robot sat still until then
+    at(0)
+    clock[0] -= 20
+    drive_task = drive.handler()
+    next(drive_task)
+
+    snap = strategy.SensorState([0, 0, 0, 0], None, None, None, 0, 0)
+    pub = snapshot.Publisher(snap, tracker.OpponentTracker(), lut)
+    last_enc = None
+
+    for i in range(len(log)):
+        if i and log.flags[i] & recorder.FLAG_DRIVE:
+            at(i - 1)
+            next(drive_task)
+        at(i)
+        now = clock[0]
+
+        # Publish the snapshot the way the fusion task does
+        if last_enc is None:
+            l_enc, r_enc = encoder.read()
+            dt = 0
+            last_l_enc = last_r_enc = None
+        else:
+            last_l_enc, last_r_enc = last_enc
+            l_enc, r_enc = encoder.read(last_l_enc, last_r_enc)
+            dt = now - last_l_enc.time_ms
+        last_enc = (l_enc, r_enc)
+
+        tof = None
+        if log.flags[i] & recorder.FLAG_TOF:
+            tof = (log.tof_l[i], log.tof_c[i], log.tof_r[i])
+        pub.publish(now, dt, l_enc, r_enc, last_l_enc, last_r_enc, tof, log.line[i])
+
+        # Compare against what was recorded alongside this record
+        duties = (int(left.duty), int(right.duty))
+        result.rows.append((strat.state,) + duties)
+        if log.state[i] != recorder.NO_STATE and log.state[i] != strat.state:
+            result.state_diffs.append(i)
+        result.max_duty_diff = max(result.max_duty_diff, abs(duties[0] - log.duty_l[i]),
+                                   abs(duties[1] - log.duty_r[i]))
+
+        if strat.step(snap):
+            snap.line_reset = True
+            # The drive task starts the new command on its next run
+            cmd = drive._Pending[0] if drive._Pending is not None else drive.DriveCommand
+            result.transitions.append((now, strat.state_name(), type(cmd).__name__))
+    return result
+
+def strategy_for(log):
+    """ Fresh instance of the strategy the robot ran, picked by its IR start command """
+    cmd = log.ir_cmd[0] if len(log) else ir.IR_START_CMD
+    strat = strategy.Strategies.get(cmd, strategy.Strategies[ir.IR_START_CMD])
+    return type(strat)()
+
+def write_csv(log, result, path):
+    """ Write every record next to its replayed state and duty cycles """
+    names = [name for name, _ in recorder.COLUMNS]
+    with open(path, 'w') as f:
+        f.write(','.join(names + ['replay_state', 'replay_duty_l', 'replay_duty_r']) + '\n')
+        for i in range(len(log)):
+            vals = [log.columns[name][i] for name in names] + list(result.rows[i])
+            f.write(','.join(str(v) for v in vals) + '\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a match log through the strategy and drive code')
+    parser.add_argument('log', help='log written by recorder.py, e.g. match.bin')
+    parser.add_argument('--strategy', help='strategy class to replay with (default the one the robot ran)')
+    parser.add_argument('--lut', help='bearing_lut.bin the robot was running with')
+    parser.add_argument('--cal', help='motor_cal.txt the robot was running with')
+    parser.add_argument('--csv', help='write every record and its replay to this file')
+    args = parser.parse_args()
+
+    log = load(args.log)
+    strat = getattr(strategy, args.strategy)() if args.strategy else strategy_for(log)
+    lut = None
+    if args.lut:
+        lut = bearing_lut.load(args.lut)
+    motor_cal.Left, motor_cal.Right = motor_cal.load(args.cal) if args.cal else (None, None)
+
+    if log.count > len(log):
+        print('log holds the last {:d} of {:d} records; decisions before the first one are lost, '
+              'so the start of the replay may not agree'.format(len(log), log.count))
+    result = replay(log, strat, lut)
+
+    print('{:s}: {:d} records, {:d} ms'.format(strat.NAME, len(log),
+        log.time_ms[-1] - log.time_ms[0] if len(log) else 0))
+    for time_ms, name, cmd in result.transitions:
+        print('{: 10d}: {:<12s}{:s}'.format(time_ms, name, cmd))
+    print('{:d} records with a different strategy state, duty cycles within {:d} %'.format(
+        len(result.state_diffs), result.max_duty_diff))
+    if result.state_diffs:
+        print('first difference at {:d} ms'.format(log.time_ms[result.state_diffs[0]]))
+    if args.csv:
+        write_csv(log, result, args.csv)
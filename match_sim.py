@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file match_sim.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Headless SUMO match simulator and strategy tournament runner.
+#
+# Two bots are simulated on a 77 cm dohyo. Each has a pair of plant.MotorPlant
+# drive motors, three forward TOF sensors and two front line sensors, and runs
+# a strategy class and the drive task from the robot code, fed the same
+# SensorState snapshots the fusion task publishes on the robot. drive keeps its
+# state in module globals, so each bot's copy of them is swapped in before that
+# bot's strategy or drive task runs.
+#
+# Matches are seeded, so any result can be played again exactly. The runner
+# spreads matches across a multiprocessing pool and reports each entry's win
+# rate and the time it took to push the opponent out. A single match can also be
+# recorded in the robot's recorder format, for trying out match_replay.py.
+#
+# Run with, for example:
+#   python match_sim.py --matches 500 --strategy BasicStrategy --strategy SearchStrategy
+#   python match_sim.py --gauntlet --grid FWD_SPEED=0.012,0.014,0.016 --grid TURN_DEG=110,125,140
+#   python match_sim.py --record match.bin --seed 3
+
+import host_shims
+host_shims.install()
+
+import argparse
+import itertools
+import math
+import multiprocessing
+import random
+import sys
+
+import utime
+import drive
+import encoder
+import ir
+import motor_cal
+import motor_driver
+import plant
+import recorder
+import snapshot
+import strategy
+import tracker
+
+## Radius of the dohyo in mm
+RING_R = 385
+
+## Width of the white border at the edge of the dohyo in mm
+LINE_W = 25
+
+## Radius of a bot's footprint in mm
+BOT_R = 60
+
+## Line sensor positions on the bot as (forward, right) in mm: front left, front right
+LINE_POS = ((50, -40), (50, 40))
+
+## TOF sensor axes in degrees clockwise from straight ahead: left, center, right
+TOF_AXES = (-20, 0, 20)
+
+## Half of a TOF sensor's field of view in degrees
+TOF_HALF_FOV = 12.5
+
+## Distance in mm from the center of the bot forward to the TOF sensors
+TOF_FWD = 40
+
+## Longest distance the TOF sensors report before tof.TOF clamps it to 0
+TOF_MAX_MM = 1000
+
+## Standard deviation of TOF distance noise in mm
+TOF_NOISE_MM = 5
+
+## Largest fractional difference in gain between any two simulated motors
+MOTOR_GAIN_SPREAD = 0.05
+
+## Largest fractional difference in how hard two bots can push at the same duty
+# cycle, from differences in weight and tires
+TRACTION_SPREAD = 0.1
+
+## Time between TOF frames in ms, the default 33 ms timing budget
+TOF_PERIOD_MS = 33
+
+## Task periods in ms, as in main.py
+STRATEGY_PERIOD_MS = 10
+DRIVE_PERIOD_MS = 20
+
+## Physics time step in ms
+STEP_MS = 5
+
+## Matches still undecided after this long are draws
+MATCH_MS = 30000
+
+MM_PER_TICK = encoder.INCHES_PER_TICK*snapshot.MM_PER_IN
+
+## Distance between the wheels in mm, from how far the encoders say the bot turns per tick
+WHEEL_BASE = 2*MM_PER_TICK/math.radians(encoder.DEG_PER_TICK)
+
+def _calibrate():
+    """ Motor calibration of the plant model, as motor_cal.run() would store on the robot """
+    table = motor_cal.DutyTable()
+    sim = plant.MotorPlant()
+    for _ in motor_cal.calibrate(table, sim, sim, sim.ticks_ms):
+        sim.advance(STEP_MS)
+    return table
+
+motor_cal.Left = motor_cal.Right = _calibrate()
+
+# Free running speed of a bot at full duty cycle in mm/ms
+_V_MAX = plant.MotorPlant().steady_state_vel(100)*MM_PER_TICK
+
+class Bot:
+    """ One simulated bot and its copy of the robot code's state """
+
+    def __init__(self, strat, x, y, heading, rng, noise):
+        """ @param strat strategy instance to run
+            @param x, y starting position in mm from the center of the dohyo
+            @param heading starting heading in radians, counterclockwise from +x
+            @param rng random.Random for sensor and motor noise
+            @param noise standard deviation of wheel velocity noise in ticks/ms """
+        self.strat = strat
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self._rng = rng
+        self.left = plant.MotorPlant(noise=noise, rng=rng)
+        self.right = plant.MotorPlant(noise=noise, rng=rng)
+        # No two motors or bots are quite the same
+        for motor in (self.left, self.right):
+            motor.gain *= 1 + rng.uniform(-MOTOR_GAIN_SPREAD, MOTOR_GAIN_SPREAD)
+        self.traction = 1 + rng.uniform(-TRACTION_SPREAD, TRACTION_SPREAD)
+
+        # This bot's copies of the drive module's globals
+        self._drive_cmd = None
+        self._queue = []
+        self._pending = None
+
+        self.snap = strategy.SensorState([0, 0, 0, 0], None, None, None, 0, 0)
+        self.tracker = tracker.OpponentTracker()
+        # Same publisher as the fusion task, without a bearing table
+        self._pub = snapshot.Publisher(self.snap, self.tracker)
+        self._tof = [0, 0, 0]
+        self._new_frame = False
+        self._last_enc = None
+        self._drive = None
+        self._drive_ran = False
+
+        ## recorder.Recorder logging what this bot's strategy sees, or None
+        self.rec = None
+        # IR command the robot would have been started with for this strategy
+        self._ir_cmd = ir.IR_START_CMD
+        for cmd, strat_obj in strategy.Strategies.items():
+            if type(strat_obj) is type(strat):
+                self._ir_cmd = cmd
+
+    def swap_in(self):
+        drive.DriveCommand = self._drive_cmd
+        drive.CommandQueue = self._queue
+        drive._Pending = self._pending
+        encoder.Left = motor_driver.Left = self.left
+        encoder.Right = motor_driver.Right = self.right
+
+    def swap_out(self):
+        self._drive_cmd = drive.DriveCommand
+        self._queue = drive.CommandQueue
+        self._pending = drive._Pending
+
+    def start_drive(self):
+        """ Start the drive task, which takes its first encoder reading """
+        self.swap_in()
+        self._drive = drive.handler()
+        next(self._drive)
+        self.swap_out()
+
+    def run_drive(self):
+        """ Run the drive task once """
+        self.swap_in()
+        next(self._drive)
+        self._drive_ran = True
+        self.swap_out()
+
+    def run_strategy(self, now, dt):
+        """ Publish a snapshot the way the fusion task does and step the strategy """
+        self.swap_in()
+        last = self._last_enc
+        l_enc, r_enc = encoder.read() if last is None else encoder.read(last[0], last[1])
+        self._last_enc = (l_enc, r_enc)
+
+        new_frame = self._new_frame
+        self._new_frame = False
+        line = 0
+        for i in range(2):
+            if self.on_line(i):
+                line |= snapshot.LINE_BITS[i]
+
+        self._pub.publish(now, dt, l_enc, r_enc, None if last is None else last[0],
+                          None if last is None else last[1], self._tof if new_frame else None, line)
+
+        if self.rec is not None:
+            flags = 0
+            if new_frame:
+                flags |= recorder.FLAG_TOF
+            if self._drive_ran:
+                flags |= recorder.FLAG_DRIVE
+            self._drive_ran = False
+            self.rec.record(now, l_enc.ticks, r_enc.ticks, self._tof, line, self._ir_cmd, flags,
+                            int(self.left.duty), int(self.right.duty), self.strat.state)
+
+        if self.strat.step(self.snap):
+            self.snap.line_reset = True
+        self.swap_out()
+
+    def on_line(self, i):
+        """ True if line sensor i is over the white border, or off the dohyo """
+        fwd, right = LINE_POS[i]
+        c = math.cos(self.heading)
+        s = math.sin(self.heading)
+        x = self.x + fwd*c + right*s
+        y = self.y + fwd*s - right*c
+        return x*x + y*y > (RING_R - LINE_W)**2
+
+    def read_tof(self, other):
+        """ Take a TOF frame of the other bot, which corrects the tracker on the
+        next strategy run. Each sensor reports the nearest point of the other
+        bot along its axis or the edges of its field of view. """
+        ox = self.x + TOF_FWD*math.cos(self.heading)
+        oy = self.y + TOF_FWD*math.sin(self.heading)
+        cx = other.x - ox
+        cy = other.y - oy
+        c2 = cx*cx + cy*cy - BOT_R*BOT_R
+
+        for i in range(3):
+            nearest = 0
+            for edge in (-TOF_HALF_FOV, 0, TOF_HALF_FOV):
+                # Sensor angles are clockwise, headings counterclockwise
+                ang = self.heading - math.radians(TOF_AXES[i] + edge)
+                proj = cx*math.cos(ang) + cy*math.sin(ang)
+                disc = proj*proj - c2
+                if proj <= 0 or disc < 0:
+                    continue
+                hit = proj - math.sqrt(disc)
+                if 0 <= hit <= TOF_MAX_MM and (nearest == 0 or hit < nearest):
+                    nearest = hit
+            self._tof[i] = 0
+            if nearest:
+                self._tof[i] = max(1, int(nearest + self._rng.gauss(0, TOF_NOISE_MM)))
+        self._new_frame = True
+
+    def move(self, dt):
+        """ Advance the motors and integrate the bot's position as if its
+        wheels roll freely """
+        self.left.advance(dt)
+        self.right.advance(dt)
+        v_l = self.left.vel*MM_PER_TICK
+        v_r = self.right.vel*MM_PER_TICK
+        v = (v_l + v_r)/2
+        self._x0 = self.x
+        self._y0 = self.y
+        self._fwd = v*dt
+        self.x += self._fwd*math.cos(self.heading)
+        self.y += self._fwd*math.sin(self.heading)
+        # Positive turns from the encoders are clockwise
+        self.heading -= (v_l - v_r)/WHEEL_BASE*dt
+
+    def push_force(self, nx, ny):
+        """ Force the bot drives into a contact in direction (nx, ny), in duty cycle percent """
+        along = math.cos(self.heading)*nx + math.sin(self.heading)*ny
+        return max(0.0, self.traction*(self.left.duty + self.right.duty)/2*along)
+
+    def slip(self, dt):
+        """ After a contact has moved the bot, make its wheels and encoders
+        follow how far it really went, so a blocked bot's controllers see it stall """
+        actual = (self.x - self._x0)*math.cos(self.heading) + (self.y - self._y0)*math.sin(self.heading)
+        corr = (actual - self._fwd)/MM_PER_TICK
+        for motor in (self.left, self.right):
+            motor.pos += corr
+            motor.vel += corr/dt
+
+    def out(self):
+        return self.x*self.x + self.y*self.y > RING_R*RING_R
+
+def _push(a, b, dt):
+    """ Resolve contact between the bots. Bots in contact move together along
+    the line between them, at a speed set by the difference in how hard each
+    drives into the other, and both bots' wheels are held to the distance they
+    actually moved. """
+    dx = b.x - a.x
+    dy = b.y - a.y
+    dist = math.hypot(dx, dy)
+    overlap = 2*BOT_R - dist
+    if overlap <= 0:
+        return
+    if dist == 0:
+        dx, dy, dist = 1.0, 0.0, 1.0
+    nx = dx/dist
+    ny = dy/dist
+    # Full duty cycle against no resistance pushes at the free running speed
+    shove = (a.push_force(nx, ny) - b.push_force(-nx, -ny))/100*_V_MAX*dt
+    b.x += nx*(overlap/2 + shove)
+    b.y += ny*(overlap/2 + shove)
+    a.x -= nx*(overlap/2 - shove)
+    a.y -= ny*(overlap/2 - shove)
+    a.slip(dt)
+    b.slip(dt)
+
+def make_strategy(name, params):
+    """ Create a strategy from the strategy module with some class attributes overridden
+
+    @param name class name in the strategy module, e.g. 'BasicStrategy'
+    @param params dictionary of attribute overrides, e.g. {'TURN_DEG': 110} """
+    strat = getattr(strategy, name)()
+    for key, val in params.items():
+        setattr(strat, key, val)
+    return strat
+
+def play(spec, rec=None):
+    """ Play one match
+
+    @param spec (seed, (name, params), (name, params)) for bots a and b
+    @param rec recorder.Recorder to log bot a's side of the match in, or None
+    @return (result, time_ms) where result is 1 if a won, -1 if b won and 0 for a draw """
+    seed, (name_a, params_a), (name_b, params_b) = spec
+    rng = random.Random(seed)
+
+    # Start the bots on opposite sides of the center, roughly facing each other
+    sep = rng.uniform(150, 250)
+    axis = rng.uniform(0, 2*math.pi)
+    c = math.cos(axis)
+    s = math.sin(axis)
+    bots = (
+        Bot(make_strategy(name_a, params_a), -sep*c, -sep*s,
+            axis + math.radians(rng.uniform(-30, 30)), rng, 0.02),
+        Bot(make_strategy(name_b, params_b), sep*c, sep*s,
+            axis + math.pi + math.radians(rng.uniform(-30, 30)), rng, 0.02),
+    )
+    a, b = bots
+    a.rec = rec
+
+    # The drive tasks have been running since boot, one period before the match
+    now = 1000 - DRIVE_PERIOD_MS
+    utime.ticks_ms = lambda: now
+    for bot in bots:
+        bot.start_drive()
+
+    now = 1000
+    start = now
+    next_tof = [now + rng.randrange(TOF_PERIOD_MS) for _ in bots]
+    next_strategy = now
+    next_drive = now
+
+    while now - start < MATCH_MS:
+        if now >= next_strategy:
+            for i in range(2):
+                if now >= next_tof[i]:
+                    bots[i].read_tof(bots[1 - i])
+                    next_tof[i] += TOF_PERIOD_MS
+                bots[i].run_strategy(now, STRATEGY_PERIOD_MS)
+            next_strategy += STRATEGY_PERIOD_MS
+        if now >= next_drive:
+            for bot in bots:
+                bot.run_drive()
+            next_drive += DRIVE_PERIOD_MS
+
+        a.move(STEP_MS)
+        b.move(STEP_MS)
+        _push(a, b, STEP_MS)
+        now += STEP_MS
+
+        a_out = a.out()
+        b_out = b.out()
+        if a_out or b_out:
+            if a_out and b_out:
+                return 0, now - start
+            return (-1 if a_out else 1), now - start
+    return 0, MATCH_MS
+
+def _label(name, params):
+    if not params:
+        return name
+    return name + ' ' + ' '.join('{:s}={}'.format(k, v) for k, v in sorted(params.items()))
+
+def tournament(entries, matches, seed=0, jobs=None, gauntlet=False):
+    """ Play every pair of entries against each other, swapping sides every match
+
+    @param entries list of (strategy class name, params) pairs
+    @param matches number of matches per pairing
+    @param seed base seed; each match's seed is derived from it
+    @param jobs number of worker processes, or None for one per core
+    @param gauntlet only play each entry against the first one
+    @return list of per entry [wins, losses, draws, total win time, total loss time] """
+    pairs = [(0, j) for j in range(1, len(entries))] if gauntlet else \
+        list(itertools.combinations(range(len(entries)), 2))
+    specs = []
+    owners = []
+    for p, (i, j) in enumerate(pairs):
+        for k in range(matches):
+            match_seed = seed*1000003 + p*10007 + k
+            if k % 2:
+                specs.append((match_seed, entries[j], entries[i]))
+                owners.append((j, i))
+            else:
+                specs.append((match_seed, entries[i], entries[j]))
+                owners.append((i, j))
+
+    stats = [[0, 0, 0, 0, 0] for _ in entries]
+    with multiprocessing.Pool(jobs) as pool:
+        for (i, j), (result, time_ms) in zip(owners, pool.imap(play, specs, chunksize=8)):
+            if result == 0:
+                stats[i][2] += 1
+                stats[j][2] += 1
+                continue
+            win, lose = (i, j) if result > 0 else (j, i)
+            stats[win][0] += 1
+            stats[win][3] += time_ms
+            stats[lose][1] += 1
+            stats[lose][4] += time_ms
+    return stats
+
+def report(entries, stats):
+    print('{:<48s}{:>6s}{:>6s}{:>6s}{:>8s}{:>10s}{:>10s}'.format('ENTRY', 'WIN', 'LOSS',
+        'DRAW', 'WIN %', 'WIN MS', 'LOSS MS'))
+    order = sorted(range(len(entries)), key=lambda i: -stats[i][0]/max(1, sum(stats[i][:3])))
+    for i in order:
+        wins, losses, draws, win_ms, loss_ms = stats[i]
+        played = wins + losses + draws
+        print('{:<48s}{: 6d}{: 6d}{: 6d}{: 8.1f}{: 10.0f}{: 10.0f}'.format(_label(*entries[i]),
+            wins, losses, draws, 100*wins/max(1, played), win_ms/max(1, wins),
+            loss_ms/max(1, losses)))
+
+def _parse_grid(grids):
+    """ Expand --grid NAME=v1,v2 options into a list of params dictionaries """
+    axes = []
+    for grid in grids:
+        key, vals = grid.split('=')
+        axes.append([(key, int(v) if v.lstrip('-').isdigit() else float(v)) for v in vals.split(',')])
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated SUMO strategy tournaments')
+    parser.add_argument('--strategy', action='append', default=[],
+                        help='strategy class to enter, may be repeated (default BasicStrategy)')
+    parser.add_argument('--grid', action='append', default=[],
+                        help='NAME=v1,v2,... class attribute values to enter the first strategy with')
+    parser.add_argument('--matches', type=int, default=100, help='matches per pairing')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default one per core)')
+    parser.add_argument('--gauntlet', action='store_true',
+                        help='play every entry only against the first')
+    parser.add_argument('--record', metavar='PATH',
+                        help='play one match of the first two entries with --seed and write '
+                             'the first entry\'s recorder log to PATH')
+    args = parser.parse_args()
+
+    names = args.strategy or ['BasicStrategy']
+    entries = [(name, {}) for name in names]
+    if args.grid:
+        entries += [(names[0], params) for params in _parse_grid(args.grid)]
+    if args.record and len(entries) == 1:
+        entries.append(entries[0])
+    if len(entries) < 2:
+        sys.exit('Need at least two entries, e.g. two --strategy options or a --grid')
+
+    if args.record:
+        # Play with the motor calibration as it is stored, so the replay can load the same one
+        cal_path = args.record + '.cal'
+        motor_cal.save(motor_cal.Left, motor_cal.Right, cal_path)
+        motor_cal.Left, motor_cal.Right = motor_cal.load(cal_path)
+
+        # Big enough for a whole match
+        rec = recorder.Recorder(MATCH_MS//STRATEGY_PERIOD_MS)
+        result, time_ms = play((args.seed, entries[0], entries[1]), rec)
+        rec.save(args.record)
+        print('{:s} after {:d} ms'.format(('loss', 'draw', 'win')[result + 1], time_ms))
+        print('replay with: python match_replay.py {:s} --cal {:s}'.format(args.record, cal_path))
+        sys.exit()
+
+    report(entries, tournament(entries, args.matches, args.seed, args.jobs, args.gauntlet))
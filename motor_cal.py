@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file motor_cal.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Drive motor duty cycle to velocity calibration.
+#
+# calibrate() sweeps a motor through a set of duty cycles and records the steady
+# state encoder velocity at each one. The resulting lookup table gives the drive
+# layer a feedforward duty cycle for a target velocity and the deadband that has
+# to be added to small commands before the wheels move at all.
+#
+# On the robot, prop the bot up so the wheels spin freely and run
+# motor_cal.run() from the REPL. On a laptop, run this file to calibrate the
+# simulated motor in plant.py.
+#
+# run_steps() records the encoder through a series of duty cycle steps instead,
+# for gain_tune.py to fit a motor model to.
+
+import array
+try:
+    import utime
+except ImportError:
+    # Run as a host script against the plant model, see the end of the file
+    import host_shims
+    host_shims.install()
+    import utime
+
+## File the calibration tables are stored in on the board's flash
+CAL_FILE = 'motor_cal.txt'
+
+## Duty cycles visited during a calibration sweep, in percent
+SWEEP_DUTIES = tuple(range(-100, 101, 5))
+
+## Fraction of the top speed below which the wheel is considered stopped
+STALL_FRAC = 0.02
+
+## File step logs are stored in on the board's flash
+STEP_FILE = 'motor_steps.txt'
+
+## Duty cycles stepped through when logging the motor's step response, in percent
+STEP_DUTIES = (30, 0, 50, 0, 70, 0, 100, 0, -50, 0, -100, 0)
+
+class DutyTable:
+    """ Duty cycle <-> wheel velocity lookup table for one motor """
+
+    def __init__(self, duties=SWEEP_DUTIES, vels=None):
+        """ Create a lookup table
+
+        @param duties increasing duty cycles in percent
+        @param vels steady state velocities in ticks/ms at each duty cycle,
+               or None to start with an empty table to be filled by calibrate() """
+        self.duties = array.array('b', duties)
+        self.vels = array.array('f', vels if vels is not None else [0]*len(duties))
+        self.deadband_pos = 0
+        self.deadband_neg = 0
+        if vels is not None:
+            self.build()
+
+    def build(self):
+        """ Clean up measured velocities and find the deadband in each direction.
+        Velocities are forced to be monotonic so the table can be inverted. """
+        n = len(self.duties)
+        zero = 0
+        while zero < n - 1 and self.duties[zero] < 0:
+            zero += 1
+
+        top = max(abs(v) for v in self.vels)
+        stall = top*STALL_FRAC
+
+        for i in range(zero, n):
+            if abs(self.vels[i]) <= stall:
+                self.vels[i] = 0
+            elif i > zero and self.vels[i] < self.vels[i - 1]:
+                self.vels[i] = self.vels[i - 1]
+        for i in range(zero, -1, -1):
+            if abs(self.vels[i]) <= stall:
+                self.vels[i] = 0
+            elif i < zero and self.vels[i] > self.vels[i + 1]:
+                self.vels[i] = self.vels[i + 1]
+
+        # The deadband is the last duty cycle before the wheel starts turning
+        self.deadband_pos = 0
+        for i in range(zero, n):
+            if self.vels[i] != 0:
+                break
+            self.deadband_pos = self.duties[i]
+        self.deadband_neg = 0
+        for i in range(zero, -1, -1):
+            if self.vels[i] != 0:
+                break
+            self.deadband_neg = -self.duties[i]
+
+    def duty_for(self, vel):
+        """ Feedforward duty cycle expected to hold the wheel at a velocity
+
+        @param vel target velocity in ticks/ms
+        @return duty cycle in percent, including the deadband """
+        if vel == 0:
+            return 0
+        duties = self.duties
+        vels = self.vels
+        for i in range(1, len(duties)):
+            v0 = vels[i - 1]
+            v1 = vels[i]
+            if v0 <= vel <= v1 and v1 != v0:
+                return duties[i - 1] + (duties[i] - duties[i - 1])*(vel - v0)/(v1 - v0)
+        return duties[-1] if vel > 0 else duties[0]
+
+    def compensate(self, duty):
+        """ Stretch a duty cycle command over the range where the motor actually
+        moves, so small commands are not swallowed by static friction
+
+        @param duty commanded duty cycle in percent
+        @return duty cycle to apply to the motor """
+        if duty > 0:
+            return self.deadband_pos + duty*(100 - self.deadband_pos)/100
+        elif duty < 0:
+            return -self.deadband_neg + duty*(100 - self.deadband_neg)/100
+        return 0
+
+def calibrate(table, motor, enc, clock, settle_ms=300, sample_ms=200):
+    """ Generator which sweeps a motor through the table's duty cycles and stores
+    the measured steady state velocities in the table. It yields whenever it is
+    waiting on time to pass and returns once the sweep is done and the motor stopped.
+
+    @param table DutyTable to fill
+    @param motor object with a set_duty_cycle() method
+    @param enc object with a read() method returning encoder ticks
+    @param clock function returning the current time in ms, wrapping like utime.ticks_ms()
+    @param settle_ms time to wait at each duty cycle before measuring
+    @param sample_ms time over which the velocity is averaged """
+    for i in range(len(table.duties)):
+        motor.set_duty_cycle(table.duties[i])
+        start = clock()
+        while utime.ticks_diff(clock(), start) < settle_ms:
+            yield(0)
+
+        start = clock()
+        start_ticks = enc.read()
+        while utime.ticks_diff(clock(), start) < sample_ms:
+            yield(1)
+        table.vels[i] = (enc.read() - start_ticks)/utime.ticks_diff(clock(), start)
+
+    motor.set_duty_cycle(0)
+    table.build()
+
+def record_steps(log, motor, enc, clock, duties=STEP_DUTIES, hold_ms=600, sample_ms=5):
+    """ Generator which steps a motor through a series of duty cycles, appending
+    (time in ms, duty cycle, encoder ticks) for every sample to log, flattened so
+    log can be an array('i'). It yields whenever it is waiting on time to pass.
+
+    @param log list or array('i') to append samples to
+    @param motor object with a set_duty_cycle() method
+    @param enc object with a read() method returning encoder ticks
+    @param clock function returning the current time in ms, wrapping like utime.ticks_ms()
+    @param duties duty cycles to step through
+    @param hold_ms time to hold each duty cycle
+    @param sample_ms time between samples """
+    for duty in duties:
+        motor.set_duty_cycle(duty)
+        start = clock()
+        last = utime.ticks_add(start, -sample_ms)
+        while utime.ticks_diff(clock(), start) < hold_ms:
+            now = clock()
+            if utime.ticks_diff(now, last) >= sample_ms:
+                last = now
+                log.extend((now, duty, enc.read()))
+            yield(0)
+    motor.set_duty_cycle(0)
+
+def save_steps(log, path=STEP_FILE):
+    """ Store a log from record_steps() in a small text file """
+    with open(path, 'w') as f:
+        f.write('# time_ms,duty,ticks\n')
+        for i in range(0, len(log), 3):
+            f.write('{:d},{:d},{:d}\n'.format(log[i], log[i + 1], log[i + 2]))
+
+def save(left, right, path=CAL_FILE):
+    """ Store left and right calibration tables in a small text file """
+    with open(path, 'w') as f:
+        f.write('# duty,left,right\n')
+        for i in range(len(left.duties)):
+            f.write('{:d},{:.4f},{:.4f}\n'.format(left.duties[i], left.vels[i], right.vels[i]))
+
+def load(path=CAL_FILE):
+    """ Load calibration tables written by save()
+
+    @return (left, right) DutyTables, or (None, None) if no calibration is stored """
+    duties = []
+    left = []
+    right = []
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                d, l, r = line.split(',')
+                duties.append(int(d))
+                left.append(float(l))
+                right.append(float(r))
+    except (OSError, ValueError):
+        return None, None
+    if not duties:
+        return None, None
+    return DutyTable(duties, left), DutyTable(duties, right)
+
+def run(step_ms=10):
+    """ Calibrate both drive motors on the robot and save the result to flash.
+    The wheels must be free to spin. """
+    global Left
+    global Right
+
+    import encoder
+    import motor_driver
+
+    tables = []
+    for motor, enc in ((motor_driver.Left, encoder.Left), (motor_driver.Right, encoder.Right)):
+        table = DutyTable()
+        for _ in calibrate(table, motor, enc, utime.ticks_ms):
+            utime.sleep_ms(step_ms)
+        tables.append(table)
+        print('[CAL] deadband', table.deadband_neg, table.deadband_pos)
+
+    Left, Right = tables
+    save(Left, Right)
+
+def run_steps(step_ms=1):
+    """ Log the left drive motor's step response on the robot and save it to
+    flash. The wheels must be free to spin. """
+    import encoder
+    import motor_driver
+
+    log = array.array('i')
+    for _ in record_steps(log, motor_driver.Left, encoder.Left, utime.ticks_ms):
+        utime.sleep_ms(step_ms)
+    save_steps(log)
+    print('[CAL] logged', len(log)//3, 'samples')
+
+## Calibration tables for the SUMO bot drive motors, None if not calibrated
+Left, Right = load()
+
+if __name__ == '__main__':
+    import plant
+
+    table = DutyTable()
+    sim = plant.MotorPlant()
+    for _ in calibrate(table, sim, sim, sim.ticks_ms):
+        sim.advance(1)
+
+    print('duty   vel')
+    for i in range(len(table.duties)):
+        print('{: 4d} {: 7.3f}'.format(table.duties[i], table.vels[i]))
+    print('deadband', -table.deadband_neg, table.deadband_pos)
+    print('duty for 2.19 ticks/ms', table.duty_for(2.19))
@@ -1,58 +1,113 @@
-# -*- coding: utf-8 -*-
-
-##
-# @file motor_driver.py This file contains code for pwm based motor driving
-#
-# @author Josh Anderson
-# @author Ethan Czuppa
-
-import pyb
-
-class MotorDriver:
-    """ This class implements a PWM motor driver """
-    def __init__ (self, pin_en, pin_a, pin_b, tmr_num):
-        """ Creates a motor driver by initializing GPIOpins
-        and turning the motor off for safety.
-
-        @param pin_en pin used to enable motor controller
-        @param pin_a positive motor pin
-        @param pin_b negative motor pin
-        @param tmr_num timer number used to drive motor.
-               Must be compatible with chosen pins """
-
-        pin_en.init(pyb.Pin.OUT_PP)
-        pin_a.init(pyb.Pin.OUT_PP)
-        pin_b.init(pyb.Pin.OUT_PP)
-
-        # Enables motor controller channel
-        pin_en.high()
-
-        # Initializes Timer and sets and sets PWM pulse width
-        tmr = pyb.Timer(tmr_num, freq=20000)
-        self._tmr_ch1 = tmr.channel(1, pyb.Timer.PWM, pin=pin_a)
-        self._tmr_ch1.pulse_width_percent (0)
-        self._tmr_ch2 = tmr.channel(2, pyb.Timer.PWM, pin=pin_b)
-        self._tmr_ch2.pulse_width_percent(0)
-
-    def set_duty_cycle (self, level):
-        """ This method sets the duty cycle to be sent
-        to the motor to the given level. Positive values
-        cause torque in one direction, negative values
-        in the opposite direction.
-
-        @param level A signed integer holding the duty
-        cycle of the voltage sent to the motor """
-
-        # Appropriately sets PWM pulse width based on inputted level parameter
-        if level < 0:
-            self._tmr_ch1.pulse_width_percent(abs(level))
-            self._tmr_ch2.pulse_width_percent(0)
-        else:
-            self._tmr_ch1.pulse_width_percent(0)
-            self._tmr_ch2.pulse_width_percent(level)
-
-## SUMO Bot Left Motor
-Left = MotorDriver(pyb.Pin.board.PA10, pyb.Pin.board.PB4, pyb.Pin.board.PB5, 3)
-
-## SUMO Bot Right Motor
-Right = MotorDriver(pyb.Pin.board.PC1, pyb.Pin.board.PA0, pyb.Pin.board.PA1, 5)
+# -*- coding: utf-8 -*-
+
+##
+# @file motor_driver.py This file contains code for pwm based motor driving
+#
+# @author Josh Anderson
+# @author Ethan Czuppa
+
+import pyb
+
+class MotorDriver:
+    """ This class implements a PWM motor driver """
+    def __init__ (self, pin_en, pin_a, pin_b, tmr_num, max_slew=None):
+        """ Creates a motor driver by initializing GPIOpins
+        and turning the motor off for safety.
+
+        @param pin_en pin used to enable motor controller
+        @param pin_a positive motor pin
+        @param pin_b negative motor pin
+        @param tmr_num timer number used to drive motor.
+               Must be compatible with chosen pins
+        @param max_slew optional limit on how far the duty cycle may change,
+               in percent, per call to set_duty_cycle. Stopping, with a
+               duty cycle of 0, is never limited. """
+
+        pin_en.init(pyb.Pin.OUT_PP)
+        pin_a.init(pyb.Pin.OUT_PP)
+        pin_b.init(pyb.Pin.OUT_PP)
+
+        # Enables motor controller channel
+        pin_en.high()
+
+        # Initializes Timer and sets and sets PWM pulse width
+        tmr = pyb.Timer(tmr_num, freq=20000)
+        self._tmr_ch1 = tmr.channel(1, pyb.Timer.PWM, pin=pin_a)
+        self._tmr_ch1.pulse_width(0)
+        self._tmr_ch2 = tmr.channel(2, pyb.Timer.PWM, pin=pin_b)
+        self._tmr_ch2.pulse_width(0)
+
+        # Compare counts for a 100% duty cycle, so each update is a single
+        # multiply instead of pulse_width_percent's float math per channel
+        self._full_counts = tmr.period() + 1
+
+        # Last compare values written to each channel
+        self._cnt_a = 0
+        self._cnt_b = 0
+
+        ## Duty cycle most recently applied, after slew limiting
+        self.duty = 0
+
+        ## Maximum duty cycle change per update in percent, or None for no limit
+        self.max_slew = max_slew
+
+        ## Number of compare register writes actually made to the timer
+        self.writes = 0
+
+    def set_duty_cycle (self, level):
+        """ This method sets the duty cycle to be sent
+        to the motor to the given level. Positive values
+        cause torque in one direction, negative values
+        in the opposite direction. Channels whose compare
+        value would not change are not written. A level
+        of 0 stops the motor at once, whatever max_slew is.
+
+        @param level A signed integer holding the duty
+        cycle of the voltage sent to the motor """
+
+        if level > 100:
+            level = 100
+        elif level < -100:
+            level = -100
+
+        if self.max_slew is not None and level != 0:
+            if level > self.duty + self.max_slew:
+                level = self.duty + self.max_slew
+            elif level < self.duty - self.max_slew:
+                level = self.duty - self.max_slew
+        self.duty = level
+
+        # Appropriately sets PWM compare values based on inputted level parameter
+        if level < 0:
+            cnt_a = int(-level*self._full_counts) // 100
+            cnt_b = 0
+        else:
+            cnt_a = 0
+            cnt_b = int(level*self._full_counts) // 100
+
+        if cnt_a != self._cnt_a:
+            self._tmr_ch1.pulse_width(cnt_a)
+            self._cnt_a = cnt_a
+            self.writes += 1
+        if cnt_b != self._cnt_b:
+            self._tmr_ch2.pulse_width(cnt_b)
+            self._cnt_b = cnt_b
+            self.writes += 1
+
+    def __repr__ (self):
+        """ Diagnostic string with the current duty cycle and register write count """
+        return 'Motor duty {: 7.2f} writes {:d}'.format (self.duty, self.writes)
+
+def set_duty_cycles (left, right):
+    """ Update both drive motors in one call
+
+    @param left duty cycle for the left motor
+    @param right duty cycle for the right motor """
+    Left.set_duty_cycle(left)
+    Right.set_duty_cycle(right)
+
+## SUMO Bot Left Motor
+Left = MotorDriver(pyb.Pin.board.PA10, pyb.Pin.board.PB4, pyb.Pin.board.PB5, 3)
+
+## SUMO Bot Right Motor
+Right = MotorDriver(pyb.Pin.board.PC1, pyb.Pin.board.PA0, pyb.Pin.board.PA1, 5)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file plant.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Host side simulation of a SUMO bot drive motor and its encoder.
+#
+# The model is a first order system with a static friction deadband. The
+# simulated motor has the same set_duty_cycle() method as motor_driver.MotorDriver
+# and the same read() method as encoder.Encoder, so code written against the real
+# hardware objects can be exercised on a laptop.
+
+class MotorPlant:
+    """ First order DC motor and encoder model """
+
+    def __init__(self, gain=0.05, tau_ms=60.0, deadband=12.0, noise=0.0, rng=None):
+        """ Create a simulated motor at rest
+
+        @param gain steady state velocity in encoder ticks/ms per percent of
+               duty cycle above the deadband
+        @param tau_ms time constant of the motor and wheel in milliseconds
+        @param deadband duty cycle in percent needed to overcome static friction
+        @param noise standard deviation of velocity noise in ticks/ms
+        @param rng random.Random instance used for noise """
+        self.gain = gain
+        self.tau_ms = tau_ms
+        self.deadband = deadband
+        self.noise = noise
+        self._rng = rng
+
+        ## Duty cycle currently applied to the motor in percent
+        self.duty = 0
+        ## Wheel velocity in encoder ticks/ms
+        self.vel = 0.0
+        ## Wheel position in encoder ticks
+        self.pos = 0.0
+        ## Simulation time in milliseconds
+        self.time_ms = 0
+
+    def set_duty_cycle(self, level):
+        """ Apply a duty cycle, clamped to +/-100 percent like the motor driver """
+        if level > 100:
+            level = 100
+        elif level < -100:
+            level = -100
+        self.duty = level
+
+    def steady_state_vel(self, level):
+        """ Velocity in ticks/ms the motor settles at for a given duty cycle """
+        mag = abs(level) - self.deadband
+        if mag <= 0:
+            return 0.0
+        return self.gain*mag if level > 0 else -self.gain*mag
+
+    def advance(self, dt_ms):
+        """ Integrate the model forward in time
+
+        @param dt_ms time step in milliseconds """
+        target = self.steady_state_vel(self.duty)
+        if target == 0.0 and abs(self.vel) < self.gain:
+            # Static friction holds a slow wheel in place
+            self.vel = 0.0
+        else:
+            alpha = dt_ms/(self.tau_ms + dt_ms)
+            self.vel += alpha*(target - self.vel)
+        if self.noise and self._rng is not None:
+            self.vel += self._rng.gauss(0.0, self.noise)
+        self.pos += self.vel*dt_ms
+        self.time_ms += dt_ms
+
+    def read(self):
+        """ Encoder position in whole ticks """
+        return int(self.pos)
+
+    def zero(self):
+        """ Reset the encoder position to zero """
+        self.pos = 0.0
+
+    def ticks_ms(self):
+        """ Simulation clock, usable in place of utime.ticks_ms """
+        return self.time_ms
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file recorder.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Binary match recorder.
+#
+# The fusion task records every sensor input strategy consumes on each of its
+# runs: the time, encoder ticks, raw TOF distances, line flags and IR state,
+# along with the duty cycles and strategy state at the time for comparison.
+# Records go into a ring of preallocated arrays, one per column, so recording
+# is a handful of array stores with no allocation. Once the match is over the
+# ring is written to flash oldest record first, and match_replay.py on a laptop
+# feeds it back through the strategy and drive code.
+#
+# Each record is 24 bytes, so the default ring holds ~10 s at the fusion task's
+# 10 ms period in 24 kB of RAM. A full 30 s match would need 72 kB, more than
+# we can spare next to everything else, so the log keeps only the last ~10 s of
+# a longer match. The header records how many records were taken in all, and
+# match_replay.py warns when the start of a match was overwritten.
+
+import array
+import micropython
+import ustruct
+
+## Records kept in the ring, the last ~10 s of a match
+RECORDS = 1024
+
+## File the last match is written to on the board's flash
+LOG_FILE = 'match.bin'
+
+MAGIC = b'SUMO'
+VERSION = 1
+
+## Header: magic, version, number of columns, records in the file, records
+# taken during the match. The column typecodes follow it, then each column.
+HEADER = '<4sBBHI'
+
+## Record columns as (name, array typecode), in the order they are stored
+COLUMNS = (
+    ('time_ms', 'I'),
+    ('l_ticks', 'i'),
+    ('r_ticks', 'i'),
+    ('tof_l', 'H'),
+    ('tof_c', 'H'),
+    ('tof_r', 'H'),
+    ('line', 'B'),
+    ('ir_cmd', 'B'),
+    ('flags', 'B'),
+    ('duty_l', 'b'),
+    ('duty_r', 'b'),
+    ('state', 'B'),
+)
+
+## Bits in the flags column
+FLAG_TOF = 0x01         # the TOF task published a new frame since the last record
+FLAG_DRIVE = 0x02       # the drive task ran since the last record
+
+## State column value when no strategy is running
+NO_STATE = 255
+
+class Recorder:
+    """ Ring of fixed size match records """
+
+    def __init__(self, records=RECORDS):
+        self.records = records
+        self.time_ms = array.array('I', [0]*records)
+        self.l_ticks = array.array('i', [0]*records)
+        self.r_ticks = array.array('i', [0]*records)
+        self.tof_l = array.array('H', [0]*records)
+        self.tof_c = array.array('H', [0]*records)
+        self.tof_r = array.array('H', [0]*records)
+        self.line = bytearray(records)
+        self.ir_cmd = bytearray(records)
+        self.flags = bytearray(records)
+        self.duty_l = array.array('b', [0]*records)
+        self.duty_r = array.array('b', [0]*records)
+        self.state = bytearray(records)
+
+        ## Index the next record is written to
+        self.idx = 0
+        ## Records taken since the last clear(), including overwritten ones
+        self.count = 0
+        ## True once the current records have been written to flash, or there are none
+        self.saved = True
+
+    def clear(self):
+        self.idx = 0
+        self.count = 0
+        self.saved = True
+
+    @micropython.native
+    def record(self, time_ms, l_ticks, r_ticks, tof, line, ir_cmd, flags, duty_l, duty_r, state):
+        """ Store one record, overwriting the oldest once the ring is full
+
+        @param tof raw (left, center, right) TOF distances in mm
+        @param duty_l, duty_r duty cycles in percent, as integers """
+        i = self.idx
+        self.time_ms[i] = time_ms
+        self.l_ticks[i] = l_ticks
+        self.r_ticks[i] = r_ticks
+        self.tof_l[i] = tof[0]
+        self.tof_c[i] = tof[1]
+        self.tof_r[i] = tof[2]
+        self.line[i] = line
+        self.ir_cmd[i] = ir_cmd
+        self.flags[i] = flags
+        self.duty_l[i] = duty_l
+        self.duty_r[i] = duty_r
+        self.state[i] = state
+        i += 1
+        self.idx = i if i < self.records else 0
+        self.count += 1
+        self.saved = False
+
+    def save(self, path=LOG_FILE):
+        """ Write the records in the ring to flash, oldest first """
+        n = self.count if self.count < self.records else self.records
+        start = (self.idx - n) % self.records
+        codes = ''.join(code for _, code in COLUMNS)
+        try:
+            with open(path, 'wb') as f:
+                f.write(ustruct.pack(HEADER, MAGIC, VERSION, len(COLUMNS), n, self.count))
+                f.write(codes.encode())
+                for name, _ in COLUMNS:
+                    col = memoryview(getattr(self, name))
+                    if start + n <= self.records:
+                        f.write(col[start:start + n])
+                    else:
+                        f.write(col[start:])
+                        f.write(col[:start + n - self.records])
+        except OSError:
+            print('[REC] Could not save ' + path)
+            return
+        self.saved = True
+        print('[REC] Saved {:d} of {:d} records to {:s}'.format(n, self.count, path))
+
+## Recorder for the current match, filled by the fusion task
+Match = Recorder()
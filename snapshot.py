@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file snapshot.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Turns one run's worth of sensor readings into the strategy.SensorState
+# snapshot strategy decides from.
+#
+# The fusion task publishes through a Publisher on the robot, and match_sim.py
+# and match_replay.py publish through one on a laptop, so a simulated or
+# replayed strategy sees exactly what it would have seen on the robot. Nothing
+# here touches a sensor: callers read the encoders, TOF frame and line flags
+# their own way and hand the readings over.
+
+import bearing_lut
+import encoder
+import line_sensor
+
+## Millimeters per inch, for converting odometry for the opponent tracker
+MM_PER_IN = 25.4
+
+## Line sensors whose distance along the line is published, in line_sens order
+LINE_BITS = (line_sensor.FRONT_LEFT, line_sensor.FRONT_RIGHT)
+
+class Publisher:
+    """ Keeps an opponent tracker and the line distances up to date and
+    publishes them with the encoder states in a snapshot """
+
+    def __init__(self, snap, opponent, lut=None):
+        """ @param snap strategy.SensorState to update in place
+            @param opponent tracker.OpponentTracker to predict and correct
+            @param lut bearing_lut.BearingLut to find the opponent with, or None
+                   to use the weighted bearing formula """
+        self.snap = snap
+        self.opponent = opponent
+        self.lut = lut
+        # Left wheel distance in inches where each line sensor first saw the line
+        self._line_start = [None]*len(LINE_BITS)
+
+    def reset(self):
+        """ Forget the opponent and any line distances, e.g. between matches """
+        self.opponent.reset()
+        for i in range(len(self._line_start)):
+            self._line_start[i] = None
+
+    def publish(self, now, dt, l_enc, r_enc, last_l_enc, last_r_enc, tof, line_flags):
+        """ Update the snapshot from one run's readings and bump its version
+
+        @param now time of the readings in ms
+        @param dt time since the last publish in ms
+        @param l_enc, r_enc encoder.EncoderState of each wheel
+        @param last_l_enc, last_r_enc encoder states from the last publish, or
+               None on the first one
+        @param tof raw (left, center, right) distances of a TOF frame which
+               arrived since the last publish, or None if none did
+        @param line_flags bitmask of line sensors which see the line """
+        snap = self.snap
+        opponent = self.opponent
+
+        # Predict the opponent forward every run and correct it whenever the
+        # TOF task has published a new frame
+        if last_l_enc is not None:
+            d_left = l_enc.ticks - last_l_enc.ticks
+            d_right = r_enc.ticks - last_r_enc.ticks
+            opponent.predict(dt, encoder.ticks_to_deg((d_left - d_right)/2),
+                             encoder.ticks_to_in((d_left + d_right)/2)*MM_PER_IN)
+        if tof is not None:
+            opponent.correct(*bearing_lut.measure(self.lut, tof[0], tof[1], tof[2]))
+
+        line_start = self._line_start
+        if snap.line_reset:
+            snap.line_reset = False
+            for i in range(len(line_start)):
+                line_start[i] = None
+
+        line_sens = snap.line_sens
+        dist = encoder.ticks_to_in(l_enc.ticks)
+        for i in range(len(LINE_BITS)):
+            if line_flags & LINE_BITS[i]:
+                if line_start[i] is None:
+                    line_start[i] = dist
+                line_sens[i] = abs(dist - line_start[i])
+            else:
+                line_start[i] = None
+                line_sens[i] = 0
+
+        snap.l_enc = l_enc
+        snap.r_enc = r_enc
+        snap.enemy_vec = bearing_lut.ang_to_vec(opponent.bearing) if opponent.valid else None
+        snap.time_ms = now
+        snap.dt_ms = dt
+        snap.version += 1
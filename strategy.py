@@ -5,13 +5,11 @@
 # @author Josh Anderson
 # @author Ethan Czuppa
 
-import utime
-import line_sensor
 import drive
-import encoder
-import tof
 import ir
+import fsm
 
+## Strategy running the current match, picked from Strategies by the IR start command
 Strategy = None
 
 class SensorState:
@@ -22,101 +20,156 @@ class SensorState:
         self.l_enc = l_enc
         self.r_enc = r_enc
         self.enemy_vec = enemy_vec
+        ## Incremented each time the snapshot is published
+        self.version = 0
+        ## Set to have the publisher restart line distance measurements
+        self.line_reset = False
 
-def handler():
-    last_state = SensorState([0,0,0,0], None, None, None, utime.ticks_ms, 0)
-    last_lsens = [None, None, None, None]
+## Latest sensor snapshot, updated in place by the fusion task
+Snapshot = SensorState([0, 0, 0, 0], None, None, None, 0, 0)
 
+def handler():
+    """ Task which steps the running strategy once for every new sensor
+    snapshot. The sensors are all read by the fusion task, so each run only
+    makes a decision. """
+    global Strategy
 
-    last_l_enc, last_r_enc = encoder.read()
+    snap = Snapshot
+    version = snap.version
 
     while True:
         yield(0)
 
         if not ir.IR_STARTED:
-            drive.change_command(None)
-            Strategy.reset()
+            if Strategy is not None:
+                drive.change_command(None)
+                Strategy.reset()
+                Strategy = None
             continue
 
-        tof_ang = tof.read()
-        now = utime.ticks_ms()
+        if Strategy is None:
+            Strategy = Strategies.get(ir.Decoder.cmd, Strategies[ir.IR_START_CMD])
 
-        l_enc, r_enc = encoder.read(last_l_state=last_l_enc, last_r_state=last_r_enc)
-        last_l_enc = l_enc
-        last_r_enc = r_enc
+        if snap.version == version:
+            continue
+        version = snap.version
+
+        # If the strategy changes state, restart the line distance measurements
+        if Strategy.step(snap):
+            snap.line_reset = True
+
+class BasicStrategy(fsm.StateMachine):
+    """ Drive forward steering toward the opponent, and back off and turn away
+    whenever a front line sensor reaches the ring's edge """
+    NAME = 'Basic'
+
+    ## Distance in inches a front sensor has to travel over the line to count as a hit
+    LINE_IN = 1.1
+    ## Forward speed in inches per ms while seeking the opponent
+    FWD_SPEED = 0.014
+    ## Speed in inches per ms and distance in inches to back away from the line
+    BACKUP_SPEED = -0.018
+    BACKUP_IN = 6
+    ## Angle in degrees and maximum rate to turn away from the line
+    TURN_DEG = 125
+    TURN_RATE = 20
+
+    FORWARD = 0
+    ESCAPE = 1
+
+    STATES = (
+        ('forward', 'enter_forward', 'seek', (('line_hit', ESCAPE),)),
+        ('escape', 'enter_escape', None, (('escape_done', FORWARD), ('enemy_in_turn', FORWARD))),
+    )
 
-        state = SensorState([0,0,0,0], l_enc, r_enc, tof.ang_to_vec(tof_ang), 0, 0)
+    def __init__(self):
+        self._fwd_cmd = None
+        self.dir = 1
+        fsm.StateMachine.__init__(self)
 
-        if line_sensor.FrontLeft.read():
-            if last_lsens[0] is None:
-                last_lsens[0] = encoder.ticks_to_in(l_enc.ticks)
-            state.line_sens[0] = abs(encoder.ticks_to_in(l_enc.ticks) - last_lsens[0])
-        else:
-            last_lsens[0] = None
+    def reset(self):
+        self._fwd_cmd = None
+        fsm.StateMachine.reset(self)
 
-        if line_sensor.FrontRight.read():
-            if last_lsens[1] is None:
-                last_lsens[1] = encoder.ticks_to_in(l_enc.ticks)
-            state.line_sens[1] = abs(encoder.ticks_to_in(l_enc.ticks) - last_lsens[1])
-        else:
-            last_lsens[1] = None
+    # Entry and step actions
 
-        now = utime.ticks_ms()
-        state.time_ms = now
-        state.dt_ms = utime.ticks_diff(now, last_state.time_ms)
+    def enter_forward(self, sens_state):
+        if self._fwd_cmd is None:
+            self._fwd_cmd = drive.StraightVelocity(self.FWD_SPEED)
+        if drive.DriveCommand is not self._fwd_cmd:
+            drive.change_command(self._fwd_cmd)
 
-        # If the strategy state returns true, reset robot state
-        if Strategy.step(state):
-            encoder.reset()
-            last_lsens = [None, None, None, None]
+    def seek(self, sens_state):
+        self._fwd_cmd.seek(sens_state.enemy_vec)
 
+    def enter_escape(self, sens_state):
+        # Pick rotation direction based off of line sensor that trips
+        self.dir = 1
+        if sens_state.line_sens[0] < self.LINE_IN:
+            self.dir = -1
 
+        # Queue the whole escape so the drive task runs it back to back
+        # without stopping the motors between movements
+        self._fwd_cmd = drive.StraightVelocity(self.FWD_SPEED)
+        drive.change_command(drive.StraightVelocity(self.BACKUP_SPEED, dist_inches=self.BACKUP_IN))
+        drive.queue_command(drive.TurnAngle(self.dir*self.TURN_DEG, max_rate=self.TURN_RATE))
+        drive.queue_command(self._fwd_cmd)
 
-class BasicStrategy:
-    def __init__(self):
-        self.current_state = self.drive_forward_init
+    # Guards
 
-    def reset(self):
-        self.current_state = self.drive_forward_init
+    def line_hit(self, sens_state):
+        return sens_state.line_sens[0] >= self.LINE_IN or sens_state.line_sens[1] >= self.LINE_IN
 
-    def drive_forward_init(self, sens_state):
-        drive.change_command(drive.StraightVelocity(0.014))
-        self.current_state = self.drive_forward
-        return True
+    def escape_done(self, sens_state):
+        return drive.DriveCommand is self._fwd_cmd
 
-    def drive_forward(self, sens_state):
-        drive.DriveCommand.seek(sens_state.enemy_vec)
-        if sens_state.line_sens[0] < 1.1 and sens_state.line_sens[1] < 1.1:
-            return False
+    def enemy_in_turn(self, sens_state):
+        # Cut the turn short if the opponent shows up in front of us
+        return sens_state.enemy_vec is not None and isinstance(drive.DriveCommand, drive.TurnAngle)
 
-        # Pick rotation direction based off of line sensor that trips
-        self.dir = 1
-        if sens_state.line_sens[0] < 1.1:
-            self.dir = -1
+class SearchStrategy(BasicStrategy):
+    """ Spin in place until the opponent is seen, then charge it. Waits for
+    the opponent to come to us instead of driving blind across the ring. """
+    NAME = 'Search'
 
-        drive.change_command(drive.StraightVelocity(-0.018))
-        self.current_state = self.drive_backwards
-        return True
+    SEARCH = 0
+    CHARGE = 1
+    ESCAPE = 2
 
+    STATES = (
+        ('search', 'enter_search', None,
+            (('enemy_seen', CHARGE), ('line_hit', ESCAPE), ('spin_done', SEARCH))),
+        ('charge', 'enter_forward', 'seek', (('line_hit', ESCAPE), ('enemy_lost', SEARCH))),
+        ('escape', 'enter_escape', None, (('escape_done', SEARCH),)),
+    )
 
-    def drive_backwards(self, sens_state):
-        #print("[BACK]", encoder.ticks_to_in(sens_state.l_enc.ticks))
-        if encoder.ticks_to_in(sens_state.l_enc.ticks) > -6:
-            return False
-        drive.change_command(drive.TurnAngle(self.dir*125, max_rate=20))
-        self.current_state = self.turn_around
-        return True
+    def __init__(self):
+        self._spin_cmd = None
+        BasicStrategy.__init__(self)
 
+    def enter_search(self, sens_state):
+        self._spin_cmd = drive.TurnAngle(360, max_rate=10)
+        drive.change_command(self._spin_cmd)
 
-    def turn_around(self, sens_state):
-        if sens_state.enemy_vec is None and not drive.DriveCommand.complete(sens_state.l_enc):
-            return False
-        self.current_state = self.drive_forward_init
-        return False
+    def enter_forward(self, sens_state):
+        self._fwd_cmd = None
+        BasicStrategy.enter_forward(self, sens_state)
 
-    def step(self, sens_state):
-        return self.current_state(sens_state)
+    def enemy_seen(self, sens_state):
+        return sens_state.enemy_vec is not None
 
+    def enemy_lost(self, sens_state):
+        return sens_state.enemy_vec is None
 
+    def spin_done(self, sens_state):
+        return drive.DriveCommand is self._spin_cmd and \
+            self._spin_cmd.complete(sens_state.l_enc, sens_state.r_enc)
 
+## IR command for the search strategy, another button on the referee's remote
+SEARCH_CMD = 24
 
+## Strategies by the IR command which starts a match with them
+Strategies = {
+    ir.IR_START_CMD: BasicStrategy(),
+    SEARCH_CMD: SearchStrategy(),
+}
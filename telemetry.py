@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file telemetry.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Live telemetry over the USB serial port.
+#
+# A low priority task packs the wheel velocities and setpoints, duty cycles,
+# TOF bearing and strategy state into a fixed layout binary frame every run,
+# and the scheduler's run time and lateness counters for every task into
+# another every TASK_EVERY runs. Frames are packed into buffers allocated once
+# and written to the VCP without waiting. When the host isn't keeping up, the
+# rest of a partly written frame is finished on the next run and any frames
+# made in the meantime are dropped. Every frame carries a sequence number, so
+# the host can count the dropped ones.
+#
+# Each frame starts with the SYNC bytes, which never appear in the console's
+# ASCII text, so the host can pick frames out of a stream that also has print
+# output in it, and ends with a CRC-8 of everything before it, so the host can
+# throw out a frame that console output was written into the middle of and
+# look for the next one. telemetry_host.py decodes a stream into CSV.
+#
+# Frame layout, little endian:
+#   SYNC, type (B), payload length (B), sequence number (H), payload, CRC (B)
+#
+# FRAME_CONTROL payload, CONTROL_FMT:
+#   utime.ticks_ms() when the frame was made, left and right wheel velocity
+#   measured by the telemetry task and velocity setpoint in
+#   ticks/ms scaled by VEL_SCALE, left and right duty cycle in percent, TOF
+#   bearing in degrees scaled by ANG_SCALE, strategy state (NO_STATE if none)
+# FRAME_TASKS payload, TASK_FMT for each task in Tasks:
+#   runs, total run time in us, total lateness in us, slowest run in us and
+#   latest start in us, all since the task was created
+# FRAME_NAMES payload, ASCII, at most NAMES_MAX bytes:
+#   task names separated by ',', then '|', the running strategy's name, ':'
+#   and its state names separated by ','
+
+import micropython
+import pyb
+import ustruct
+import utime
+import bearing_lut
+import drive
+import encoder
+import motor_driver
+import strategy
+
+SYNC = b'\xa5\x5a'
+HEADER_FMT = '<2sBBH'
+HEADER_LEN = 6
+CRC_LEN = 1
+
+## CRC-8 polynomial, x^8 + x^2 + x + 1
+CRC_POLY = 0x07
+
+FRAME_CONTROL = 1
+FRAME_TASKS = 2
+FRAME_NAMES = 3
+
+CONTROL_FMT = '<IhhhhbbhB'
+TASK_FMT = '<IIIII'
+
+## Longest FRAME_NAMES payload, longer names are cut off
+NAMES_MAX = 240
+
+## Velocities are sent in ticks/ms times VEL_SCALE
+VEL_SCALE = 1000
+## TOF bearings are sent in degrees times ANG_SCALE
+ANG_SCALE = 10
+## Sent in place of a velocity setpoint or bearing that doesn't exist
+NO_VALUE = -32768
+## Sent in place of a state when no strategy is running
+NO_STATE = 255
+
+## Send the task counters every this many runs
+TASK_EVERY = 2
+## Send the names every this many runs, so a host which starts listening late learns them
+NAMES_EVERY = 50
+
+## Tasks whose counters are sent, set by main.py
+Tasks = ()
+
+## Set False to stop sending, e.g. to use the REPL
+Enabled = True
+
+## Frames made so far, including dropped ones
+Frames = 0
+## Frames dropped because the host wasn't keeping up
+Dropped = 0
+
+def _crc_table():
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc << 1) ^ CRC_POLY if crc & 0x80 else crc << 1
+        table[i] = crc & 0xff
+    return bytes(table)
+
+_CRC_TABLE = _crc_table()
+
+@micropython.native
+def crc8(buf, n):
+    """ CRC-8 of the first n bytes of buf """
+    table = _CRC_TABLE
+    crc = 0
+    for i in range(n):
+        crc = table[crc ^ buf[i]]
+    return crc
+
+def _clamp16(val):
+    if val > 32767:
+        return 32767
+    if val < -32767:
+        return -32767
+    return int(val)
+
+def _names():
+    """ Payload of a FRAME_NAMES frame for the tasks and running strategy """
+    names = ','.join(task.name for task in Tasks) + '|'
+    strat = strategy.Strategy
+    if strat is not None:
+        names += strat.NAME + ':' + ','.join(row[0] for row in strat.STATES)
+    return names.encode()[:NAMES_MAX]
+
+class _Link:
+    """ Writes frames to the VCP without waiting on it """
+
+    def __init__(self, vcp):
+        self.vcp = vcp
+        # Unsent end of a partly written frame
+        self.rest = None
+
+    def flush(self):
+        """ Try to finish writing a partly written frame
+
+        @return True if nothing is left to write """
+        if self.rest is not None:
+            n = self.vcp.write(self.rest)
+            if n is not None:
+                self.rest = self.rest[n:] if n < len(self.rest) else None
+        return self.rest is None
+
+    def skip(self):
+        """ Drop a frame which was due while the VCP was still busy """
+        global Frames
+        global Dropped
+
+        Frames += 1
+        Dropped += 1
+
+    def send(self, kind, buf):
+        """ Fill in a frame's header and CRC and write as much of it as the VCP will take
+
+        @param kind FRAME_ type
+        @param buf frame with HEADER_LEN bytes of space before the payload and
+               CRC_LEN after it """
+        global Frames
+        global Dropped
+
+        end = len(buf) - CRC_LEN
+        ustruct.pack_into(HEADER_FMT, buf, 0, SYNC, kind, end - HEADER_LEN, Frames & 0xffff)
+        buf[end] = crc8(buf, end)
+        Frames += 1
+        n = self.vcp.write(buf)
+        if n is None:
+            Dropped += 1
+        elif n < len(buf):
+            self.rest = memoryview(buf)[n:]
+
+def handler():
+    """ Task which sends telemetry frames over the USB serial port """
+    import tof
+
+    vcp = pyb.USB_VCP()
+    link = _Link(vcp)
+    control = bytearray(HEADER_LEN + ustruct.calcsize(CONTROL_FMT) + CRC_LEN)
+    task_size = ustruct.calcsize(TASK_FMT)
+    tasks = bytearray(HEADER_LEN + task_size*len(Tasks) + CRC_LEN)
+    names = None
+    names_strat = None
+    runs = 0
+    # Encoder states from the last run, for the wheel velocities. The fusion
+    # task's snapshot stops updating between matches, so read them here.
+    l_enc = r_enc = None
+
+    while True:
+        yield(0)
+        if not Enabled or not vcp.isconnected():
+            l_enc = None
+            continue
+
+        now = utime.ticks_ms()
+        l_vel = r_vel = 0
+        if l_enc is None:
+            l_enc, r_enc = encoder.read()
+        elif utime.ticks_diff(now, l_enc.time_ms) > 0:
+            l_enc, r_enc = encoder.read(l_enc, r_enc)
+            l_vel = _clamp16(l_enc.vel_ticks_ms*VEL_SCALE)
+            r_vel = _clamp16(r_enc.vel_ticks_ms*VEL_SCALE)
+
+        send_tasks = runs % TASK_EVERY == 0
+        runs += 1
+
+        # While the host is behind, drop this run's frames instead of packing
+        # over the one still being written
+        if not link.flush():
+            link.skip()
+            if send_tasks:
+                link.skip()
+            continue
+
+        l_set = r_set = NO_VALUE
+        cmd = drive.DriveCommand
+        if isinstance(cmd, drive.StraightVelocity):
+            l_set = _clamp16(cmd.left_vel*VEL_SCALE)
+            r_set = _clamp16(cmd.right_vel*VEL_SCALE)
+        ang = tof.TofAng
+        ang = NO_VALUE if ang is None else _clamp16(ang*bearing_lut.DEG_PER_UNIT*ANG_SCALE)
+        strat = strategy.Strategy
+        ustruct.pack_into(CONTROL_FMT, control, HEADER_LEN, now, l_vel, r_vel, l_set, r_set,
+                          int(motor_driver.Left.duty), int(motor_driver.Right.duty), ang,
+                          NO_STATE if strat is None else strat.state)
+        link.send(FRAME_CONTROL, control)
+
+        if send_tasks and link.rest is not None:
+            link.skip()
+        elif send_tasks:
+            offset = HEADER_LEN
+            for task in Tasks:
+                # cotask keeps its profile in the task's private counters
+                ustruct.pack_into(TASK_FMT, tasks, offset, task._runs, task._run_sum, task._late_sum,
+                                  task._slowest, task._latest)
+                offset += task_size
+            link.send(FRAME_TASKS, tasks)
+
+        # Names are resent now and then, and whenever another strategy starts
+        if link.rest is None and (names is None or strat is not names_strat or runs % NAMES_EVERY == 0):
+            if names is None or strat is not names_strat:
+                names_strat = strat
+                names = bytearray(HEADER_LEN) + _names() + bytearray(CRC_LEN)
+            link.send(FRAME_NAMES, names)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file telemetry_host.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Host side decoder for the robot's telemetry stream (see telemetry.py).
+#
+# Reads the stream from the robot's USB serial port, or from a capture of it
+# saved earlier with --raw, picks the frames out from between any console
+# output, and writes the control frames to CSV, one row per frame. Frames whose
+# CRC doesn't match, e.g. because console output landed in the middle of one,
+# are skipped along with the console output. The scheduler counters for each
+# task can go to a second CSV, one row per task per frame, stamped with the
+# time of the control frame sent before them. Gaps in the sequence numbers are
+# counted as lost frames.
+#
+# Run with:
+#   python telemetry_host.py /dev/ttyACM0 -o run.csv --tasks tasks.csv --raw run.bin
+#   python telemetry_host.py run.bin -o run.csv                    (a saved capture)
+#
+# Reading the serial port needs pyserial.
+
+import host_shims
+host_shims.install()
+
+import argparse
+import os
+import struct
+import sys
+import time
+
+import telemetry
+
+_CONTROL_LEN = struct.calcsize(telemetry.CONTROL_FMT)
+_TASK_LEN = struct.calcsize(telemetry.TASK_FMT)
+
+## Column names of the CSV written for control frames
+CONTROL_COLUMNS = ('seq', 'time_ms', 'vel_l', 'vel_r', 'set_l', 'set_r', 'duty_l', 'duty_r',
+                   'bearing', 'state', 'state_name')
+
+## Column names of the CSV written for task frames
+TASK_COLUMNS = ('seq', 'time_ms', 'task', 'runs', 'run_sum_us', 'late_sum_us', 'slowest_us', 'latest_us')
+
+class Control:
+    """ Decoded FRAME_CONTROL frame, in ticks/ms, percent and degrees. Setpoints
+    and the bearing are None when the robot didn't have one. """
+
+    def __init__(self, seq, vals):
+        self.seq = seq
+        time_ms, vel_l, vel_r, set_l, set_r, duty_l, duty_r, bearing, state = vals
+        self.time_ms = time_ms
+        self.vel_l = vel_l/telemetry.VEL_SCALE
+        self.vel_r = vel_r/telemetry.VEL_SCALE
+        self.set_l = None if set_l == telemetry.NO_VALUE else set_l/telemetry.VEL_SCALE
+        self.set_r = None if set_r == telemetry.NO_VALUE else set_r/telemetry.VEL_SCALE
+        self.duty_l = duty_l
+        self.duty_r = duty_r
+        self.bearing = None if bearing == telemetry.NO_VALUE else bearing/telemetry.ANG_SCALE
+        self.state = None if state == telemetry.NO_STATE else state
+
+class Decoder:
+    """ Picks telemetry frames out of a byte stream """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._seq = None
+
+        ## Task names from the newest FRAME_NAMES frame
+        self.task_names = []
+        ## Running strategy's name and state names from the newest FRAME_NAMES frame
+        self.strategy = ''
+        self.state_names = []
+        ## Newest Control frame
+        self.control = None
+
+        ## Frames decoded
+        self.frames = 0
+        ## Frames missing from the sequence numbers
+        self.lost = 0
+        ## Bytes of console output and damaged frames skipped
+        self.skipped = 0
+
+    def state_name(self, state):
+        if state is None or state >= len(self.state_names):
+            return ''
+        return self.state_names[state]
+
+    def _valid_len(self, kind, length):
+        if kind == telemetry.FRAME_CONTROL:
+            return length == _CONTROL_LEN
+        if kind == telemetry.FRAME_TASKS:
+            return 0 < length and length % _TASK_LEN == 0
+        return kind == telemetry.FRAME_NAMES and length <= telemetry.NAMES_MAX
+
+    def feed(self, data):
+        """ Decode the frames completed by some more of the stream
+
+        @return list of (kind, seq, frame). frame is a Control for FRAME_CONTROL,
+                a list of (runs, run_sum_us, late_sum_us, slowest_us, latest_us)
+                per task for FRAME_TASKS, and the names as a string for FRAME_NAMES """
+        buf = self._buf
+        buf += data
+        frames = []
+        pos = 0
+        while True:
+            start = buf.find(telemetry.SYNC, pos)
+            if start < 0:
+                # Keep a trailing first sync byte in case the rest is still coming
+                end = len(buf) - 1 if buf[-1:] == telemetry.SYNC[:1] else len(buf)
+                self.skipped += end - pos
+                pos = end
+                break
+            self.skipped += start - pos
+            if len(buf) - start < telemetry.HEADER_LEN:
+                pos = start
+                break
+            _, kind, length, seq = struct.unpack_from(telemetry.HEADER_FMT, buf, start)
+            if not self._valid_len(kind, length):
+                self.skipped += 1
+                pos = start + 1
+                continue
+            end = start + telemetry.HEADER_LEN + length + telemetry.CRC_LEN
+            if end > len(buf):
+                pos = start
+                break
+            raw = bytes(buf[start:end])
+            if telemetry.crc8(raw, len(raw) - telemetry.CRC_LEN) != raw[-1]:
+                # Not a frame after all, or a damaged one; look for the next
+                self.skipped += 1
+                pos = start + 1
+                continue
+            payload = raw[telemetry.HEADER_LEN:-telemetry.CRC_LEN]
+            pos = end
+
+            if self._seq is not None:
+                self.lost += (seq - self._seq - 1) & 0xffff
+            self._seq = seq
+            self.frames += 1
+
+            if kind == telemetry.FRAME_CONTROL:
+                frame = self.control = Control(seq, struct.unpack(telemetry.CONTROL_FMT, payload))
+            elif kind == telemetry.FRAME_TASKS:
+                frame = [struct.unpack_from(telemetry.TASK_FMT, payload, i)
+                         for i in range(0, length, _TASK_LEN)]
+            else:
+                frame = payload.decode('ascii', 'replace')
+                tasks, _, strat = frame.partition('|')
+                self.task_names = tasks.split(',') if tasks else []
+                self.strategy, _, states = strat.partition(':')
+                self.state_names = states.split(',') if states else []
+            frames.append((kind, seq, frame))
+        del buf[:pos]
+        return frames
+
+def open_stream(source):
+    """ Open a capture file, or the robot's serial port if source isn't a file
+
+    @return (stream, live) where stream is a binary file-like object whose
+            read() returns what has arrived, and live is True for a serial port """
+    if os.path.isfile(source):
+        return open(source, 'rb'), False
+    import serial
+    return serial.Serial(source, timeout=0.01), True
+
+def _fmt(val):
+    if val is None:
+        return ''
+    if isinstance(val, float):
+        return '{:.3f}'.format(val)
+    return str(val)
+
+def read_frames(stream, live, dec, raw=None, seconds=None, idle=False):
+    """ Generate decoded frames from a stream until a capture ends, a live
+    stream has been read for a number of seconds, or Ctrl-C
+
+    @param stream file-like object from open_stream()
+    @param live True if stream is a serial port, which may have nothing to read yet
+    @param dec Decoder to decode with
+    @param raw binary file a copy of the stream is saved to, or None
+    @param seconds how long to read a live stream for, or None for no limit
+    @param idle also generate None each time a read of a live stream times
+           out with nothing, so the caller can do something while it waits """
+    stop = None if seconds is None else time.monotonic() + seconds
+    try:
+        while stop is None or time.monotonic() < stop:
+            data = stream.read(4096)
+            if not data:
+                if live:
+                    if idle:
+                        yield None
+                    continue
+                return
+            if raw is not None:
+                raw.write(data)
+            for frame in dec.feed(data):
+                yield frame
+    except KeyboardInterrupt:
+        return
+
+def to_csv(stream, live, out, tasks_out=None, raw=None, seconds=None):
+    """ Decode a stream to CSV
+
+    @param out text file the control frames are written to
+    @param tasks_out text file the task frames are written to, or None
+    @return Decoder, for its counts """
+    dec = Decoder()
+    out.write(','.join(CONTROL_COLUMNS) + '\n')
+    if tasks_out is not None:
+        tasks_out.write(','.join(TASK_COLUMNS) + '\n')
+
+    # Decoder.control is the newest control frame in the whole chunk read, so
+    # keep the one sent before each task frame here
+    control = None
+    for kind, seq, frame in read_frames(stream, live, dec, raw, seconds):
+        if kind == telemetry.FRAME_CONTROL:
+            c = control = frame
+            out.write(','.join(_fmt(v) for v in (seq, c.time_ms, c.vel_l, c.vel_r, c.set_l, c.set_r,
+                c.duty_l, c.duty_r, c.bearing, c.state, dec.state_name(c.state))) + '\n')
+        elif kind == telemetry.FRAME_TASKS and tasks_out is not None:
+            time_ms = control.time_ms if control is not None else ''
+            for i, counts in enumerate(frame):
+                name = dec.task_names[i] if i < len(dec.task_names) else str(i)
+                tasks_out.write(','.join(_fmt(v) for v in (seq, time_ms, name) + counts) + '\n')
+    return dec
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decode the robot\'s telemetry stream to CSV')
+    parser.add_argument('source', help='serial port, e.g. /dev/ttyACM0 or COM3, or a saved capture')
+    parser.add_argument('-o', '--output', help='CSV file for control frames (default stdout)')
+    parser.add_argument('--tasks', help='CSV file for task scheduler counters')
+    parser.add_argument('--raw', help='also save the raw stream here, to decode again later')
+    parser.add_argument('--seconds', type=float, help='stop reading a serial port after this long')
+    args = parser.parse_args()
+
+    stream, live = open_stream(args.source)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    tasks_out = open(args.tasks, 'w') if args.tasks else None
+    raw = open(args.raw, 'wb') if args.raw else None
+    dec = to_csv(stream, live, out, tasks_out, raw, args.seconds)
+    for f in (out, tasks_out, raw):
+        if f is not None and f is not sys.stdout:
+            f.close()
+    print('{:d} frames, {:d} lost, {:d} bytes of console output skipped'.format(
+        dec.frames, dec.lost, dec.skipped), file=sys.stderr)
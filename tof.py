@@ -7,67 +7,326 @@
 #
 # Contains time of flight sensor code and sensor declaritions.
 
+import array
+import bearing_lut
 import VL53L0X
 import i2c
 import utime
 
+## File on flash the sensors' boot calibration is kept in. Delete it to
+# force a full calibration on the next boot.
+CAL_FILE = 'tof_cal.txt'
+
+## Ranging modes, as the timing budget of each back to back measurement in us
+MODE_FAST = 20000
+MODE_DEFAULT = 33000
+MODE_ACCURATE = 200000
 
 class TOF:
     """ Time of Flight Sensor Class """
 
-    def __init__(self, i2c):
+    def __init__(self, i2c, name=None, start=True):
         """ Initialize and start a TOF sensor on an i2c bus
         @param i2c Initialized I2C bus class
+        @param name name the sensor's calibration is stored under in CAL_FILE,
+               or None to always run a full calibration
+        @param start start continuous ranging right away. TofArray starts
+               its sensors itself so it can stagger them.
         """
-        self.sensor = VL53L0X.VL53L0X(i2c)
-        self.sensor.start()
+        self.name = name
+        self.bus = i2c
+        t_start = utime.ticks_ms()
+        cal = _Cal.get(name)
+        self.sensor = VL53L0X.VL53L0X(i2c, cal=cal)
+
+        ## Time in ms the sensor took to boot
+        self.boot_ms = utime.ticks_diff(utime.ticks_ms(), t_start)
+        ## True if the sensor booted from a stored calibration
+        self.cached = cal is not None and self.sensor.cal == cal
+
+        if name is not None and not self.cached:
+            _Cal[name] = self.sensor.cal
+            save_cal()
+
+        ## Inter-measurement period in ms used when ranging is started, 0 for back to back
+        self.period_ms = 0
+
+        if start:
+            self.start()
+
+        ## Most recent distance in mm, 0 if nothing is in range
+        self.dist = 0
+        ## Most recent distance in mm as reported by the sensor, without the
+        # range limit applied
+        self.raw = 0
+
+    def start(self):
+        """ Start continuous ranging with the configured period """
+        self.sensor.start(self.period_ms)
+
+    def set_timing(self, budget_us, period_ms=0):
+        """ Change the measurement timing budget and inter-measurement period.
+        The sensor is stopped while the budget changes and has to be started
+        again with start() afterwards.
+
+        @param budget_us timing budget per measurement in us, at least
+               VL53L0X.MIN_TIMING_BUDGET_US
+        @param period_ms time between measurements in ms for continuous timed
+               mode, or 0 for back to back measurements. Must be longer than the budget.
+        @return True if the new timing was accepted """
+        if period_ms and period_ms*1000 < budget_us:
+            return False
+        self.sensor.stop()
+        if not self.sensor.set_measurement_timing_budget(budget_us):
+            return False
+        self.period_ms = period_ms
+        return True
 
     def read(self):
-        """ Read distance in mm from sensors """
+        """ Read distance in mm from sensors, waiting for a measurement if needed """
         val = self.sensor.read()
+        self.raw = val
         if val > 1000:
             val = 0
+        self.dist = val
         return val
 
+    def poll(self):
+        """ Check the sensor for a new measurement without waiting for one
+
+        @return True if dist was updated """
+        if not self.sensor.poll():
+            return False
+        val = self.sensor.result()
+        self.raw = val
+        if val > 1000:
+            val = 0
+        self.dist = val
+        return True
+
+    def boot_report(self):
+        """ One line summary of how long the sensor took to come up """
+        stages = ' '.join('{:s} {:d}'.format(stage, ms) for stage, ms in self.sensor.boot_ms)
+        return '[TOF] {:s} boot {:d} ms{:s} ({:s})'.format(str(self.name), self.boot_ms,
+            ' cached' if self.cached else '', stages)
+
+def _valid_cal(cal):
+    """ Sanity check a stored calibration before it's handed to a sensor """
+    spad_count, is_aperture, vhv, phase = cal
+    return 0 < spad_count < 0x80 and is_aperture in (0, 1) and \
+        0 <= vhv < 0x100 and 0 <= phase < 0x80
+
+def load_cal():
+    """ Read stored sensor calibrations from CAL_FILE. Each line holds a sensor
+    name, its SPAD count, aperture flag, VHV setting and phase calibration,
+    followed by a checksum of the four numbers. Damaged lines are skipped.
+
+    @return dictionary of name to calibration tuple """
+    cals = {}
+    try:
+        with open(CAL_FILE) as f:
+            for line in f:
+                fields = line.strip().split(',')
+                if len(fields) != 6:
+                    continue
+                try:
+                    vals = [int(v) for v in fields[1:]]
+                except ValueError:
+                    continue
+                cal = (vals[0], bool(vals[1]), vals[2], vals[3])
+                if (sum(vals[:4]) & 0xff) == vals[4] and _valid_cal((vals[0], vals[1], vals[2], vals[3])):
+                    cals[fields[0]] = cal
+    except OSError:
+        pass
+    return cals
+
+def save_cal():
+    """ Write all known sensor calibrations to CAL_FILE """
+    try:
+        with open(CAL_FILE, 'w') as f:
+            for name, cal in _Cal.items():
+                vals = (cal[0], int(cal[1]), cal[2], cal[3])
+                f.write('{:s},{:d},{:d},{:d},{:d},{:d}\n'.format(name, vals[0], vals[1],
+                    vals[2], vals[3], sum(vals) & 0xff))
+    except OSError:
+        print('[TOF] Could not save calibration')
+
+# Sensor calibrations by name, loaded once at import
+_Cal = load_cal()
+
+class TofFrame:
+    """ Latest distances from a group of TOF sensors """
+
+    def __init__(self, n):
+        ## Distance in mm from each sensor, 0 if nothing is in range
+        self.dist = array.array('H', [0]*n)
+        ## Unclamped distance in mm from each sensor
+        self.raw = array.array('H', [0]*n)
+        ## Time in ms each sensor's distance was measured
+        self.stamp_ms = array.array('I', [0]*n)
+        ## Time in ms of the newest distance in the frame
+        self.time_ms = 0
+        ## Incremented every time any distance in the frame changes
+        self.seq = 0
+
+class TofArray:
+    """ Runs a group of TOF sensors in continuous mode and collects whichever
+    measurements are ready each time it is updated """
+
+    def __init__(self, sensors):
+        """ @param sensors TOF objects, in the order of their distances in the frame """
+        self._sensors = sensors
+        ## Frame holding the latest distance from each sensor
+        self.frame = TofFrame(len(sensors))
+
+        # Time in ms each sensor is due to be started, or None once running
+        self._start_at = [None]*len(sensors)
+        # Timing budget each sensor still has to be switched to, or None
+        self._budget = [None]*len(sensors)
+
+        ## Number of times a sensor refused a new ranging mode
+        self.mode_errors = 0
+
+    def start(self, stagger_ms=11):
+        """ Schedule continuous ranging to start on each sensor in turn.
+        Offsetting the starts spreads the sensors' measurements across the
+        ranging period, so they don't all fire and finish together and each
+        update only has a third of the results to collect. Sensors are started
+        by update(), so this does not wait.
+
+        @param stagger_ms delay between starting consecutive sensors """
+        now = utime.ticks_ms()
+        for i in range(len(self._sensors)):
+            self._start_at[i] = utime.ticks_add(now, i*stagger_ms)
+
+    def set_mode(self, mode):
+        """ Switch every sensor to a new ranging mode, for example MODE_FAST
+        while tracking an opponent, and restart them staggered across the new
+        period. Changing the timing means stopping and reconfiguring each
+        sensor, which update() does once it holds the sensor's bus, so this
+        does not touch the buses.
+
+        @param mode one of the MODE_ timing budgets """
+        for i in range(len(self._sensors)):
+            self._budget[i] = mode
+        self.start(mode // 1000 // len(self._sensors))
+
+    def update(self):
+        """ Poll every sensor once, without waiting on any of them. Sensors
+        whose bus is locked by another task are skipped until the next update.
+
+        @return True if the frame has new data """
+        frame = self.frame
+        now = utime.ticks_ms()
+        new = False
+        for i in range(len(self._sensors)):
+            sens = self._sensors[i]
+            if not sens.bus.lock(self):
+                continue
+            if self._budget[i] is not None:
+                if not sens.set_timing(self._budget[i]):
+                    self.mode_errors += 1
+                self._budget[i] = None
+            if self._start_at[i] is not None:
+                if utime.ticks_diff(now, self._start_at[i]) >= 0:
+                    sens.start()
+                    self._start_at[i] = None
+            elif sens.poll():
+                frame.dist[i] = sens.dist
+                frame.raw[i] = sens.raw
+                frame.stamp_ms[i] = now
+                new = True
+            sens.bus.release(self)
+        if new:
+            frame.time_ms = now
+            frame.seq += 1
+        return new
+
 TofAng = None
-TofLastRead = 0
 
-def read():
-    global TofAng
-    global TofLastRead
+## Ranging mode the TOF sensors are running in
+Mode = MODE_DEFAULT
 
-    now = utime.ticks_ms()
-    dt = now - TofLastRead
+# Ranging mode the TOF task should switch to on its next run
+_RequestedMode = MODE_DEFAULT
 
-    # Only return new value every 40 Ms
-    if dt < 100:
-        return TofAng
+def request_mode(mode):
+    """ Ask the TOF task to switch ranging mode, e.g. MODE_FAST while tracking
+    an opponent and MODE_DEFAULT while searching for one
 
-    l = Left.read()
-    c = Center.read()
-    r = Right.read()
-    sum = l + c + r
+    @param mode one of the MODE_ timing budgets """
+    global _RequestedMode
+    _RequestedMode = mode
 
-    TofLastRead = now
+## Calibrated bearing table, or None to use the weighted bearing formula
+Lut = bearing_lut.load()
 
-    if sum == 0:
-        TofAng = None
-        return None
+def frame_to_ang(frame):
+    """ Bearing to the opponent from a (left, center, right) frame on the
+    weighted formula's -20 to 20 scale, positive to the right, or None if
+    nothing is seen """
+    raw = frame.raw
+    return bearing_lut.measure(Lut, raw[0], raw[1], raw[2])[0]
 
-    TofAng = -20*(l/sum) + 20*(r/sum)
+def frame_to_range(frame):
+    """ Distance in mm to the closest object in a frame, or 0 if nothing is seen """
+    raw = frame.raw
+    return bearing_lut.measure(Lut, raw[0], raw[1], raw[2])[1]
+
+def handler():
+    """ Task which collects TOF results as they become ready and keeps the
+    opponent bearing up to date """
+    global TofAng
+    global Mode
+
+    while True:
+        yield(0)
+        if _RequestedMode != Mode:
+            Mode = _RequestedMode
+            Sensors.set_mode(Mode)
+
+        if Sensors.update():
+            TofAng = frame_to_ang(Sensors.frame)
+
+def calibrate_point(cal, bearing, range_mm, samples=20):
+    """ Calibration mode: record TOF frames with the opponent at a known position.
+    Waits for the sensors, so run it from the REPL with the scheduler stopped.
+    Once every position has been recorded, build and store the table with
+    cal.build().save() and reboot to start using it.
+
+    @param cal bearing_lut.Calibrator collecting the readings
+    @param bearing true bearing of the opponent in degrees, positive to the
+           right, or None to record what the sensors see with no opponent
+    @param range_mm true distance to the opponent in mm
+    @param samples number of frames to record """
+    seen = 0
+    while seen < samples:
+        if Sensors.update():
+            raw = Sensors.frame.raw
+            cal.add(raw[0], raw[1], raw[2], bearing, range_mm)
+            seen += 1
+
+def read():
+    """ Get the bearing to the opponent in degrees, or None if nothing is seen.
+    The TOF task keeps this up to date, so it never touches the I2C buses. """
     return TofAng
 
-def ang_to_vec(deg):
-    if deg is None:
-        return None
-    return deg/20.0
+ang_to_vec = bearing_lut.ang_to_vec
 
 
 ## Left Time of Flight Sensor
-Left = TOF(i2c.Bus1)
+Left = TOF(i2c.Bus1, 'left', start=False)
 
 ## Center Time of Flight Sensor
-Center = TOF(i2c.Bus2)
+Center = TOF(i2c.Bus2, 'center', start=False)
 
 ## Right Time of Flight Sensor
-Right = TOF(i2c.Bus3)
+Right = TOF(i2c.Bus3, 'right', start=False)
+
+print(Left.boot_report())
+print(Center.boot_report())
+print(Right.boot_report())
+
+## All three Time of Flight Sensors, publishing (left, center, right) frames
+Sensors = TofArray((Left, Center, Right))
+Sensors.start()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file tracker.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Opponent tracking filter.
+#
+# The TOF sensors only give a new opponent bearing every few tens of ms, while
+# strategy runs every 10 ms. OpponentTracker runs an alpha-beta filter on the
+# opponent's bearing and range: every strategy tick it predicts them forward,
+# taking our own rotation and forward motion from odometry into account, and
+# whenever a new TOF frame arrives it corrects the prediction with it.
+#
+# The bearing is kept on the same -20 to 20 scale tof.frame_to_ang() measures it
+# on, so our own rotation is converted onto that scale before it is applied.
+
+import bearing_lut
+
+## Bearing and range correction gains
+ALPHA = 0.5
+## Bearing rate and range rate correction gains
+BETA = 0.1
+
+## Time in ms without a detection before the opponent is considered lost
+LOST_MS = 300
+
+class OpponentTracker:
+    """ Alpha-beta filter for the opponent's bearing and range """
+
+    def __init__(self, alpha=ALPHA, beta=BETA, lost_ms=LOST_MS):
+        self.alpha = alpha
+        self.beta = beta
+        self.lost_ms = lost_ms
+        self.reset()
+
+    def reset(self):
+        """ Forget the opponent """
+        ## Bearing to the opponent on tof.frame_to_ang()'s scale, positive to the right
+        self.bearing = 0.0
+        ## Distance to the opponent in mm
+        self.range = 0.0
+        ## Rate the bearing changes from the opponent's own motion, in bearing units/ms
+        self.bearing_rate = 0.0
+        ## Rate the range changes from the opponent's own motion, in mm/ms
+        self.range_rate = 0.0
+        ## Our own forward speed in mm/ms from the last prediction
+        self.own_speed = 0.0
+        ## True while the opponent is being tracked
+        self.valid = False
+        # Time since the last detection in ms
+        self._since_meas = 0
+
+    def predict(self, dt_ms, d_heading_deg, d_forward_mm):
+        """ Move the estimate forward in time
+
+        @param dt_ms time since the last prediction in ms
+        @param d_heading_deg how far we turned clockwise since the last prediction
+        @param d_forward_mm how far we drove forward since the last prediction """
+        if dt_ms > 0:
+            self.own_speed = d_forward_mm/dt_ms
+        if not self.valid:
+            return
+        self._since_meas += dt_ms
+        if self._since_meas > self.lost_ms:
+            self.valid = False
+            return
+        self.bearing += self.bearing_rate*dt_ms - d_heading_deg/bearing_lut.DEG_PER_UNIT
+        self.range += self.range_rate*dt_ms - d_forward_mm
+        if self.range < 0:
+            self.range = 0.0
+
+    def correct(self, bearing, range_mm):
+        """ Correct the estimate with a new TOF measurement
+
+        @param bearing measured bearing from tof.frame_to_ang(), or None if nothing was detected
+        @param range_mm measured distance in mm """
+        if bearing is None:
+            return
+        dt = self._since_meas
+        self._since_meas = 0
+        if not self.valid or dt <= 0:
+            self.bearing = bearing
+            self.range = range_mm
+            self.bearing_rate = 0.0
+            self.range_rate = 0.0
+            self.valid = True
+            return
+
+        err_b = bearing - self.bearing
+        err_r = range_mm - self.range
+        self.bearing += self.alpha*err_b
+        self.range += self.alpha*err_r
+        self.bearing_rate += self.beta*err_b/dt
+        self.range_rate += self.beta*err_r/dt
+
+    def closing_speed(self):
+        """ Speed the gap to the opponent is closing at in mm/ms, counting both
+        our motion and theirs """
+        return self.own_speed - self.range_rate
+
+## Tracker for the opponent, updated by the fusion task
+Opponent = OpponentTracker()
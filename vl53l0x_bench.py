@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+##
+# @file vl53l0x_bench.py
+# @author Josh Anderson
+# @author Ethan Czuppa
+#
+# Host benchmark of the VL53L0X driver's measurement path.
+#
+# The sensor is replaced by a register file which always has a measurement
+# ready. Each read path is run against it and the I2C transactions, bytes on
+# the bus and heap bytes allocated per measurement are reported. The original
+# per-register path, which packs and unpacks through ustruct, is kept here as
+# the baseline. The timing budget and inter-measurement period are then set and
+# read back through the register file.
+#
+# Run with: python vl53l0x_bench.py
+
+import host_shims
+host_shims.install()
+
+import time
+import tracemalloc
+import VL53L0X
+
+class FakeVL53L0X:
+    """ I2C bus with a single VL53L0X shaped register file on it. Counts the
+    transactions and bytes which go through it. """
+
+    def __init__(self, range_mm=420):
+        self.regs = bytearray(256)
+        # SPAD info, VCSEL periods and timeouts close to the sensor's defaults
+        self.regs[0x83] = 0x01
+        self.regs[0x92] = 0x85
+        self.regs[0x50] = 0x06
+        self.regs[0x70] = 0x04
+        self.regs[0x46] = 0x25
+        self.regs[0x51:0x53] = b'\x00\x96'
+        self.regs[0x71:0x73] = b'\x01\xae'
+        self.regs[0xf8:0xfa] = b'\x00\x01'
+        self.regs[0xc0] = 0xee
+        self._readonly = (0x13, 0x1e, 0x1f, 0x46, 0x50, 0x51, 0x52, 0x70, 0x83, 0x92)
+        self.set_range(range_mm)
+        self.reset_counts()
+
+    def set_range(self, range_mm):
+        """ Make a measurement of range_mm ready """
+        self.regs[0x13] = 0x07
+        self.regs[0x1e] = range_mm >> 8
+        self.regs[0x1f] = range_mm & 0xff
+
+    def reset_counts(self):
+        self.transactions = 0
+        self.bytes = 0
+
+    def readfrom_mem(self, addr, reg, n):
+        self.transactions += 1
+        self.bytes += n
+        return bytes(self.regs[reg:reg + n])
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        self.transactions += 1
+        self.bytes += len(buf)
+        buf[:] = self.regs[reg:reg + len(buf)]
+
+    def writeto_mem(self, addr, reg, data):
+        self.transactions += 1
+        self.bytes += len(data)
+        if reg not in self._readonly:
+            self.regs[reg:reg + len(data)] = data
+
+def baseline_read(sensor):
+    """ Measurement path as it was, going through _register() for every access """
+    if sensor._register(VL53L0X._RESULT_INTERRUPT_STATUS) & 0x07:
+        value = sensor._register(VL53L0X._RESULT_RANGE_STATUS + 10, struct='>H')
+        sensor._register(VL53L0X._INTERRUPT_CLEAR, 0x01)
+        return value
+
+def poll_read(sensor):
+    """ poll() and result() with preallocated buffers """
+    if sensor.poll():
+        return sensor.result()
+
+def burst_read(sensor):
+    """ Status and range in a single burst read """
+    return sensor.poll_range()
+
+def measure(name, fun, sensor, dev, n=20000):
+    """ Time n measurements through fun and count bus traffic and the peak
+    heap bytes CPython allocates during one measurement """
+    dev.reset_counts()
+    fun(sensor)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    value = fun(sensor)
+    alloc = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    assert value == 420, value
+    txns = dev.transactions/2
+    nbytes = dev.bytes/2
+
+    start = time.perf_counter()
+    for _ in range(n):
+        fun(sensor)
+    us = (time.perf_counter() - start)*1e6/n
+
+    print('{:<10s}{: 8.1f}{: 8.1f}{: 10d}{: 10.2f}'.format(name, txns, nbytes, alloc, us))
+
+## Largest difference allowed between a timing budget set and read back, in
+# us, from rounding the final range timeout to whole macro periods
+BUDGET_TOLERANCE_US = 100
+
+def check_timing(sensor, dev):
+    """ Timing budgets round trip through the timeout registers, budgets
+    under the minimum are refused and the inter-measurement period is scaled
+    by the oscillator calibration into the full 32 bit register """
+    for budget_us in (VL53L0X.MIN_TIMING_BUDGET_US, 33000, 100000, 200000):
+        assert sensor.set_measurement_timing_budget(budget_us), budget_us
+        got = sensor.get_measurement_timing_budget()
+        print('budget {: 7d} us reads back {: 7d} us'.format(budget_us, got))
+        assert abs(got - budget_us) <= BUDGET_TOLERANCE_US, (budget_us, got)
+    assert not sensor.set_measurement_timing_budget(VL53L0X.MIN_TIMING_BUDGET_US - 1)
+    assert sensor.get_measurement_timing_budget() == got
+
+    dev.regs[0xf8:0xfa] = (3000).to_bytes(2, 'big')
+    sensor.set_inter_measurement_period(50)
+    period = int.from_bytes(dev.regs[0x04:0x08], 'big')
+    print('period 50 ms writes {:d} oscillator counts'.format(period))
+    assert period == 50*3000, period
+    dev.regs[0xf8:0xfa] = b'\x00\x01'
+
+if __name__ == '__main__':
+    dev = FakeVL53L0X()
+    sensor = VL53L0X.VL53L0X(dev)
+    print('boot: {:d} transactions, {:d} bytes'.format(dev.transactions, dev.bytes))
+    dev.reset_counts()
+    VL53L0X.VL53L0X(dev, cal=sensor.cal)
+    print('boot with stored calibration: {:d} transactions, {:d} bytes'.format(dev.transactions, dev.bytes))
+    print('PATH         TXNS   BYTES    HEAP B   US/READ')
+    for name, fun in (('baseline', baseline_read), ('poll', poll_read), ('burst', burst_read)):
+        measure(name, fun, sensor, dev)
+    check_timing(sensor, dev)